@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# Compiles the sample programs in programs/ and reports how the generated code
+# changes between optimization levels.
+
+import ctypes
+from base64 import b64encode
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Sequence
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+from compiler.__main__ import compile_to_assembly
+from compiler.assembler import assemble, assemble_and_get_executable
+from compiler.profile import read_profile
+
+programs_dir = Path(__file__).parent / "programs"
+
+# Standard input given to the programs when counting executed instructions
+program_inputs = {
+    "divisors": "2000\n",
+    "multiples": "1000\n",
+    "prime": "10007\n",
+}
+
+# Larger inputs for measuring the running time of the longer-running programs
+timing_inputs = {
+    "divisors": "300000000\n",
+    "multiples": "300000000\n",
+    "prime": "1000000007\n",
+}
+
+# Reads a count followed by that many integers and prints their sum, for measuring
+# the throughput of read_int on large inputs
+sum_program = """
+var n = read_int();
+var sum = 0;
+while n > 0 do {
+    sum = sum + read_int();
+    n = n - 1;
+}
+sum
+"""
+sum_input_sizes = [1000, 100000, 1000000]
+
+PTRACE_TRACEME = 0
+PTRACE_SINGLESTEP = 9
+PTRACE_SYSCALL = 24
+
+
+def measure_compile_time(
+    source_code: str, release: bool = False, repeats: int = 20
+) -> tuple[float, float]:
+    """Returns the median time of compiling the program at -O1 and of the part of
+    that spent assembling and linking, in seconds."""
+    totals = []
+    backends = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        assembly_code = compile_to_assembly(source_code, 1, release)
+        middle = time.perf_counter()
+        assemble_and_get_executable(assembly_code, strip=release)
+        end = time.perf_counter()
+        totals.append(end - start)
+        backends.append(end - middle)
+    return statistics.median(totals), statistics.median(backends)
+
+
+def count_instructions(assembly_code: str) -> int:
+    """Counts the lines of Assembly that are instructions, as opposed to
+    labels, directives, comments and blank lines."""
+    count = 0
+    for line in assembly_code.splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#") or line.startswith("."):
+            continue
+        if line.endswith(":"):
+            continue
+        count += 1
+    return count
+
+
+def count_executed_instructions(executable: str, input: str) -> int:
+    """Runs the program one instruction at a time under ptrace and counts the steps."""
+    return count_ptrace_stops(executable, input, PTRACE_SINGLESTEP)
+
+
+def count_syscalls(executable: str, input: str) -> int:
+    """Runs the program under ptrace and counts the system calls it makes."""
+    # The program stops when entering and when leaving each system call,
+    # except the last one, after which it stops by exiting.
+    return count_ptrace_stops(executable, input, PTRACE_SYSCALL) // 2
+
+
+def count_ptrace_stops(executable: str, input: str, request: int) -> int:
+    """Runs the program under ptrace, resuming it with the given request
+    every time it stops, and counts how many times it stops."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.ptrace.argtypes = [
+        ctypes.c_long,
+        ctypes.c_long,
+        ctypes.c_void_p,
+        ctypes.c_void_p,
+    ]
+    libc.ptrace.restype = ctypes.c_long
+
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write(input.encode())
+        stdin.seek(0)
+        pid = os.fork()
+        if pid == 0:
+            os.dup2(stdin.fileno(), 0)
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            libc.ptrace(PTRACE_TRACEME, 0, None, None)
+            os.execv(executable, [executable])
+
+    steps = 0
+    _, status = os.waitpid(pid, 0)
+    while os.WIFSTOPPED(status):
+        if libc.ptrace(request, pid, None, None) != 0:
+            raise OSError(ctypes.get_errno(), "ptrace failed")
+        _, status = os.waitpid(pid, 0)
+        steps += 1
+    return steps
+
+
+def measure_time(executable: str, input: str, repeats: int = 3) -> float:
+    """Returns the best wall-clock time of running the program, in seconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [executable], input=input.encode(), stdout=subprocess.DEVNULL, check=True
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+opt_levels = [0, 1, 2]
+
+
+def print_row(name: str, input: str, width: int, values: list[str]) -> None:
+    print(f"{name:<16}{input:>{width}}" + "".join(f"{v:>12}" for v in values))
+
+
+def changes(values: Sequence[float]) -> list[str]:
+    """Formats the change of each optimized level relative to -O0."""
+    return [f"{(v - values[0]) / values[0] * 100:.1f}%" for v in values[1:]]
+
+
+def main() -> int:
+    # Each table shows -O0, -O1 (linear scan register allocation) and -O2
+    # (graph coloring), followed by the change of -O1 and -O2 relative to -O0
+    headers = [f"-O{level}" for level in opt_levels] + [
+        f"-O{level} change" for level in opt_levels[1:]
+    ]
+    print("Instructions in the generated code")
+    print_row("program", "", 0, headers)
+    for path in sorted(programs_dir.glob("*.txt")):
+        source_code = path.read_text()
+        sizes = [
+            count_instructions(compile_to_assembly(source_code, opt_level))
+            for opt_level in opt_levels
+        ]
+        print_row(path.stem, "", 0, [str(n) for n in sizes] + changes(sizes))
+
+    print()
+    print("Compile time in milliseconds at -O1")
+    print(f"{'program':<16}{'total':>12}{'as + ld':>12}")
+    for path in sorted(programs_dir.glob("*.txt")):
+        total, backend = measure_compile_time(path.read_text())
+        print(f"{path.stem:<16}{total * 1000:>12.2f}{backend * 1000:>12.2f}")
+
+    print()
+    print("Debug and release builds at -O1, in bytes and milliseconds")
+    print(
+        f"{'program':<16}{'mode':>8}{'assembly':>12}{'executable':>12}"
+        f"{'base64':>12}{'compile':>12}"
+    )
+    for path in sorted(programs_dir.glob("*.txt")):
+        source_code = path.read_text()
+        for release in [False, True]:
+            assembly_code = compile_to_assembly(source_code, 1, release)
+            binary = assemble_and_get_executable(assembly_code, strip=release)
+            total, _ = measure_compile_time(source_code, release)
+            print(
+                f"{path.stem:<16}{'release' if release else 'debug':>8}"
+                f"{len(assembly_code):>12}{len(binary):>12}"
+                f"{len(b64encode(binary)):>12}{total * 1000:>12.2f}"
+            )
+
+    print()
+    print("Instructions executed, including the runtime library")
+    print_row("program", "input", 8, headers)
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as wd:
+        for path in sorted(programs_dir.glob("*.txt")):
+            source_code = path.read_text()
+            input = program_inputs.get(path.stem, "")
+            counts = []
+            for opt_level in opt_levels:
+                executable = os.path.join(wd, f"{path.stem}-O{opt_level}")
+                assemble(compile_to_assembly(source_code, opt_level), executable)
+                counts.append(count_executed_instructions(executable, input))
+            print_row(
+                path.stem,
+                input.strip(),
+                8,
+                [str(n) for n in counts] + changes(counts),
+            )
+
+        print()
+        print("System calls at -O1")
+        print(f"{'program':<16}{'input':>8}{'calls':>12}")
+        for path in sorted(programs_dir.glob("*.txt")):
+            input = program_inputs.get(path.stem, "")
+            calls = count_syscalls(os.path.join(wd, f"{path.stem}-O1"), input)
+            print(f"{path.stem:<16}{input.strip():>8}{calls:>12}")
+
+        print()
+        print("Running time in seconds")
+        print_row("program", "input", 12, headers)
+        for name, input in sorted(timing_inputs.items()):
+            times = [
+                measure_time(os.path.join(wd, f"{name}-O{opt_level}"), input)
+                for opt_level in opt_levels
+            ]
+            print_row(
+                name,
+                input.strip(),
+                12,
+                [f"{t:.3f}" for t in times] + changes(times),
+            )
+
+        print()
+        print("Profile-guided optimization, trained on the inputs above")
+        pgo_levels = [1, 2]
+        pgo_headers = [
+            header
+            for level in pgo_levels
+            for header in [f"-O{level}", f"-O{level} PGO", "change"]
+        ]
+        print("Instructions executed")
+        print_row("program", "input", 8, pgo_headers)
+        for path in sorted(programs_dir.glob("*.txt")):
+            source_code = path.read_text()
+            input = program_inputs.get(path.stem, "")
+            values = []
+            for opt_level in pgo_levels:
+                profile_file = os.path.join(wd, f"{path.stem}-O{opt_level}.profile")
+                instrumented = os.path.join(
+                    wd, f"{path.stem}-O{opt_level}-instrumented"
+                )
+                assemble(
+                    compile_to_assembly(
+                        source_code, opt_level, instrument=profile_file
+                    ),
+                    instrumented,
+                )
+                subprocess.run(
+                    [instrumented],
+                    input=input.encode(),
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+                executable = os.path.join(wd, f"{path.stem}-O{opt_level}-pgo")
+                assemble(
+                    compile_to_assembly(
+                        source_code, opt_level, profile=read_profile(profile_file)
+                    ),
+                    executable,
+                )
+                counts = [
+                    count_executed_instructions(
+                        os.path.join(wd, f"{path.stem}-O{opt_level}"), input
+                    ),
+                    count_executed_instructions(executable, input),
+                ]
+                values += [str(n) for n in counts] + changes(counts)
+            print_row(path.stem, input.strip(), 8, values)
+
+        print("Running time in seconds")
+        print_row("program", "input", 12, pgo_headers)
+        for name, input in sorted(timing_inputs.items()):
+            values = []
+            for opt_level in pgo_levels:
+                times = [
+                    measure_time(
+                        os.path.join(wd, f"{name}-O{opt_level}{suffix}"), input
+                    )
+                    for suffix in ["", "-pgo"]
+                ]
+                values += [f"{t:.3f}" for t in times] + changes(times)
+            print_row(name, input.strip(), 12, values)
+
+        print()
+        print("Reading input at -O1")
+        print(f"{'integers':<16}{'bytes':>12}{'calls':>12}{'seconds':>12}")
+        executable = os.path.join(wd, "sum-O1")
+        assemble(compile_to_assembly(sum_program, 1), executable)
+        for size in sum_input_sizes:
+            input = f"{size}\n" + "".join(f"{i * 7919 - 500000}\n" for i in range(size))
+            calls = count_syscalls(executable, input)
+            seconds = measure_time(executable, input)
+            print(f"{size:<16}{len(input):>12}{calls:>12}{seconds:>12.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@ from base64 import b64encode
 import json
 import re
 import sys
+from os import path
 from socketserver import ForkingTCPServer, StreamRequestHandler
 from traceback import format_exception
 from typing import Any
@@ -11,16 +12,43 @@ from compiler.tokenizer import tokenize
 from compiler.parser import parse
 from compiler.typechecker import typecheck
 from compiler.ir_generator import generate_ir
+from compiler.optimizer import optimize
 from compiler.assembly_generator import generate_assembly
 from compiler.ir import reserved_names
-from compiler.assembler import assemble_and_get_executable
-
-
-def call_compiler(source_code: str) -> bytes:
+from compiler.assembler import assemble, assemble_and_get_executable
+from compiler.profile import Profile, read_profile
+
+
+def call_compiler(source_code: str, opt_level: int = 1, release: bool = False) -> bytes:
+    return assemble_and_get_executable(
+        compile_to_assembly(source_code, opt_level, release), strip=release
+    )
+
+
+def compile_to_assembly(
+    source_code: str,
+    opt_level: int = 1,
+    release: bool = False,
+    source_file: str = "<stdin>",
+    instrument: str | None = None,
+    profile: Profile | None = None,
+) -> str:
+    """Compiles the program into Assembly code, with line info that refers
+    to `source_file`. In release mode the code has no comments or line info,
+    and the executable built from it no debug info or symbols.
+
+    With `instrument`, the program writes a profile to the file at that path
+    when it exits. A profile read from such a file guides the optimizations."""
     program = parse(tokenize(source_code))
     typecheck(program)
-    code = generate_assembly(generate_ir(program, reserved_names))
-    return assemble_and_get_executable(code)
+    return generate_assembly(
+        optimize(generate_ir(program, reserved_names), opt_level, profile),
+        opt_level,
+        comments=not release,
+        source_file=None if release else source_file,
+        instrument=instrument,
+        profile=profile,
+    )
 
 
 def main() -> int:
@@ -30,6 +58,10 @@ def main() -> int:
     output_file: str | None = None
     host = "127.0.0.1"
     port = 3000
+    opt_level = 1
+    release = False
+    instrument = False
+    profile_file: str | None = None
     for arg in sys.argv[1:]:
         if (m := re.fullmatch(r"--output=(.+)", arg)) is not None:
             output_file = m[1]
@@ -37,6 +69,14 @@ def main() -> int:
             host = m[1]
         elif (m := re.fullmatch(r"--port=(.+)", arg)) is not None:
             port = int(m[1])
+        elif (m := re.fullmatch(r"-O([012])", arg)) is not None:
+            opt_level = int(m[1])
+        elif arg == "--release":
+            release = True
+        elif arg == "--instrument":
+            instrument = True
+        elif (m := re.fullmatch(r"--profile-use=(.+)", arg)) is not None:
+            profile_file = m[1]
         elif arg.startswith("-"):
             raise Exception(f"Unknown argument: {arg}")
         elif command is None:
@@ -71,9 +111,23 @@ def main() -> int:
         source_code = read_source_code()
         if output_file is None:
             raise Exception("Output file flag --output=... required")
-        executable = call_compiler(source_code)
-        with open(output_file, "wb") as f:
-            f.write(executable)
+        assemble(
+            compile_to_assembly(
+                source_code,
+                opt_level,
+                release,
+                input_file or "<stdin>",
+                # The program writes its profile next to itself
+                instrument=(
+                    path.abspath(output_file + ".profile") if instrument else None
+                ),
+                profile=(
+                    read_profile(profile_file) if profile_file is not None else None
+                ),
+            ),
+            output_file,
+            strip=release,
+        )
     elif command == "serve":
         try:
             run_server(host, port)
@@ -95,7 +149,8 @@ def run_server(host: str, port: int) -> None:
                 input = json.loads(input_str)
                 if input["command"] == "compile":
                     source_code = input["code"]
-                    executable = call_compiler(source_code)
+                    release = bool(input.get("release", False))
+                    executable = call_compiler(source_code, release=release)
                     result["program"] = b64encode(executable).decode()
                 elif input["command"] == "ping":
                     pass
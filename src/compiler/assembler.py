@@ -1,3 +1,5 @@
+import hashlib
+import os
 import subprocess
 import tempfile
 from contextlib import nullcontext
@@ -5,6 +7,8 @@ from os import path
 from typing import Any, Callable, ContextManager, TypeVar
 import shutil
 from pathlib import Path
+from compiler.encoder import EncodingError, assemble_object
+from compiler.linker import LinkError, link
 
 T = TypeVar("T")
 
@@ -16,18 +20,24 @@ def assemble(
     tempfile_basename: str = "program",
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    strip: bool = False,
 ) -> None:
-    """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
+    """Generates an executable file from Assembly code.
 
+    The code is encoded and linked in-process when possible,
+    and with 'as' and 'ld' (or 'cc') otherwise.
+    With `strip`, the executable has no debug info or symbols.
     The file is written to the given path.
     """
     _assemble(
         assembly_code=assembly_code,
+        output_file=path.abspath(output_file),
         workdir=workdir,
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
-        take_output=lambda f: shutil.move(f, output_file),
+        strip=strip,
+        take_output=lambda f: None,
     )
 
 
@@ -37,77 +47,120 @@ def assemble_and_get_executable(
     tempfile_basename: str = "program",
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    strip: bool = False,
 ) -> bytes:
-    """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
+    """Generates an executable file from Assembly code, like `assemble`.
 
     The file is returned.
     """
     return _assemble(
         assembly_code=assembly_code,
+        output_file=None,
         workdir=workdir,
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
+        strip=strip,
         take_output=lambda f: Path(f).read_bytes(),
     )
 
 
 def _assemble(
     assembly_code: str,
+    output_file: str | None,
     workdir: str | None,
     tempfile_basename: str,
     link_with_c: bool,
     extra_libraries: list[str],
+    strip: bool,
     take_output: Callable[[str], T],
 ) -> T:
     if workdir is not None:
         wd = Path(workdir).absolute().as_posix()
         return _assemble_impl(
             assembly_code,
+            output_file or path.join(wd, "a.out"),
             wd,
             tempfile_basename,
             link_with_c,
             extra_libraries,
+            strip,
             take_output,
         )
     else:
-        with tempfile.TemporaryDirectory(prefix="compiler_") as wd:
+        with tempfile.TemporaryDirectory(prefix="compiler_", dir=_scratch_dir()) as wd:
             return _assemble_impl(
                 assembly_code,
+                output_file or path.join(wd, "a.out"),
                 wd,
                 tempfile_basename,
                 link_with_c,
                 extra_libraries,
+                strip,
                 take_output,
             )
 
 
+def _scratch_dir() -> str | None:
+    """Returns a directory in memory (tmpfs) for intermediate files, if there is one."""
+    if path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
 def _assemble_impl(
     assembly_code: str,
+    output_file: str,
     workdir: str,
     tempfile_basename: str,
     link_with_c: bool,
     extra_libraries: list[str],
+    strip: bool,
     take_output: Callable[[str], T],
 ) -> T:
-    stdlib_asm = path.join(workdir, "stdlib.s")
-    stdlib_obj = path.join(workdir, "stdlib.o")
-    program_asm = path.join(workdir, f"{tempfile_basename}.s")
     program_obj = path.join(workdir, f"{tempfile_basename}.o")
-    output_file = path.join(workdir, "a.out")
-
-    if link_with_c:
-        final_stdlib_asm_code = drop_start_symbol(stdlib_asm_code)
+    try:
+        object_code = assemble_object(assembly_code)
+    except EncodingError:
+        encoded = False
+        # Code outside the subset that the built-in encoder supports is piped
+        # to 'as', which runs while the standard library is looked up in the
+        # cache or, failing that, assembled alongside it.
+        debug_flags = [] if strip else ["-g"]
+        process = subprocess.Popen(
+            ["as", *debug_flags, "-o" + program_obj, "--"],
+            stdin=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            stdlib_obj = stdlib_object(workdir, link_with_c)
+        finally:
+            process.communicate(assembly_code)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        object_code = Path(program_obj).read_bytes()
     else:
-        final_stdlib_asm_code = stdlib_asm_code
-
-    with open(stdlib_asm, "w") as f:
-        f.write(final_stdlib_asm_code)
-    with open(program_asm, "w") as f:
-        f.write(assembly_code)
-    subprocess.run(["as", "-g", "-o" + stdlib_obj, stdlib_asm], check=True)
-    subprocess.run(["as", "-g", "-o" + program_obj, program_asm], check=True)
+        encoded = True
+        stdlib_obj = stdlib_object(workdir, link_with_c)
+
+    if not link_with_c and len(extra_libraries) == 0:
+        # Without libraries, the built-in linker does what 'ld' would
+        try:
+            executable = link([Path(stdlib_obj).read_bytes(), object_code], strip=strip)
+        except LinkError:
+            pass
+        else:
+            with open(output_file, "wb") as f:
+                f.write(executable)
+            os.chmod(output_file, 0o755)
+            return take_output(output_file)
+
+    if encoded:
+        with open(program_obj, "wb") as f:
+            f.write(object_code)
     linker_flags = ["-static", *[f"-l{lib}" for lib in extra_libraries]]
+    if strip:
+        linker_flags.append("-s")
     if link_with_c:
         # Linking with the C standard library correctly is complicated,
         # as evidenced by the complicated linker command shown by `cc -v something.c`.
@@ -125,6 +178,74 @@ def _assemble_impl(
     return take_output(output_file)
 
 
+def stdlib_object(workdir: str, link_with_c: bool) -> str:
+    """Returns the path of the standard library assembled into an object file.
+
+    The object file is cached in `stdlib_cache_dir()`, keyed by a hash of the
+    code and the assembler, so that it is assembled only once.
+    If the cache cannot be used, the object file is built in `workdir`.
+    """
+    if link_with_c:
+        code = drop_start_symbol(stdlib_asm_code)
+    else:
+        code = stdlib_asm_code
+    key = hashlib.sha256(f"{_assembler_identity()}\0{code}".encode()).hexdigest()
+    cache_dir = stdlib_cache_dir()
+    cached_obj = cache_dir / f"stdlib-{key[:32]}.o"
+    if _is_object_file(cached_obj):
+        return cached_obj.as_posix()
+
+    stdlib_asm = path.join(workdir, "stdlib.s")
+    stdlib_obj = path.join(workdir, "stdlib.o")
+    with open(stdlib_asm, "w") as f:
+        f.write(code)
+    subprocess.run(["as", "-g", "-o" + stdlib_obj, stdlib_asm], check=True)
+    try:
+        # Write under a temporary name first so that concurrent compilations
+        # never see a partially written file
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_obj = cache_dir / f"stdlib-{key[:32]}.{os.getpid()}.tmp"
+        shutil.copyfile(stdlib_obj, temp_obj)
+        os.replace(temp_obj, cached_obj)
+    except OSError:
+        pass
+    return stdlib_obj
+
+
+def stdlib_cache_dir() -> Path:
+    """Returns the directory for cached object files.
+
+    This is $COMPILER_CACHE_DIR if set, and otherwise 'compiler'
+    in the user's cache directory.
+    """
+    if "COMPILER_CACHE_DIR" in os.environ:
+        return Path(os.environ["COMPILER_CACHE_DIR"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return Path(cache_home) / "compiler"
+
+
+def _assembler_identity() -> str:
+    """Identifies the installed 'as' by its path, size and modification time.
+
+    Running 'as --version' would cost the subprocess that the cache saves,
+    but any upgrade of the assembler replaces the file and changes these.
+    """
+    executable = shutil.which("as")
+    if executable is None:
+        return ""
+    executable = path.realpath(executable)
+    stat = os.stat(executable)
+    return f"{executable}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _is_object_file(file: Path) -> bool:
+    try:
+        with open(file, "rb") as f:
+            return f.read(4) == b"\x7fELF"
+    except OSError:
+        return False
+
+
 def drop_start_symbol(code: str) -> str:
     return code.split("# BEGIN START")[0] + code.split("# END START")[1]
 
@@ -145,102 +266,174 @@ stdlib_asm_code: str = """
 
 _start:
     call main
+    call flush_output
     movq $60, %rax
     xorq %rdi, %rdi
     syscall
 # END START
 
+# When linked with C, the C library calls 'main' and then runs the functions
+# listed in '.fini_array' as the program exits.
+    .section .fini_array
+    .quad flush_output
+    .section .text
+
+# ***** Output buffering *****
+# print_int and print_bool collect their output in 'output_buffer'.
+# It is written out when it fills up, before read_int waits for input,
+# and when the program exits.
+
+OUTPUT_BUFFER_SIZE = 65536
+
+    .section .bss
+output_buffer:
+    .skip OUTPUT_BUFFER_SIZE
+output_used:
+    .skip 8              # Number of bytes in 'output_buffer'
+    .section .text
+
+# ***** Function 'flush_output' *****
+# Writes out and empties the output buffer.
+# Changes rax, rcx, rdx, rsi, rdi and r11.
+flush_output:
+    movq output_used(%rip), %rdx      # rdx = number of bytes
+    leaq output_buffer(%rip), %rsi    # rsi = pointer to them
+.Lflush_loop:
+    cmpq $0, %rdx
+    jle .Lflush_done
+    # Call syscall 'write', which may write only some of the bytes
+    movq $1, %rax        # rax = syscall number for write
+    movq $1, %rdi        # rdi = file handle for stdout
+    syscall
+    cmpq $0, %rax
+    jl .Lflush_done      # Give up on errors
+    addq %rax, %rsi
+    subq %rax, %rdx
+    jmp .Lflush_loop
+.Lflush_done:
+    movq $0, output_used(%rip)
+    ret
+
+# ***** Function 'buffer_output' *****
+# Appends rdx bytes starting at rsi to the output buffer,
+# flushing the buffer first if they do not fit.
+# Changes rax, rcx, rdx, rsi, rdi and r11.
+buffer_output:
+    movq output_used(%rip), %rax
+    addq %rdx, %rax
+    cmpq $OUTPUT_BUFFER_SIZE, %rax
+    jle .Lbuffer_fits
+    pushq %rsi
+    pushq %rdx
+    call flush_output
+    popq %rdx
+    popq %rsi
+.Lbuffer_fits:
+    leaq output_buffer(%rip), %rdi
+    addq output_used(%rip), %rdi      # rdi = end of the buffered output
+    addq %rdx, output_used(%rip)
+    movq %rdx, %rcx
+    rep movsb                         # Copy rcx bytes from rsi to rdi
+    ret
+
 # ***** Function 'print_int' *****
 # Prints a 64-bit signed integer followed by a newline.
 #
-# We'll build up the digits to print on the stack.
-# We generate the least significant digit first,
-# and the stack grows downward, so that works out nicely.
+# We'll build up the digits to print in a buffer on the stack,
+# from the end towards the beginning, two digits at a time.
 #
 # Algorithm:
-#     push(newline)
-#     if x < 0:
-#         negative = true
-#         x = -x
-#     while x > 0:
-#         push(digit for (x % 10))
-#         x = x / 10
-#     if negative:
-#         push(minus sign)
-#     syscall 'write' with pushed data
+#     put(newline)
+#     x = unsigned absolute value of the input
+#     while x >= 100:
+#         put(digit pair for (x % 100))
+#         x = x / 100
+#     if x >= 10:
+#         put(digit pair for x)
+#     else:
+#         put(digit for x)
+#     if the input was negative:
+#         put(minus sign)
+#     append the buffer to the output buffer
 #     return the original argument
 #
+# Dividing by 100 is done by multiplying with a fixed-point reciprocal,
+# since 'divq' is many times slower than 'mulq'. The absolute value of
+# the most negative integer is 2^63, which fits when taken as unsigned.
+#
 # Registers:
-# - rdi = our input number, which we divide down as we go
-# - rsp = stack pointer, pointing to the next character to emit.
-# - rbp = pointer to one after the last byte of our output (which grows downward)
-# - r9 = whether the number was negative
+# - rcx = the remaining unsigned absolute value, which we divide down as we go
+# - rsi = pointer to the first byte of output so far (which grows downward)
+# - rbp = pointer to one after the last byte of output
+# - r8 = pointer to 'digit_pairs'
+# - r9 = the reciprocal of 100
 # - r10 = a copy of the original input, so we can return it
-# - rax, rcx and rdx are used by intermediate computations
+# - rax, rdx, rdi and r11 are used by intermediate computations
 
 print_int:
     pushq %rbp               # Save previous stack frame pointer
     movq %rsp, %rbp          # Set stack frame pointer
+    subq $32, %rsp           # Reserve room for the output (at most 21 bytes)
     movq %rdi, %r10          # Back up original input
-    decq %rsp                # Point rsp at first byte of output
-                             # TODO: this non-alignment confuses debuggers. Use a different register?
 
     # Add newline as the last output byte
-    movb $10, (%rsp)         # ASCII newline = 10
-    decq %rsp
-
-    # Check for zero and negative cases
-    xorq %r9, %r9
-    xorq %rax, %rax
-    cmpq $0, %rdi
-    je .Ljust_zero
-    jge .Ldigit_loop
-    incq %r9  # If < 0, set %r9 to 1
-
-.Ldigit_loop:
-    cmpq $0, %rdi
-    je .Ldigits_done        # Loop done when input = 0
-
-    # Divide rdi by 10
-    movq %rdi, %rax
-    movq $10, %rcx
-    cqto
-    idivq %rcx               # Sets rax = quotient and rdx = remainder
-
-    movq %rax, %rdi          # The quotient becomes our remaining input
-    cmpq $0, %rdx            # If the remainder is negative (because the input is), negate it
-    jge .Lnot_negative
-    negq %rdx
+    leaq -1(%rbp), %rsi
+    movb $10, (%rsi)         # ASCII newline = 10
+
+    # Take the absolute value
+    movq %rdi, %rcx
+    testq %rcx, %rcx
+    jns .Lnot_negative
+    negq %rcx
 .Lnot_negative:
-    addq $48, %rdx           # ASCII '0' = 48. Add the remainder to get the correct digit.
-    movb %dl, (%rsp)         # Store the digit in the output
-    decq %rsp
-    jmp .Ldigit_loop
-
-.Ljust_zero:
-    movb $48, (%rsp)         # ASCII '0' = 48
-    decq %rsp
+    leaq digit_pairs(%rip), %r8
+    movabsq $0x28F5C28F5C28F5C3, %r9  # 2^66 / 100, rounded up
+
+.Lpair_loop:
+    cmpq $100, %rcx
+    jb .Lpairs_done          # Loop done when fewer than 3 digits remain
+
+    # Divide rcx by 100
+    movq %rcx, %rax
+    shrq $2, %rax
+    mulq %r9                 # rdx = (rcx / 4) * (2^66 / 100) / 2^64
+    shrq $2, %rdx            # rdx = rcx / 100
+    imulq $100, %rdx, %rax
+    subq %rax, %rcx          # rcx = rcx % 100
+
+    # Store the two digits of the remainder in the output
+    movzwl (%r8,%rcx,2), %eax
+    subq $2, %rsi
+    movw %ax, (%rsi)
+    movq %rdx, %rcx          # The quotient becomes our remaining input
+    jmp .Lpair_loop
+
+.Lpairs_done:
+    cmpq $10, %rcx
+    jb .Lone_digit
+    movzwl (%r8,%rcx,2), %eax
+    subq $2, %rsi
+    movw %ax, (%rsi)
+    jmp .Ldigits_done
+.Lone_digit:
+    addq $48, %rcx           # ASCII '0' = 48
+    decq %rsi
+    movb %cl, (%rsi)
 
 .Ldigits_done:
-
     # Add minus sign if negative
-    cmpq $0, %r9
-    je .Lminus_done
-    movb $45, (%rsp)         # ASCII '-' = 45
-    decq %rsp
+    testq %r10, %r10
+    jns .Lminus_done
+    decq %rsi
+    movb $45, (%rsi)         # ASCII '-' = 45
 .Lminus_done:
 
-    # Call syscall 'write'
-    movq $1, %rax            # rax = syscall number for write
-    movq $1, %rdi            # rdi = file handle for stdout
-    # rsi = pointer to message
-    movq %rsp, %rsi
-    incq %rsi
+    # Append the output to the buffer
+    # rsi = pointer to output
     # rdx = number of bytes
     movq %rbp, %rdx
-    subq %rsp, %rdx
-    decq %rdx
-    syscall
+    subq %rsi, %rdx
+    call buffer_output
 
     # Restore stack registers and return the original input
     movq %rbp, %rsp
@@ -248,6 +441,14 @@ print_int:
     movq %r10, %rax
     ret
 
+# The two ASCII digits of each number from 0 to 99
+digit_pairs:
+    .ascii "0001020304050607080910111213141516171819"
+    .ascii "2021222324252627282930313233343536373839"
+    .ascii "4041424344454647484950515253545556575859"
+    .ascii "6061626364656667686970717273747576777879"
+    .ascii "8081828384858687888990919293949596979899"
+
 
 # ***** Function 'print_bool' *****
 # Prints either 'true' or 'false', followed by a newline.
@@ -266,13 +467,11 @@ print_bool:
     movq $true_str_len, %rdx
 
 .Lwrite:
-    # Call syscall 'write'
-    movq $1, %rax            # rax = syscall number for write
-    movq $1, %rdi            # rdi = file handle for stdout
-    # rsi = pointer to message (already set above)
+    # Append the output to the buffer
+    # rsi = pointer to output (already set above)
     # rdx = number of bytes (already set above)
-    syscall
-    
+    call buffer_output
+
     # Restore stack registers and return the original input
     movq %rbp, %rsp
     popq %rbp
@@ -286,20 +485,33 @@ false_str:
     .ascii "false\\n"
 false_str_len = . - false_str
 
+# ***** Input buffering *****
+# read_int takes its input from 'input_buffer', which one 'read' syscall
+# refills when all of it has been consumed.
+
+INPUT_BUFFER_SIZE = 65536
+
+    .section .bss
+input_buffer:
+    .skip INPUT_BUFFER_SIZE
+input_position:
+    .skip 8              # Index of the next unread byte in 'input_buffer'
+input_end:
+    .skip 8              # Number of bytes in 'input_buffer'
+    .section .text
+
 # ***** Function 'read_int' *****
 # Reads an integer from stdin, skipping non-digit characters, until a newline.
 #
-# To avoid the complexity of buffering, it very inefficiently
-# makes a syscall to read each byte.
+# Buffered output is written out before refilling the input buffer,
+# so that it appears before the program waits for input.
 #
 # It crashes the program if input could not be read.
 read_int:
     pushq %rbp           # Save previous stack frame pointer
     movq %rsp, %rbp      # Set stack frame pointer
     pushq %r12           # Back up r12 since it's callee-saved
-    pushq $0             # Reserve space for input
-                         # (we only write the lowest byte,
-                         # but loading 64-bits at once is easier)
+    subq $8, %rsp        # Keep the stack aligned for calls
 
     xorq %r9, %r9        # Clear r9 - it'll store the minus sign
     xorq %r10, %r10      # Clear r10 - it'll accumulate our output
@@ -308,19 +520,27 @@ read_int:
 
     # Loop until a newline or end of input is encountered
 .Lloop:
-    # Call syscall 'read'
+    movq input_position(%rip), %rax
+    cmpq input_end(%rip), %rax
+    jl .Lno_error        # There are unread bytes in the buffer
+
+    call flush_output    # Changes rax, rcx, rdx, rsi, rdi and r11 only
+
+    # Call syscall 'read' to refill the buffer
     xorq %rax, %rax      # syscall number for read = 0
     xorq %rdi, %rdi      # file handle for stdin = 0
-    movq %rsp, %rsi      # rsi = pointer to buffer
-    movq $1, %rdx        # rdx = buffer size
+    leaq input_buffer(%rip), %rsi     # rsi = pointer to buffer
+    movq $INPUT_BUFFER_SIZE, %rdx     # rdx = buffer size
     syscall              # result in rax = number of bytes read,
-                         # or 0 on end of input, -1 on error
+                         # or 0 on end of input, negative on error
 
-    # Check return value: either -1, 0 or 1.
+    # Check return value
     cmpq $0, %rax
-    jg .Lno_error
     je .Lend_of_input
-    jmp .Lerror
+    jl .Lerror
+    movq %rax, input_end(%rip)
+    xorq %rax, %rax      # Start from the beginning of the buffer
+    jmp .Lno_error
 
 .Lend_of_input:
     cmpq $0, %r12
@@ -328,8 +548,12 @@ read_int:
     jmp .Lend            # Otherwise complete reading this input.
 
 .Lno_error:
+    # rax = position of the next byte in the buffer
+    leaq input_buffer(%rip), %rsi
+    movzbq (%rsi,%rax), %r8           # Load input byte to r8
+    incq %rax
+    movq %rax, input_position(%rip)
     incq %r12            # Increment input byte counter
-    movq (%rsp), %r8     # Load input byte to r8
 
     # If the input byte is 10 (newline), exit the loop
     cmpq $10, %r8
@@ -364,7 +588,7 @@ read_int:
     neg %r10
 .Lfinal_negation_done:
     # Restore stack registers and return the result
-    popq %r12
+    movq -8(%rbp), %r12
     movq %rbp, %rsp
     popq %rbp
     movq %r10, %rax
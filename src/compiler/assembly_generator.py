@@ -1,15 +1,56 @@
 from compiler import ir
+from compiler.token import Location
 from dataclasses import fields
-from compiler.intrinsics import all_intrinsics, IntrinsicArgs
+from compiler.intrinsics import (
+    all_intrinsics,
+    IntrinsicArgs,
+    comparison_jumps,
+    swapped_comparisons,
+    immediate_operands,
+    is_immediate,
+    is_register,
+)
+from compiler.cfg import (
+    ControlFlowGraph,
+    build_cfg,
+    labels_at,
+    natural_loops,
+    used_vars,
+    is_local,
+    constant_vars,
+)
+from compiler.profile import Profile, block_locations, profile_magic
+from compiler.register_allocator import (
+    RegisterAllocation,
+    allocate_registers,
+    color_registers,
+)
+
+# Functions that call nothing may use this many bytes below the stack pointer
+red_zone_size = 128
+
+# With a profile, blocks running this many times less often than the block
+# before them are moved out of the way of the common path
+cold_block_ratio = 8
 
 
 class Locals:
-    """Knows the memory location of every local variable."""
+    """Knows the memory location or register of every local variable."""
 
     _var_to_location: dict[ir.IRVar, str]
     _stack_used: int
+    _save_slots: dict[str, str]
 
-    def __init__(self, variables: list[ir.IRVar]) -> None:
+    def __init__(
+        self,
+        variables: list[ir.IRVar],
+        allocation: RegisterAllocation | None = None,
+        frame_pointer: bool = True,
+    ) -> None:
+        """Without a frame pointer, the variables are stored below the stack pointer."""
+        base = "%rbp" if frame_pointer else "%rsp"
+        # Where the stack arguments are, past the return address and the saved %rbp
+        first_stack_arg = 16 if frame_pointer else 8
         self._var_to_location = {
             ir.IRVar("print_int"): "print_int(%rip)",
             ir.IRVar("print_bool"): "print_bool(%rip)",
@@ -23,21 +64,51 @@ class Locals:
             ir.IRVar("%r9"): "%r9",
             ir.IRVar("unit"): "%rax",
         }
-        current = 0
+        if allocation is None:
+            allocation = RegisterAllocation()
+        # Variables sharing stack slots come first, then those with a slot of their own
+        current = -8 * (max(allocation.stack_slots.values(), default=-1) + 1)
         for var in variables:
             if var not in self._var_to_location:
-                if var.name[0] == "X":
+                if var in allocation.registers:
+                    self._var_to_location[var] = allocation.registers[var]
+                elif var in allocation.stack_slots:
+                    slot = allocation.stack_slots[var]
+                    self._var_to_location[var] = f"{-8 * (slot + 1)}({base})"
+                elif var.name[0] == "X":
                     current -= 8
-                    self._var_to_location[var] = f"{current}(%rbp)"
+                    self._var_to_location[var] = f"{current}({base})"
+                elif is_immediate(var.name):
+                    self._var_to_location[var] = var.name
+                elif var.name.startswith("%arg"):
+                    index = int(var.name[4:]) - len(ir.argument_registers)
+                    self._var_to_location[var] = (
+                        f"{first_stack_arg + 8 * index}({base})"
+                    )
                 else:
                     self._var_to_location[var] = f"{var.name}(%rip)"
-        self._stack_used = -current
+
+        # Registers whose values are saved in the stack frame while they are used for other things
+        self._save_slots = {}
+        saved = set(allocation.callee_saved)
+        for registers in allocation.saved_at_calls.values():
+            saved.update(registers)
+        for register in sorted(saved):
+            current -= 8
+            self._save_slots[register] = f"{current}({base})"
+        # Calls require the stack pointer to be a multiple of 16. It is when the
+        # return address and the saved %rbp have been pushed, so keep it that way.
+        self._stack_used = -current + (-current) % 16
 
     def get_ref(self, v: ir.IRVar) -> str:
-        """Returns an Assembly reference like `-24(%rbp)`
-        for the memory location that stores the given variable"""
+        """Returns an Assembly reference like `-24(%rbp)` or `%rbx`
+        for the memory location or register that stores the given variable"""
         return self._var_to_location[v]
 
+    def save_slot(self, register: str) -> str:
+        """Returns the memory location where the value of a register is saved."""
+        return self._save_slots[register]
+
     def stack_used(self) -> int:
         """Returns the number of bytes of stack space needed for the local variables."""
         return self._stack_used
@@ -64,7 +135,160 @@ def get_all_ir_variables(instructions: list[ir.Instruction]) -> list[ir.IRVar]:
     return result_list
 
 
-def generate_assembly(function_instructions: dict[str, list[ir.Instruction]]) -> str:
+def layout_blocks(
+    instructions: list[ir.Instruction], profile: Profile | None = None
+) -> list[ir.Instruction]:
+    """Reorders the basic blocks so that fewer jumps are executed.
+
+    The condition at the top of a loop is moved below the loop body, so that
+    each iteration ends with one conditional jump back to the body instead of a
+    jump to the condition followed by a conditional jump past the loop.
+    With a profile, blocks that rarely run are moved to the end of the function,
+    so that the code around them falls through to the more common path."""
+    cfg = build_cfg(instructions)
+    order = list(range(len(cfg.blocks)))
+    for loop in natural_loops(cfg):
+        header = cfg.blocks[loop.header]
+        start = order.index(loop.header)
+        span = order[start : start + len(loop.blocks)]
+        if set(span) != loop.blocks or len(span) < 2:
+            continue
+        if start == 0:
+            # The function starts at the header, so it must stay in front
+            continue
+        first, last = header.instructions[0], cfg.blocks[span[-1]].instructions[-1]
+        if not (
+            isinstance(header.instructions[-1], ir.CondJump)
+            and isinstance(first, ir.Label)
+            and isinstance(last, ir.Jump)
+            and last.label.name == first.name
+        ):
+            continue
+        order[start : start + len(span)] = span[1:] + span[:1]
+    if profile is not None:
+        order = _move_cold_blocks(cfg, order, profile)
+
+    result: list[ir.Instruction] = []
+    for i, b in enumerate(order):
+        block = cfg.blocks[b]
+        result.extend(block.instructions)
+        last_insn = block.instructions[-1] if len(block.instructions) != 0 else None
+        if isinstance(last_insn, (ir.Jump, ir.CondJump, ir.TailCall)):
+            continue
+        if b + 1 < len(cfg.blocks) and (i + 1 == len(order) or order[i + 1] != b + 1):
+            # The block used to fall through to the next one
+            next_label = cfg.blocks[b + 1].instructions[0]
+            assert isinstance(next_label, ir.Label)
+            result.append(ir.Jump(next_label, loc=next_label.loc))
+    return result
+
+
+def _move_cold_blocks(
+    cfg: ControlFlowGraph, order: list[int], profile: Profile
+) -> list[int]:
+    """Moves the blocks that run less than `1 / cold_block_ratio` times as often as
+    their most common predecessor after the other blocks, but before a last block
+    that falls off the end of the function. Loop exits are not moved."""
+    counts = [profile.block_count(block.instructions) for block in cfg.blocks]
+    loops = natural_loops(cfg)
+    last = order[-1]
+    last_insn = cfg.blocks[last].instructions[-1:]
+    falls_off = not any(
+        isinstance(insn, (ir.Jump, ir.CondJump, ir.TailCall)) for insn in last_insn
+    )
+    cold: set[int] = set()
+    for b, block in enumerate(cfg.blocks):
+        count = counts[b]
+        if b == 0 or count is None or (falls_off and b == last):
+            continue
+        predecessor_counts = [
+            c
+            for p in block.predecessors
+            if (c := counts[p]) is not None
+            and not any(p in loop.blocks and b not in loop.blocks for loop in loops)
+        ]
+        if count * cold_block_ratio < max(predecessor_counts, default=0):
+            cold.add(b)
+    if len(cold) == 0:
+        return order
+    hot = [b for b in order if b not in cold]
+    cold_order = [b for b in order if b in cold]
+    if falls_off:
+        return hot[:-1] + cold_order + hot[-1:]
+    return hot + cold_order
+
+
+def select_immediates(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Replaces variables holding a constant with immediate operands like `$5`
+    where the instruction reading them accepts one, and removes the constants
+    that are then no longer read from a variable.
+
+    Operations can then use forms like `addq $1, %rsi` and `cmpq $100, %rdi`."""
+
+    constants = {
+        v: value
+        for v, value in constant_vars(instructions).items()
+        if -(2**31) <= value < 2**31
+    }
+
+    def immediate(v: ir.IRVar) -> ir.IRVar:
+        return ir.IRVar(f"${constants[v]}") if v in constants else v
+
+    result: list[ir.Instruction] = []
+    for insn in instructions:
+        match insn:
+            case ir.Copy():
+                insn = ir.Copy(immediate(insn.source), insn.dest, loc=insn.loc)
+            case ir.Call() if insn.fun.name in all_intrinsics:
+                positions = immediate_operands[insn.fun.name]
+                args = [
+                    immediate(arg) if i in positions else arg
+                    for i, arg in enumerate(insn.args)
+                ]
+                if not all(is_immediate(arg.name) for arg in args):
+                    insn = ir.Call(insn.fun, args, insn.dest, loc=insn.loc)
+            case ir.Call():
+                args = [immediate(arg) for arg in insn.args]
+                insn = ir.Call(insn.fun, args, insn.dest, loc=insn.loc)
+            case ir.TailCall():
+                args = [immediate(arg) for arg in insn.args]
+                insn = ir.TailCall(insn.fun, args, loc=insn.loc)
+        result.append(insn)
+
+    still_read = {v for insn in result for v in used_vars(insn)}
+    return [
+        insn
+        for insn in result
+        if not (isinstance(insn, ir.LoadIntConst) and insn.dest not in still_read)
+    ]
+
+
+def generate_assembly(
+    function_instructions: dict[str, list[ir.Instruction]],
+    opt_level: int = 1,
+    comments: bool = True,
+    source_file: str | None = None,
+    instrument: str | None = None,
+    profile: Profile | None = None,
+) -> str:
+    """Returns the Assembly code for the functions.
+
+    Optimization level 0 keeps every variable in the stack frame and translates
+    each IR instruction on its own. Level 1 keeps variables in registers, lays out
+    blocks to fall through to each other and compares and branches without
+    storing the result of the comparison. It calls known functions directly and
+    leaves out the stack frame of functions that call nothing, keeping their
+    variables in the red zone below the stack pointer. Level 2 chooses the
+    registers by graph coloring, which takes longer but spills and copies less.
+
+    With `comments`, each IR instruction is written as a comment before its code.
+    With `source_file`, '.loc' directives map the code to the lines of the source
+    file, so that debuggers and profilers like 'perf' can show them.
+
+    With `instrument`, the code counts how many times each basic block runs
+    and writes the counts to the file at that path when `main` returns. The
+    resulting profile can then guide the block layout and, at level 2, which
+    variables are kept in registers."""
     lines = []
 
     def emit(line: str) -> None:
@@ -75,82 +299,403 @@ def generate_assembly(function_instructions: dict[str, list[ir.Instruction]]) ->
         ".extern print_bool",
         ".extern read_int",
         ".global main",
-        ".type main, @function",
         ".section .text",
         "",
     ]
+    if source_file is not None:
+        initial_decl.insert(0, f".file 1 {_quote(source_file)}")
     for decl in initial_decl:
         emit(decl)
 
+    # For each block counter, the source locations of its block
+    counted_locations: list[list[tuple[int, int]]] = []
+
     for fun in function_instructions.keys():
         instructions = function_instructions[fun]
-        locals = Locals(variables=get_all_ir_variables(instructions))
-        emit(f"{fun}:")
-        emit("pushq %rbp")
-        emit("movq %rsp, %rbp")
-        emit(f"subq ${locals._stack_used}, %rsp")
+        if opt_level >= 2:
+            instructions = select_immediates(layout_blocks(instructions, profile))
+            allocation = color_registers(instructions, profile)
+        elif opt_level == 1:
+            instructions = select_immediates(layout_blocks(instructions, profile))
+            allocation = allocate_registers(instructions)
+        else:
+            allocation = RegisterAllocation()
+        variables = get_all_ir_variables(instructions)
+        locals = Locals(variables, allocation)
+        frame_pointer = True
+        if (
+            opt_level >= 1
+            and locals.stack_used() <= red_zone_size
+            and not any(_calls_function(insn) for insn in instructions)
+            and not (instrument is not None and fun == "main")
+        ):
+            frame_pointer = False
+            locals = Locals(variables, allocation, frame_pointer)
+        use_count: dict[ir.IRVar, int] = {}
+        for insn in instructions:
+            for v in used_vars(insn):
+                use_count[v] = use_count.get(v, 0) + 1
+
+        def move(source: ir.IRVar, dest_ref: str) -> None:
+            """Emits code that copies the value of `source` to a register or memory location."""
+            if source.name == "unit":
+                return
+            if is_immediate(source.name):
+                emit(f"movq {source.name}, {dest_ref}")
+                return
+            if not is_local(source) and source.name[0] != "%":
+                # The address of a function
+                if is_register(dest_ref):
+                    emit(f"leaq {source.name}(%rip), {dest_ref}")
+                else:
+                    emit(f"leaq {source.name}(%rip), %rax")
+                    emit(f"movq %rax, {dest_ref}")
+                return
+            source_ref = locals.get_ref(source)
+            if source_ref == dest_ref:
+                return
+            if is_register(source_ref) or is_register(dest_ref):
+                emit(f"movq {source_ref}, {dest_ref}")
+            else:
+                emit(f"movq {source_ref}, %rax")
+                emit(f"movq %rax, {dest_ref}")
 
+        def pass_arguments(fun: ir.IRVar, args: list[ir.IRVar]) -> tuple[str, int]:
+            """Emits code that puts the arguments in the argument registers and on the
+            stack. Returns the operand that calls the function, and the number of bytes
+            to pop off the stack after the call."""
+            # Arguments after the sixth are pushed in reverse order
+            stack_args = args[len(ir.argument_registers) :]
+            pushed = 8 * len(stack_args)
+            if len(stack_args) % 2 != 0:
+                # Keep the stack pointer a multiple of 16 at the call
+                emit("subq $8, %rsp")
+                pushed += 8
+            for arg in reversed(stack_args):
+                if arg.name == "unit":
+                    emit("pushq $0")
+                elif is_immediate(arg.name):
+                    emit(f"pushq {arg.name}")
+                elif not is_local(arg) and arg.name[0] != "%":
+                    move(arg, "%rax")
+                    emit("pushq %rax")
+                else:
+                    emit(f"pushq {locals.get_ref(arg)}")
+
+            direct = opt_level >= 1 and not is_local(fun)
+            fun_ref = locals.get_ref(fun)
+            if fun_ref in ir.argument_registers:
+                # The argument registers are about to be overwritten
+                emit(f"movq {fun_ref}, %rax")
+
+            # Arguments in registers are moved first, in an order that reads each
+            # register before it is overwritten. %r11 breaks cycles like %rdi <-> %rsi.
+            from_registers: list[tuple[str, str]] = []
+            others: list[tuple[ir.IRVar, str]] = []
+            for arg, reg in zip(args, ir.argument_registers):
+                if is_local(arg) and is_register(locals.get_ref(arg)):
+                    if locals.get_ref(arg) != reg:
+                        from_registers.append((locals.get_ref(arg), reg))
+                else:
+                    others.append((arg, reg))
+            while len(from_registers) != 0:
+                ready = [
+                    (src, dst)
+                    for src, dst in from_registers
+                    if all(other_src != dst for other_src, _ in from_registers)
+                ]
+                if len(ready) == 0:
+                    _, dst = from_registers[0]
+                    emit(f"movq {dst}, %r11")
+                    from_registers = [
+                        ("%r11" if src == dst else src, d) for src, d in from_registers
+                    ]
+                    continue
+                src, dst = ready[0]
+                emit(f"movq {src}, {dst}")
+                from_registers.remove((src, dst))
+            for arg, reg in others:
+                move(arg, reg)
+
+            if direct:
+                return fun.name, pushed
+            if fun_ref not in ir.argument_registers:
+                if fun.name[0] == "X":
+                    emit(f"movq {fun_ref}, %rax")
+                else:
+                    emit(f"leaq {fun_ref}, %rax")
+            return "*%rax", pushed
+
+        def restore_callee_saved() -> None:
+            for register in allocation.callee_saved:
+                emit(f"movq {locals.save_slot(register)}, {register}")
+
+        emit(f".type {fun}, @function")
+        # The source line of the code that follows, as (row, column)
+        current_line: tuple[int, int] | None = None
+
+        def mark_line(loc: Location) -> None:
+            nonlocal current_line
+            if source_file is None or loc.row < 0 or current_line == (loc.row, loc.col):
+                return
+            current_line = (loc.row, loc.col)
+            if lines[-1].startswith(".loc"):
+                # The previous line had no code
+                lines.pop()
+            # DWARF numbers lines and columns from 1
+            emit(f".loc 1 {loc.row + 1} {loc.col + 1}")
+
+        emit(f"{fun}:")
         for insn in instructions:
-            emit("")
-            emit("# " + str(insn))
+            if insn.loc.row >= 0 and not isinstance(insn, ir.Label):
+                mark_line(insn.loc)
+                break
+        if frame_pointer:
+            emit("pushq %rbp")
+            emit("movq %rsp, %rbp")
+            emit(f"subq ${locals.stack_used()}, %rsp")
+        for register in allocation.callee_saved:
+            emit(f"movq {register}, {locals.save_slot(register)}")
+
+        # The counter of each block is incremented before its first instruction
+        counters: dict[int, int] = {}
+        if instrument is not None:
+            for position, block in _counted_blocks(instructions):
+                counters[position] = len(counted_locations)
+                counted_locations.append(block_locations(block))
+
+        def count_block(position: int) -> None:
+            if position in counters:
+                emit(f"addq $1, .Lprofile_counts+{8 * counters[position]}(%rip)")
+
+        # The jumps for a comparison whose result only decides the CondJump after it
+        fused_jumps: tuple[str, str] | None = None
+        for i, insn in enumerate(instructions):
+            next_labels = labels_at(instructions, i + 1) if opt_level >= 1 else set()
+            if comments:
+                emit("")
+                emit("# " + str(insn))
+            if not isinstance(insn, ir.Label):
+                mark_line(insn.loc)
+            count_block(i)
             match insn:
                 case ir.Label():
                     # ".L" prefix marks the symbol as "private"
                     emit(f".L{insn.name}:")
                 case ir.LoadIntConst():
+                    dest_ref = locals.get_ref(insn.dest)
                     if -(2**31) <= insn.value < 2**31:
-                        emit(f"movq ${insn.value}, {locals.get_ref(insn.dest)}")
+                        emit(f"movq ${insn.value}, {dest_ref}")
+                    elif is_register(dest_ref):
+                        emit(f"movabsq ${insn.value}, {dest_ref}")
                     else:
                         # Larger integers
                         emit(f"movabsq ${insn.value}, %rax")
-                        emit(f"movq %rax, {locals.get_ref(insn.dest)}")
+                        emit(f"movq %rax, {dest_ref}")
                 case ir.LoadBoolConst():
                     emit(f"movq ${1 if insn.value else 0}, {locals.get_ref(insn.dest)}")
                 case ir.Jump():
-                    emit(f"jmp .L{insn.label.name}")
+                    if insn.label.name not in next_labels:
+                        emit(f"jmp .L{insn.label.name}")
                 case ir.Copy():
-                    if insn.source.name == "unit":
-                        continue
-                    if insn.source.name[0] != "X" and insn.source.name[0] != "%":
-                        emit(f"leaq {insn.source.name}(%rip), %rax")
-                    else:
-                        emit(f"movq {locals.get_ref(insn.source)}, %rax")
-                    emit(f"movq %rax, {locals.get_ref(insn.dest)}")
+                    move(insn.source, locals.get_ref(insn.dest))
                 case ir.CondJump():
-                    emit(f"cmpq $0, {locals.get_ref(insn.cond)}")
-                    emit(f"jne .L{insn.then_label.name}")
-                    emit(f"jmp .L{insn.else_label.name}")
+                    if fused_jumps is not None:
+                        jump_if_true, jump_if_false = fused_jumps
+                        fused_jumps = None
+                    else:
+                        cond_ref = locals.get_ref(insn.cond)
+                        if is_register(cond_ref):
+                            emit(f"testq {cond_ref}, {cond_ref}")
+                        else:
+                            emit(f"cmpq $0, {cond_ref}")
+                        jump_if_true, jump_if_false = "jne", "je"
+                    then_name, else_name = insn.then_label.name, insn.else_label.name
+                    if then_name in next_labels:
+                        if else_name not in next_labels:
+                            emit(f"{jump_if_false} .L{else_name}")
+                    elif else_name in next_labels:
+                        emit(f"{jump_if_true} .L{then_name}")
+                    else:
+                        emit(f"{jump_if_true} .L{then_name}")
+                        emit(f"jmp .L{else_name}")
                 case ir.Call():
                     func = insn.fun.name
-                    if func in all_intrinsics:
+                    following = (
+                        instructions[i + 1] if i + 1 < len(instructions) else None
+                    )
+                    arg_refs = [locals.get_ref(arg) for arg in insn.args]
+                    dest_ref = locals.get_ref(insn.dest)
+                    if (
+                        opt_level >= 1
+                        and func in comparison_jumps
+                        and isinstance(following, ir.CondJump)
+                        and following.cond == insn.dest
+                        and use_count[insn.dest] == 1
+                    ):
+                        left, right = arg_refs
+                        if is_immediate(left):
+                            # Only the second operand of 'cmpq' can be an immediate
+                            func = swapped_comparisons[func]
+                            left, right = right, left
+                        if is_register(left) and right == "$0":
+                            emit(f"testq {left}, {left}")
+                        elif (
+                            is_register(left)
+                            or is_register(right)
+                            or is_immediate(right)
+                        ):
+                            emit(f"cmpq {right}, {left}")
+                        else:
+                            emit(f"movq {left}, %rdx")
+                            emit(f"cmpq {right}, %rdx")
+                        fused_jumps = comparison_jumps[func]
+                    elif func in all_intrinsics:
+                        # The result can go straight to the destination register, unless
+                        # the intrinsic still reads another value from it after writing it
+                        if is_register(dest_ref) and all(
+                            ref != dest_ref or ref == arg_refs[0]
+                            for ref in arg_refs[1:]
+                        ):
+                            result_register = dest_ref
+                        else:
+                            result_register = "%rax"
                         all_intrinsics[func](
-                            IntrinsicArgs(
-                                [locals.get_ref(arg) for arg in insn.args],
-                                "%rax",
-                                emit,
-                            )
+                            IntrinsicArgs(arg_refs, result_register, emit)
                         )
-                        emit(f"movq %rax, {locals.get_ref(insn.dest)}")
+                        if result_register != dest_ref:
+                            emit(f"movq %rax, {dest_ref}")
                     else:
-                        if len(insn.args) > 6:
-                            raise Exception(
-                                f"{insn.loc}: Assembly generator cannot handle funtion {func} with more than 6 arguments"
-                            )
-                        registers = ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]
-                        for arg, reg in zip(insn.args, registers):
-                            emit(f"movq {locals.get_ref(arg)}, {reg}")
-                        if insn.fun.name[0] == "X":
-                            emit(f"movq {locals.get_ref(insn.fun)}, %rax")
-                        else:
-                            emit(f"leaq {locals.get_ref(insn.fun)}, %rax")
-                        emit(f"callq *%rax")
-                        emit(f"movq %rax, {locals.get_ref(insn.dest)}")
+                        saved = allocation.saved_at_calls.get(i, [])
+                        for register in saved:
+                            emit(f"movq {register}, {locals.save_slot(register)}")
+                        target, pushed = pass_arguments(insn.fun, insn.args)
+                        emit(f"callq {target}")
+                        if pushed != 0:
+                            emit(f"addq ${pushed}, %rsp")
+                        if dest_ref != "%rax":
+                            emit(f"movq %rax, {dest_ref}")
+                        for register in saved:
+                            emit(f"movq {locals.save_slot(register)}, {register}")
+                case ir.TailCall():
+                    target, _ = pass_arguments(insn.fun, insn.args)
+                    # Leave this function's stack frame, so that the called
+                    # function returns to the caller of this function
+                    restore_callee_saved()
+                    emit("movq %rbp, %rsp")
+                    emit("popq %rbp")
+                    emit(f"jmp {target}")
 
         emit("")
+        count_block(len(instructions))
         if fun == "main":
+            if instrument is not None:
+                emit("callq .Lwrite_profile")
             emit("movq $0, %rax")
-        emit("movq %rbp, %rsp")
-        emit("popq %rbp")
+        restore_callee_saved()
+        if frame_pointer:
+            emit("movq %rbp, %rsp")
+            emit("popq %rbp")
         emit("ret")
+        emit(f".size {fun}, .-{fun}")
         emit("")
+    if instrument is not None:
+        lines.extend(_profile_writer(instrument, counted_locations))
     return "\n".join(lines)
+
+
+def _counted_blocks(
+    instructions: list[ir.Instruction],
+) -> list[tuple[int, list[ir.Instruction]]]:
+    """Splits the instructions into blocks that start at the function entry or at
+    a run of labels, and returns each block with the position of its first
+    instruction that is not a label, or the end of the function if it has none."""
+    starts = [
+        i
+        for i, insn in enumerate(instructions)
+        if i == 0
+        or (
+            isinstance(insn, ir.Label) and not isinstance(instructions[i - 1], ir.Label)
+        )
+    ]
+    result: list[tuple[int, list[ir.Instruction]]] = []
+    for start, end in zip(starts, starts[1:] + [len(instructions)]):
+        position = start
+        while position < end and isinstance(instructions[position], ir.Label):
+            position += 1
+        result.append((position, instructions[start:end]))
+    return result
+
+
+def _profile_writer(
+    path: str, counted_locations: list[list[tuple[int, int]]]
+) -> list[str]:
+    """Returns the block counters and a function that writes them to the file at
+    `path`, in the format that `compiler.profile.parse_profile` reads."""
+    records = [
+        f".quad {row}, {col}, .Lprofile_counts+{8 * counter}"
+        for counter, locations in enumerate(counted_locations)
+        for row, col in locations
+    ]
+    return [
+        "# Replaces the address of the counter in each record with its value,",
+        "# and writes the records to the profile file",
+        ".Lwrite_profile:",
+        "leaq .Lprofile_records(%rip), %rsi",
+        "leaq .Lprofile_end(%rip), %rdx",
+        ".Lwrite_profile_next:",
+        "cmpq %rdx, %rsi",
+        "jae .Lwrite_profile_open",
+        "movq 16(%rsi), %rax",
+        "movq (%rax), %rax",
+        "movq %rax, 16(%rsi)",
+        "addq $24, %rsi",
+        "jmp .Lwrite_profile_next",
+        ".Lwrite_profile_open:",
+        "movq $2, %rax",  # open(path, O_WRONLY | O_CREAT | O_TRUNC, 0644)
+        "leaq .Lprofile_path(%rip), %rdi",
+        "movq $577, %rsi",
+        "movq $420, %rdx",
+        "syscall",
+        "testq %rax, %rax",
+        "js .Lwrite_profile_done",
+        "movq %rax, %rdi",
+        "movq $1, %rax",  # write(fd, records, size)
+        "leaq .Lprofile_magic(%rip), %rsi",
+        "leaq .Lprofile_end(%rip), %rdx",
+        "subq %rsi, %rdx",
+        "syscall",
+        "movq $3, %rax",  # close(fd)
+        "syscall",
+        ".Lwrite_profile_done:",
+        "ret",
+        "",
+        ".section .data",
+        ".align 8",
+        ".Lprofile_magic:",
+        f".ascii {_quote(profile_magic.decode())}",
+        ".Lprofile_records:",
+        *records,
+        ".Lprofile_end:",
+        ".Lprofile_path:",
+        f".asciz {_quote(path)}",
+        ".section .bss",
+        ".align 8",
+        ".Lprofile_counts:",
+        f".zero {8 * max(len(counted_locations), 1)}",
+        "",
+    ]
+
+
+def _quote(text: str) -> str:
+    """Returns the text as an Assembly string literal."""
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _calls_function(insn: ir.Instruction) -> bool:
+    match insn:
+        case ir.Call():
+            return insn.fun.name not in all_intrinsics
+        case ir.TailCall():
+            return True
+    return False
@@ -0,0 +1,496 @@
+from dataclasses import dataclass, field, replace
+from typing import Callable, TypeVar
+from compiler import ir
+from compiler.intrinsics import all_intrinsics
+
+# Intrinsics that crash the program on some inputs (division by zero)
+trapping_intrinsics: set[str] = {"/", "%"}
+
+# Intrinsics whose result does not depend on the order of the arguments
+commutative_intrinsics: set[str] = {"+", "*", "*hi", "==", "!="}
+
+# Comparisons that are written the other way around when the arguments are swapped
+mirrored_comparisons: dict[str, str] = {">": "<", ">=": "<="}
+
+T = TypeVar("T")
+
+_int_comparisons: dict[str, Callable[[int, int], bool]] = {
+    "==": lambda x, y: x == y,
+    "!=": lambda x, y: x != y,
+    "<": lambda x, y: x < y,
+    "<=": lambda x, y: x <= y,
+    ">": lambda x, y: x > y,
+    ">=": lambda x, y: x >= y,
+}
+
+# An expression like `("+", X_1, X_2)` or `("int", 5)` together with a variable holding its value
+type Expression = tuple[tuple[str | int | bool | ir.IRVar, ...], ir.IRVar]
+
+
+@dataclass
+class BasicBlock:
+    """A straight-line run of instructions that can only be entered at the top."""
+
+    instructions: list[ir.Instruction]
+    successors: list[int] = field(default_factory=list)
+    predecessors: list[int] = field(default_factory=list)
+
+
+@dataclass
+class ControlFlowGraph:
+    """The basic blocks of one function, in their original order.
+
+    Block 0 is the entry. Blocks without successors fall off the end of the function
+    or end in a tail call."""
+
+    blocks: list[BasicBlock]
+
+    def instructions(self) -> list[ir.Instruction]:
+        return [insn for block in self.blocks for insn in block.instructions]
+
+
+def build_cfg(instructions: list[ir.Instruction]) -> ControlFlowGraph:
+    blocks: list[BasicBlock] = []
+    current: list[ir.Instruction] = []
+    for insn in instructions:
+        if isinstance(insn, ir.Label) and len(current) != 0:
+            blocks.append(BasicBlock(current))
+            current = []
+        current.append(insn)
+        if isinstance(insn, (ir.Jump, ir.CondJump, ir.TailCall)):
+            blocks.append(BasicBlock(current))
+            current = []
+    if len(current) != 0 or len(blocks) == 0:
+        blocks.append(BasicBlock(current))
+
+    label_to_block: dict[str, int] = {}
+    for i, block in enumerate(blocks):
+        first = block.instructions[0] if len(block.instructions) != 0 else None
+        if isinstance(first, ir.Label):
+            label_to_block[first.name] = i
+
+    for i, block in enumerate(blocks):
+        last = block.instructions[-1] if len(block.instructions) != 0 else None
+        match last:
+            case ir.Jump():
+                targets = [label_to_block[last.label.name]]
+            case ir.CondJump():
+                targets = [label_to_block[last.then_label.name]]
+                if last.else_label.name != last.then_label.name:
+                    targets.append(label_to_block[last.else_label.name])
+            case ir.TailCall():
+                targets = []
+            case _:
+                targets = [i + 1] if i + 1 < len(blocks) else []
+        for target in targets:
+            block.successors.append(target)
+            blocks[target].predecessors.append(i)
+
+    return ControlFlowGraph(blocks)
+
+
+def labels_at(instructions: list[ir.Instruction], start: int) -> set[str]:
+    """Returns the names of the labels in the run of labels starting at `start`."""
+    names: set[str] = set()
+    for insn in instructions[start:]:
+        if not isinstance(insn, ir.Label):
+            break
+        names.add(insn.name)
+    return names
+
+
+def is_local(var: ir.IRVar) -> bool:
+    """Tells apart the IR generator's variables from registers, built-ins and functions."""
+    return var.name.startswith("X_")
+
+
+def defined_vars(insn: ir.Instruction) -> list[ir.IRVar]:
+    match insn:
+        case ir.LoadBoolConst() | ir.LoadIntConst() | ir.Copy() | ir.Call():
+            return [insn.dest]
+    return []
+
+
+def used_vars(insn: ir.Instruction) -> list[ir.IRVar]:
+    match insn:
+        case ir.Copy():
+            return [insn.source]
+        case ir.Call() | ir.TailCall():
+            return [insn.fun, *insn.args]
+        case ir.CondJump():
+            return [insn.cond]
+    return []
+
+
+def has_side_effects(insn: ir.Instruction) -> bool:
+    """Tells whether the instruction does anything besides computing its result."""
+    match insn:
+        case ir.LoadBoolConst() | ir.LoadIntConst() | ir.Copy() | ir.Label():
+            return False
+        case ir.Call():
+            name = insn.fun.name
+            return name not in all_intrinsics or name in trapping_intrinsics
+    return True
+
+
+def reachable_blocks(cfg: ControlFlowGraph) -> set[int]:
+    reached: set[int] = set()
+    stack = [0]
+    while len(stack) != 0:
+        i = stack.pop()
+        if i not in reached:
+            reached.add(i)
+            stack.extend(cfg.blocks[i].successors)
+    return reached
+
+
+def wrap_int(value: int) -> int:
+    """Wraps an integer around to the range of a signed 64-bit integer."""
+    return (value + 2**63) % 2**64 - 2**63
+
+
+def truncating_divide(x: int, y: int) -> int:
+    """Divides like `idivq`: the quotient is rounded towards zero."""
+    quotient = abs(x) // abs(y)
+    return quotient if (x < 0) == (y < 0) else -quotient
+
+
+def evaluate_intrinsic(name: str, args: list[int]) -> int | bool | None:
+    """Computes the result of an intrinsic on integer arguments the way the
+    generated code would, or returns None if it would crash or is not an integer operation."""
+    if len(args) == 1:
+        return wrap_int(-args[0]) if name == "unary_-" else None
+    if len(args) != 2:
+        return None
+    x, y = args
+    if name in _int_comparisons:
+        return _int_comparisons[name](x, y)
+    match name:
+        case "+":
+            return wrap_int(x + y)
+        case "-":
+            return wrap_int(x - y)
+        case "*":
+            return wrap_int(x * y)
+        case "*hi":
+            return (x * y) >> 64
+        case "/" | "%":
+            if y == 0 or (x == -(2**63) and y == -1):
+                return None
+            quotient = truncating_divide(x, y)
+            return quotient if name == "/" else x - quotient * y
+        case "<<":
+            return wrap_int(x << (y & 63))
+        case ">>":
+            return x >> (y & 63)
+        case ">>>":
+            return wrap_int((x % 2**64) >> (y & 63))
+        case "&":
+            return x & y
+    return None
+
+
+def constant_vars(instructions: list[ir.Instruction]) -> dict[ir.IRVar, int]:
+    """Returns the local variables that are only ever assigned an integer constant, once.
+
+    Variables are defined before they are read, so they hold that constant wherever they are read.
+    """
+    defs: dict[ir.IRVar, list[ir.Instruction]] = {}
+    for insn in instructions:
+        for v in defined_vars(insn):
+            defs.setdefault(v, []).append(insn)
+    constants: dict[ir.IRVar, int] = {}
+    for v, insns in defs.items():
+        if is_local(v) and len(insns) == 1:
+            definition = insns[0]
+            if isinstance(definition, ir.LoadIntConst):
+                constants[v] = definition.value
+    return constants
+
+
+def new_var_generator(instructions: list[ir.Instruction]) -> Callable[[], ir.IRVar]:
+    """Returns a function that creates local variables not used by the instructions."""
+    current = -1
+    for insn in instructions:
+        for v in defined_vars(insn) + used_vars(insn):
+            if is_local(v) and v.name[2:].isdigit():
+                current = max(current, int(v.name[2:]))
+
+    def new_var() -> ir.IRVar:
+        nonlocal current
+        current += 1
+        return ir.IRVar(f"X_{current}")
+
+    return new_var
+
+
+def dominators(cfg: ControlFlowGraph) -> list[set[int]]:
+    """Returns, for each block, the blocks that every path from the entry to it passes through.
+
+    Unreachable blocks have no dominators."""
+    reached = reachable_blocks(cfg)
+    doms = [set(reached) if i in reached else set() for i in range(len(cfg.blocks))]
+    doms[0] = {0}
+    changed = True
+    while changed:
+        changed = False
+        for i in range(1, len(cfg.blocks)):
+            if i not in reached:
+                continue
+            new = set(reached)
+            for p in cfg.blocks[i].predecessors:
+                if p in reached:
+                    new &= doms[p]
+            new.add(i)
+            if new != doms[i]:
+                doms[i] = new
+                changed = True
+    return doms
+
+
+@dataclass
+class Loop:
+    """A natural loop: the blocks that can reach a back edge to `header`
+    without passing through the header."""
+
+    header: int
+    blocks: set[int]
+
+
+def natural_loops(cfg: ControlFlowGraph) -> list[Loop]:
+    """Returns the loops of the function, inner loops before the loops containing them."""
+    doms = dominators(cfg)
+    bodies: dict[int, set[int]] = {}
+    for i, block in enumerate(cfg.blocks):
+        for header in block.successors:
+            if header not in doms[i]:
+                continue
+            body = bodies.setdefault(header, {header})
+            stack = [i]
+            while len(stack) != 0:
+                b = stack.pop()
+                if b not in body:
+                    body.add(b)
+                    stack.extend(p for p in cfg.blocks[b].predecessors if doms[p])
+    loops = [Loop(header, body) for header, body in bodies.items()]
+    loops.sort(key=lambda loop: len(loop.blocks))
+    return loops
+
+
+def replace_uses(
+    insn: ir.Instruction, mapping: dict[ir.IRVar, ir.IRVar]
+) -> ir.Instruction:
+    """Returns the instruction with every variable it reads renamed according to `mapping`."""
+
+    def rename(v: ir.IRVar) -> ir.IRVar:
+        return mapping.get(v, v)
+
+    match insn:
+        case ir.Copy():
+            return replace(insn, source=rename(insn.source))
+        case ir.Call() | ir.TailCall():
+            return replace(
+                insn, fun=rename(insn.fun), args=[rename(a) for a in insn.args]
+            )
+        case ir.CondJump():
+            return replace(insn, cond=rename(insn.cond))
+    return insn
+
+
+def replace_dest(insn: ir.Instruction, dest: ir.IRVar) -> ir.Instruction:
+    """Returns the instruction with the variable it writes replaced by `dest`."""
+    match insn:
+        case ir.LoadBoolConst() | ir.LoadIntConst() | ir.Copy() | ir.Call():
+            return replace(insn, dest=dest)
+    return insn
+
+
+def liveness(cfg: ControlFlowGraph) -> list[set[ir.IRVar]]:
+    """Returns the local variables that are live at the end of each block."""
+    blocks = cfg.blocks
+    live_in: list[set[ir.IRVar]] = [set() for _ in blocks]
+    live_out: list[set[ir.IRVar]] = [set() for _ in blocks]
+
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(blocks))):
+            out: set[ir.IRVar] = set()
+            for s in blocks[i].successors:
+                out |= live_in[s]
+            live = set(out)
+            for insn in reversed(blocks[i].instructions):
+                live = live_before(insn, live)
+            if out != live_out[i] or live != live_in[i]:
+                live_out[i] = out
+                live_in[i] = live
+                changed = True
+    return live_out
+
+
+def live_before(insn: ir.Instruction, live_after: set[ir.IRVar]) -> set[ir.IRVar]:
+    """Steps the liveness analysis backwards over one instruction."""
+    live = live_after - set(defined_vars(insn))
+    live |= {v for v in used_vars(insn) if is_local(v)}
+    return live
+
+
+def available_copies(
+    cfg: ControlFlowGraph,
+) -> list[set[tuple[ir.IRVar, ir.IRVar]]]:
+    """Returns, for the start of each block, the `(dest, source)` pairs of local
+    variables that are known to be equal on every path reaching it."""
+    return _available_on_all_paths(cfg, copies_after)
+
+
+def _available_on_all_paths(
+    cfg: ControlFlowGraph, step: Callable[[ir.Instruction, set[T]], set[T]]
+) -> list[set[T]]:
+    """Solves a forward data-flow problem whose facts must hold on every incoming path."""
+    blocks = cfg.blocks
+    avail_in: list[set[T] | None] = [None for _ in blocks]
+    avail_out: list[set[T] | None] = [None for _ in blocks]
+
+    changed = True
+    while changed:
+        changed = False
+        for i, block in enumerate(blocks):
+            facts: set[T] | None
+            if i == 0:
+                facts = set()
+            else:
+                facts = None
+                for p in block.predecessors:
+                    pred_out = avail_out[p]
+                    if pred_out is not None:
+                        facts = set(pred_out) if facts is None else facts & pred_out
+            if facts is None:
+                continue
+            avail_in[i] = set(facts)
+            for insn in block.instructions:
+                facts = step(insn, facts)
+            if facts != avail_out[i]:
+                avail_out[i] = facts
+                changed = True
+
+    return [facts if facts is not None else set() for facts in avail_in]
+
+
+def copies_after(
+    insn: ir.Instruction, copies: set[tuple[ir.IRVar, ir.IRVar]]
+) -> set[tuple[ir.IRVar, ir.IRVar]]:
+    """Steps the available copies analysis forwards over one instruction."""
+    defs = defined_vars(insn)
+    result = {(d, s) for d, s in copies if d not in defs and s not in defs}
+    if (
+        isinstance(insn, ir.Copy)
+        and is_local(insn.source)
+        and is_local(insn.dest)
+        and insn.source != insn.dest
+    ):
+        result.add((insn.dest, insn.source))
+    return result
+
+
+def expression_key(
+    insn: ir.Instruction,
+) -> tuple[str | int | bool | ir.IRVar, ...] | None:
+    """Returns a description of the value the instruction computes that is the same
+    for all instructions computing the same value from the same variables."""
+    match insn:
+        case ir.LoadIntConst():
+            return ("int", insn.value)
+        case ir.LoadBoolConst():
+            return ("bool", insn.value)
+        case ir.Call() if insn.fun.name in all_intrinsics:
+            name = insn.fun.name
+            args = list(insn.args)
+            if name in mirrored_comparisons:
+                name = mirrored_comparisons[name]
+                args.reverse()
+            elif name in commutative_intrinsics:
+                args.sort(key=lambda v: v.name)
+            return (name, *args)
+    return None
+
+
+def available_expressions(cfg: ControlFlowGraph) -> list[set[Expression]]:
+    """Returns, for the start of each block, the expressions that have been
+    computed into a variable on every path reaching it, without that variable
+    or the variables the expression reads being redefined since."""
+    return _available_on_all_paths(cfg, expressions_after)
+
+
+def expressions_after(
+    insn: ir.Instruction, expressions: set[Expression]
+) -> set[Expression]:
+    """Steps the available expressions analysis forwards over one instruction."""
+    defs = defined_vars(insn)
+    result = {
+        (key, holder)
+        for key, holder in expressions
+        if holder not in defs and not any(d in key for d in defs)
+    }
+    if len(defs) == 0 or not is_local(defs[0]):
+        return result
+    dest = defs[0]
+    key = expression_key(insn)
+    if key is not None and dest not in key:
+        result.add((key, dest))
+    if isinstance(insn, ir.Copy):
+        # After `X_2 = X_1 + 1; X_1 = X_2`, X_1 does not hold the value of `X_1 + 1`
+        result |= {
+            (key, dest)
+            for key, holder in expressions
+            if holder == insn.source and dest not in key
+        }
+    return result
+
+
+def reaching_definitions(cfg: ControlFlowGraph) -> list[set[int]]:
+    """Returns, for the start of each block, the positions in `cfg.instructions()`
+    of the definitions of local variables that may reach it unchanged."""
+    instructions = cfg.instructions()
+    sites: dict[ir.IRVar, set[int]] = {}
+    for pos, insn in enumerate(instructions):
+        for v in defined_vars(insn):
+            if is_local(v):
+                sites.setdefault(v, set()).add(pos)
+
+    starts: list[int] = []
+    pos = 0
+    for block in cfg.blocks:
+        starts.append(pos)
+        pos += len(block.instructions)
+
+    reach_in: list[set[int]] = [set() for _ in cfg.blocks]
+    reach_out: list[set[int]] = [set() for _ in cfg.blocks]
+    changed = True
+    while changed:
+        changed = False
+        for i, block in enumerate(cfg.blocks):
+            reach = set()
+            for p in block.predecessors:
+                reach |= reach_out[p]
+            reach_in[i] = set(reach)
+            for offset, insn in enumerate(block.instructions):
+                reach = definitions_after(starts[i] + offset, insn, reach, sites)
+            if reach != reach_out[i]:
+                reach_out[i] = reach
+                changed = True
+    return reach_in
+
+
+def definitions_after(
+    pos: int,
+    insn: ir.Instruction,
+    reaching: set[int],
+    sites: dict[ir.IRVar, set[int]],
+) -> set[int]:
+    """Steps the reaching definitions analysis forwards over the instruction at `pos`,
+    given the positions of all definitions of each variable."""
+    result = reaching
+    for v in defined_vars(insn):
+        if is_local(v):
+            result = (result - sites[v]) | {pos}
+    return result
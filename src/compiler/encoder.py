@@ -0,0 +1,946 @@
+import os
+import re
+import struct
+from dataclasses import dataclass, field
+
+# Machine code for the subset of x86-64 Assembly that the code generator emits,
+# encoded the same way as GNU 'as' encodes it.
+
+registers: dict[str, int] = {
+    name: number
+    for number, name in enumerate(
+        ["rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi"]
+        + [f"r{n}" for n in range(8, 16)]
+    )
+}
+
+# The lowest bytes of the first four registers, which 'setcc' and shifts use
+byte_registers: dict[str, int] = {"al": 0, "cl": 1, "dl": 2, "bl": 3}
+
+# The condition codes of 'jcc' and 'setcc'
+condition_codes: dict[str, int] = {
+    "o": 0,
+    "no": 1,
+    "b": 2,
+    "ae": 3,
+    "e": 4,
+    "z": 4,
+    "ne": 5,
+    "nz": 5,
+    "be": 6,
+    "a": 7,
+    "s": 8,
+    "ns": 9,
+    "p": 10,
+    "np": 11,
+    "l": 12,
+    "ge": 13,
+    "le": 14,
+    "g": 15,
+}
+
+# The value of the 'reg' field that selects each operation of the arithmetic
+# instructions sharing the opcodes 0x81 and 0x83
+_arithmetic_operations: dict[str, int] = {
+    "add": 0,
+    "or": 1,
+    "and": 4,
+    "sub": 5,
+    "xor": 6,
+    "cmp": 7,
+}
+
+# The same for the shifts sharing the opcodes 0xC1, 0xD1 and 0xD3
+_shift_operations: dict[str, int] = {"sal": 4, "shl": 4, "shr": 5, "sar": 7}
+
+# The same for the single-operand instructions sharing the opcode 0xF7
+_unary_operations: dict[str, int] = {"not": 2, "neg": 3, "imul": 5, "idiv": 7}
+
+# Instructions written with a 'q' suffix to make their operand size explicit
+_suffixed_instructions = (
+    set(_arithmetic_operations)
+    | set(_shift_operations)
+    | set(_unary_operations)
+    | {"mov", "movabs", "lea", "test", "push", "pop", "call", "ret"}
+)
+
+R_X86_64_64 = 1
+R_X86_64_PC32 = 2
+R_X86_64_PLT32 = 4
+R_X86_64_32 = 10
+R_X86_64_32S = 11
+
+
+@dataclass(frozen=True)
+class Register:
+    name: str
+
+
+@dataclass(frozen=True)
+class Immediate:
+    value: int
+
+
+@dataclass(frozen=True)
+class Memory:
+    """A memory operand like `-8(%rbp)`, `(%rsi,%rdi)` or `f(%rip)`.
+
+    With a symbol, the address is relative to the instruction pointer."""
+
+    displacement: int = 0
+    base: str | None = None
+    index: str | None = None
+    scale: int = 1
+    symbol: str | None = None
+
+
+@dataclass(frozen=True)
+class Symbol:
+    """The target of a direct jump or call."""
+
+    name: str
+
+
+@dataclass(frozen=True)
+class Indirect:
+    """The target of a jump or call through a register, like `*%rax`."""
+
+    register: str
+
+
+type Operand = Register | Immediate | Memory | Symbol | Indirect
+
+
+@dataclass(frozen=True)
+class Instruction:
+    mnemonic: str
+    operands: tuple[Operand, ...] = ()
+
+
+@dataclass(frozen=True)
+class Label:
+    name: str
+
+
+@dataclass(frozen=True)
+class SourceLine:
+    """A '.loc' directive: the following code was generated from this line."""
+
+    file: int
+    line: int
+    column: int
+
+
+@dataclass(frozen=True)
+class SymbolEnd:
+    """A '.size' directive: the symbol ends here."""
+
+    name: str
+
+
+type Item = Instruction | Label | SourceLine | SymbolEnd
+
+
+@dataclass
+class AssemblyProgram:
+    """The instructions, labels and line directives of a program, in order, which
+    of the labels are global symbols and functions, and the source file names."""
+
+    items: list[Item] = field(default_factory=list)
+    global_symbols: list[str] = field(default_factory=list)
+    function_symbols: set[str] = field(default_factory=set)
+    files: dict[int, str] = field(default_factory=dict)
+
+
+@dataclass
+class Relocation:
+    offset: int
+    symbol: str
+    type: int
+    addend: int
+
+
+@dataclass
+class EncodedProgram:
+    """The machine code of a program, the offset of each label and the relocations
+    for the symbols that the linker must fill in, the offset of each line directive,
+    and the size of the symbols that have one."""
+
+    code: bytes
+    symbols: dict[str, int]
+    relocations: list[Relocation]
+    lines: list[tuple[int, SourceLine]]
+    sizes: dict[str, int]
+
+
+@dataclass
+class _Fixup:
+    """A 32-bit field in an instruction that holds the distance to a symbol."""
+
+    position: int
+    symbol: str
+    branch: bool
+
+
+@dataclass
+class _Code:
+    code: bytes
+    fixup: _Fixup | None = None
+
+
+@dataclass
+class _Jump:
+    """A jump to a label, encoded in 2 bytes if the label is close enough."""
+
+    short_opcode: bytes
+    long_opcode: bytes
+    target: str
+    long: bool = False
+
+    def size(self) -> int:
+        return len(self.long_opcode) + 4 if self.long else len(self.short_opcode) + 1
+
+
+class EncodingError(Exception):
+    """Raised for Assembly code outside the subset that can be encoded."""
+
+
+# A '.file' directive giving the name of a source file for '.loc' directives
+_file_directive = re.compile(r'\.file\s+(\d+)\s+"((?:[^"\\]|\\.)*)"')
+
+
+def parse_assembly(assembly_code: str) -> AssemblyProgram:
+    """Parses the Assembly code emitted by the code generator."""
+    program = AssemblyProgram()
+    for line in assembly_code.splitlines():
+        if (m := _file_directive.fullmatch(line.strip())) is not None:
+            program.files[int(m[1])] = re.sub(r"\\(.)", r"\1", m[2])
+            continue
+        line = line.split("#", 1)[0].strip()
+        if (m := re.match(r"([\w.$]+):\s*", line)) is not None:
+            program.items.append(Label(m[1]))
+            line = line[m.end() :]
+        if line == "":
+            continue
+        mnemonic, _, rest = line.partition(" ")
+        args = _split_operands(rest)
+        if mnemonic in (".global", ".globl"):
+            program.global_symbols.extend(args)
+        elif mnemonic == ".type":
+            if len(args) != 2 or args[1] != "@function":
+                raise EncodingError(f"Unsupported directive: {line}")
+            program.function_symbols.add(args[0])
+        elif mnemonic == ".loc":
+            numbers = line.split()[1:]
+            if not 2 <= len(numbers) <= 3 or not all(n.isdigit() for n in numbers):
+                raise EncodingError(f"Unsupported directive: {line}")
+            file, line_number, column = map(int, numbers + ["0"] * (3 - len(numbers)))
+            if file not in program.files:
+                raise EncodingError(f"Unknown file number: {line}")
+            program.items.append(SourceLine(file, line_number, column))
+        elif mnemonic == ".size":
+            if len(args) != 2 or args[1].replace(" ", "") != f".-{args[0]}":
+                raise EncodingError(f"Unsupported directive: {line}")
+            program.items.append(SymbolEnd(args[0]))
+        elif mnemonic == ".extern" or line in (".text", ".section .text"):
+            pass
+        elif mnemonic.startswith("."):
+            raise EncodingError(f"Unsupported directive: {line}")
+        else:
+            operands = tuple(_parse_operand(arg) for arg in args)
+            program.items.append(Instruction(mnemonic, operands))
+    return program
+
+
+def _split_operands(text: str) -> list[str]:
+    """Splits at the commas that are not inside parentheses."""
+    result: list[str] = []
+    depth = 0
+    current = ""
+    for c in text:
+        if c == "," and depth == 0:
+            result.append(current.strip())
+            current = ""
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        current += c
+    if current.strip() != "":
+        result.append(current.strip())
+    return result
+
+
+def _parse_operand(text: str) -> Operand:
+    if text.startswith("%"):
+        return Register(text[1:])
+    if text.startswith("*%"):
+        return Indirect(text[2:])
+    if text.startswith("$"):
+        try:
+            return Immediate(int(text[1:], 0))
+        except ValueError:
+            raise EncodingError(f"Unsupported operand: {text}")
+    m = re.fullmatch(
+        r"([\w.$]*|-?\d+)\((%\w+)?(?:,\s*%(\w+)(?:,\s*(\d))?)?\)", text.replace(" ", "")
+    )
+    if m is not None:
+        displacement, base, index, scale = m.groups()
+        if base == "%rip":
+            if (
+                index is not None
+                or re.fullmatch(r"[A-Za-z_.$][\w.$]*", displacement) is None
+            ):
+                raise EncodingError(f"Unsupported operand: {text}")
+            return Memory(symbol=displacement)
+        if re.fullmatch(r"-?\d*", displacement) is None:
+            raise EncodingError(f"Unsupported operand: {text}")
+        return Memory(
+            int(displacement or "0"),
+            base[1:] if base is not None else None,
+            index,
+            int(scale or "1"),
+        )
+    if re.fullmatch(r"[A-Za-z_.$][\w.$]*", text) is not None:
+        return Symbol(text)
+    raise EncodingError(f"Unsupported operand: {text}")
+
+
+def assemble_object(assembly_code: str) -> bytes:
+    """Turns Assembly code into a relocatable ELF object file, like 'as' does."""
+    return encode_object(parse_assembly(assembly_code))
+
+
+def encode_object(program: AssemblyProgram) -> bytes:
+    return _elf_object(encode_program(program), program)
+
+
+def encode_program(program: AssemblyProgram) -> EncodedProgram:
+    """Encodes the instructions, with each jump to a label as short as it can be."""
+    labels = {item.name for item in program.items if isinstance(item, Label)}
+    global_symbols = set(program.global_symbols)
+    pieces: list[_Code | _Jump | Label | SourceLine | SymbolEnd] = []
+    for item in program.items:
+        if isinstance(item, Instruction):
+            pieces.append(_encode_instruction(item, labels))
+        else:
+            pieces.append(item)
+
+    # Branch relaxation: start with every jump short and lengthen the ones whose
+    # target turns out too far, until the offsets stop changing
+    while True:
+        offsets, symbols = _layout(pieces)
+        changed = False
+        for piece, offset in zip(pieces, offsets):
+            if isinstance(piece, _Jump) and not piece.long:
+                distance = symbols[piece.target] - (offset + piece.size())
+                if not -128 <= distance <= 127:
+                    piece.long = True
+                    changed = True
+        if not changed:
+            break
+
+    code = bytearray()
+    relocations: list[Relocation] = []
+    lines: list[tuple[int, SourceLine]] = []
+    sizes: dict[str, int] = {}
+    for piece, offset in zip(pieces, offsets):
+        if isinstance(piece, SourceLine):
+            lines.append((offset, piece))
+        elif isinstance(piece, SymbolEnd):
+            if piece.name not in symbols:
+                raise EncodingError(f"Size of undefined symbol {piece.name}")
+            sizes[piece.name] = offset - symbols[piece.name]
+        elif isinstance(piece, _Jump):
+            distance = symbols[piece.target] - (offset + piece.size())
+            if piece.long:
+                code += piece.long_opcode + struct.pack("<i", distance)
+            else:
+                code += piece.short_opcode + struct.pack("<b", distance)
+        elif isinstance(piece, _Code):
+            fixup = piece.fixup
+            if fixup is None:
+                code += piece.code
+                continue
+            end = offset + len(piece.code)
+            addend = fixup.position - len(piece.code)
+            # Like 'as', leave references to global symbols to the linker,
+            # which may redirect them, except for jumps that were relaxed above
+            if fixup.symbol in symbols and fixup.symbol not in global_symbols:
+                value = struct.pack("<i", symbols[fixup.symbol] - end)
+            else:
+                value = bytes(4)
+                relocation_type = R_X86_64_PLT32 if fixup.branch else R_X86_64_PC32
+                relocations.append(
+                    Relocation(
+                        offset + fixup.position, fixup.symbol, relocation_type, addend
+                    )
+                )
+            code += (
+                piece.code[: fixup.position] + value + piece.code[fixup.position + 4 :]
+            )
+    return EncodedProgram(bytes(code), symbols, relocations, lines, sizes)
+
+
+def _layout(
+    pieces: list[_Code | _Jump | Label | SourceLine | SymbolEnd],
+) -> tuple[list[int], dict[str, int]]:
+    offsets: list[int] = []
+    symbols: dict[str, int] = {}
+    offset = 0
+    for piece in pieces:
+        offsets.append(offset)
+        if isinstance(piece, Label):
+            symbols[piece.name] = offset
+        elif isinstance(piece, _Jump):
+            offset += piece.size()
+        elif isinstance(piece, _Code):
+            offset += len(piece.code)
+    return offsets, symbols
+
+
+def _encode_instruction(insn: Instruction, labels: set[str]) -> _Code | _Jump:
+    mnemonic = insn.mnemonic
+    if mnemonic.endswith("q") and mnemonic[:-1] in _suffixed_instructions:
+        mnemonic = mnemonic[:-1]
+    operands = insn.operands
+    match mnemonic, operands:
+        case "ret", ():
+            return _Code(b"\xc3")
+        case "cqto", ():
+            return _Code(b"\x48\x99")
+        case ("jmp" | "call"), (Indirect(register),):
+            return _Code(
+                *_with_modrm(
+                    4 if mnemonic == "jmp" else 2,
+                    Register(register),
+                    b"\xff",
+                    rex_w=False,
+                )
+            )
+        case "call", (Symbol(name),):
+            return _Code(b"\xe8" + bytes(4), _Fixup(1, name, branch=True))
+        case "jmp", (Symbol(name),):
+            if name not in labels:
+                return _Code(b"\xe9" + bytes(4), _Fixup(1, name, branch=True))
+            return _Jump(b"\xeb", b"\xe9", name)
+        case _, (Symbol(name),) if (
+            mnemonic[0] == "j" and mnemonic[1:] in condition_codes
+        ):
+            cc = condition_codes[mnemonic[1:]]
+            if name not in labels:
+                return _Code(
+                    bytes([0x0F, 0x80 + cc]) + bytes(4), _Fixup(2, name, branch=True)
+                )
+            return _Jump(bytes([0x70 + cc]), bytes([0x0F, 0x80 + cc]), name)
+        case _, (Register(name),) if (
+            mnemonic.startswith("set") and mnemonic[3:] in condition_codes
+        ):
+            if name not in byte_registers:
+                raise EncodingError(f"Unsupported instruction: {insn}")
+            opcode = bytes([0x0F, 0x90 + condition_codes[mnemonic[3:]]])
+            return _Code(opcode + bytes([0xC0 | byte_registers[name]]))
+        case ("push" | "pop"), (Register(name),):
+            number = _register(name)
+            prefix = b"\x41" if number >= 8 else b""
+            return _Code(
+                prefix + bytes([(0x50 if mnemonic == "push" else 0x58) + (number & 7)])
+            )
+        case "push", (Immediate(value),):
+            if _is_int8(value):
+                return _Code(b"\x6a" + struct.pack("<b", value))
+            return _Code(b"\x68" + _int32(value))
+        case "push", (Memory() as source,):
+            return _Code(*_with_modrm(6, source, b"\xff", rex_w=False))
+        case "movabs", (Immediate(value), Register(name)):
+            number = _register(name)
+            rex = 0x48 | (number >> 3)
+            return _Code(
+                bytes([rex, 0xB8 + (number & 7)])
+                + struct.pack("<Q", value & (2**64 - 1))
+            )
+        case "mov", (Immediate(value), (Register() | Memory()) as dest):
+            return _Code(*_with_modrm(0, dest, b"\xc7", immediate=_int32(value)))
+        case "mov", (Register(name), (Register() | Memory()) as dest):
+            return _Code(*_with_modrm(_register(name), dest, b"\x89"))
+        case "mov", (Memory() as source, Register(name)):
+            return _Code(*_with_modrm(_register(name), source, b"\x8b"))
+        case "lea", (Memory() as source, Register(name)):
+            return _Code(*_with_modrm(_register(name), source, b"\x8d"))
+        case "test", (Register(name), (Register() | Memory()) as dest):
+            return _Code(*_with_modrm(_register(name), dest, b"\x85"))
+        case _, (Immediate(value), (Register() | Memory()) as dest) if (
+            mnemonic in _arithmetic_operations
+        ):
+            operation = _arithmetic_operations[mnemonic]
+            if _is_int8(value):
+                return _Code(
+                    *_with_modrm(
+                        operation, dest, b"\x83", immediate=struct.pack("<b", value)
+                    )
+                )
+            if dest == Register("rax"):
+                # The short form for the accumulator
+                return _Code(bytes([0x48, operation * 8 + 5]) + _int32(value))
+            return _Code(
+                *_with_modrm(operation, dest, b"\x81", immediate=_int32(value))
+            )
+        case _, (Register(name), (Register() | Memory()) as dest) if (
+            mnemonic in _arithmetic_operations
+        ):
+            opcode = bytes([_arithmetic_operations[mnemonic] * 8 + 1])
+            return _Code(*_with_modrm(_register(name), dest, opcode))
+        case _, (Memory() as source, Register(name)) if (
+            mnemonic in _arithmetic_operations
+        ):
+            opcode = bytes([_arithmetic_operations[mnemonic] * 8 + 3])
+            return _Code(*_with_modrm(_register(name), source, opcode))
+        case _, (Immediate(value), (Register() | Memory()) as dest) if (
+            mnemonic in _shift_operations
+        ):
+            operation = _shift_operations[mnemonic]
+            if value == 1:
+                return _Code(*_with_modrm(operation, dest, b"\xd1"))
+            return _Code(
+                *_with_modrm(operation, dest, b"\xc1", immediate=bytes([value & 0xFF]))
+            )
+        case _, (Register("cl"), (Register() | Memory()) as dest) if (
+            mnemonic in _shift_operations
+        ):
+            return _Code(*_with_modrm(_shift_operations[mnemonic], dest, b"\xd3"))
+        case _, ((Register() | Memory()) as source,) if mnemonic in _unary_operations:
+            return _Code(*_with_modrm(_unary_operations[mnemonic], source, b"\xf7"))
+        case "imul", ((Register() | Memory()) as source, Register(name)):
+            return _Code(*_with_modrm(_register(name), source, b"\x0f\xaf"))
+        case "imul", (
+            Immediate(value),
+            (Register() | Memory()) as source,
+            Register(name),
+        ):
+            if _is_int8(value):
+                return _Code(
+                    *_with_modrm(
+                        _register(name),
+                        source,
+                        b"\x6b",
+                        immediate=struct.pack("<b", value),
+                    )
+                )
+            return _Code(
+                *_with_modrm(_register(name), source, b"\x69", immediate=_int32(value))
+            )
+    raise EncodingError(f"Unsupported instruction: {insn}")
+
+
+def _with_modrm(
+    reg: int,
+    rm: Operand,
+    opcode: bytes,
+    immediate: bytes = b"",
+    rex_w: bool = True,
+) -> tuple[bytes, _Fixup | None]:
+    """Encodes an instruction with a ModR/M byte whose 'reg' field is `reg`
+    and whose 'r/m' field refers to `rm`."""
+    rex = 0x48 if rex_w else 0x40
+    if reg >= 8:
+        rex |= 0x04
+    fixup: _Fixup | None = None
+    match rm:
+        case Register(name):
+            number = _register(name)
+            if number >= 8:
+                rex |= 0x01
+            address = bytes([0xC0 | (reg & 7) << 3 | (number & 7)])
+        case Memory(symbol=str(symbol)):
+            address = bytes([(reg & 7) << 3 | 5]) + bytes(4)
+            fixup = _Fixup(1, symbol, branch=False)
+        case Memory(displacement, str(base), index, scale):
+            base_number = _register(base)
+            if base_number >= 8:
+                rex |= 0x01
+            if displacement == 0 and base_number & 7 != 5:
+                mod, disp = 0, b""
+            elif _is_int8(displacement):
+                mod, disp = 1, struct.pack("<b", displacement)
+            else:
+                mod, disp = 2, _int32(displacement)
+            if index is not None or base_number & 7 == 4:
+                # A SIB byte follows, as 'r/m' = 4 means there is one
+                index_number = 4 if index is None else _register(index)
+                if index is not None and index_number == 4:
+                    raise EncodingError("%rsp cannot be an index register")
+                if index_number >= 8:
+                    rex |= 0x02
+                scale_bits = {1: 0, 2: 1, 4: 2, 8: 3}[scale]
+                sib = bytes(
+                    [scale_bits << 6 | (index_number & 7) << 3 | (base_number & 7)]
+                )
+                address = bytes([mod << 6 | (reg & 7) << 3 | 4]) + sib + disp
+            else:
+                address = bytes([mod << 6 | (reg & 7) << 3 | (base_number & 7)]) + disp
+        case _:
+            raise EncodingError(f"Unsupported operand: {rm}")
+    prefix = bytes([rex]) if rex != 0x40 else b""
+    if fixup is not None:
+        fixup.position += len(prefix) + len(opcode)
+    return prefix + opcode + address + immediate, fixup
+
+
+def _register(name: str) -> int:
+    if name not in registers:
+        raise EncodingError(f"Unsupported register: %{name}")
+    return registers[name]
+
+
+def _is_int8(value: int) -> bool:
+    return -128 <= value <= 127
+
+
+def _int32(value: int) -> bytes:
+    if not -(2**31) <= value < 2**31:
+        raise EncodingError(f"Immediate out of range: {value}")
+    return struct.pack("<i", value)
+
+
+# ELF constants, see the System V ABI
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHT_NOBITS = 8
+SHF_WRITE = 1
+SHF_ALLOC = 2
+SHF_EXECINSTR = 4
+SHF_INFO_LINK = 0x40
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_FUNC = 2
+STT_SECTION = 3
+
+
+class StringTable:
+    """The contents of an ELF string table section."""
+
+    def __init__(self) -> None:
+        self.data = bytearray(b"\0")
+        self.offsets: dict[str, int] = {}
+
+    def add(self, name: str) -> int:
+        if name not in self.offsets:
+            self.offsets[name] = len(self.data)
+            self.data += name.encode() + b"\0"
+        return self.offsets[name]
+
+
+def _elf_object(encoded: EncodedProgram, program: AssemblyProgram) -> bytes:
+    """Writes an ELF object file with the code in its '.text' section, and the
+    DWARF debug info for its '.loc' directives if it has any."""
+    code, symbols = encoded.code, encoded.symbols
+    # name, type, flags, data, link, info, alignment, entry size
+    sections: list[tuple[str, int, int, bytes, int, int, int, int]] = []
+    section_relocations: dict[str, list[Relocation]] = {}
+
+    def add_section(
+        name: str,
+        flags: int,
+        data: bytes,
+        relocations: list[Relocation] | None,
+        alignment: int = 1,
+    ) -> None:
+        sections.append((name, SHT_PROGBITS, flags, data, 0, 0, alignment, 0))
+        if relocations is not None:
+            section_relocations[name] = relocations
+            # Filled in when the symbol table is known
+            sections.append((f".rela{name}", SHT_RELA, SHF_INFO_LINK, b"", 0, 0, 8, 24))
+
+    add_section(".text", SHF_ALLOC | SHF_EXECINSTR, code, encoded.relocations)
+    if len(encoded.lines) != 0:
+        line_program, line_relocations = _debug_line(
+            encoded.lines, program.files, len(code)
+        )
+        units, unit_relocations, abbrev = _debug_info(
+            program.files[encoded.lines[0][1].file], len(code)
+        )
+        add_section(".debug_line", 0, line_program, line_relocations)
+        add_section(".debug_info", 0, units, unit_relocations)
+        add_section(".debug_abbrev", 0, abbrev, None)
+    section_indices = {name: index + 1 for index, (name, *_) in enumerate(sections)}
+    symtab_index = len(sections) + 1
+
+    strtab = StringTable()
+    symtab = bytearray(bytes(24))
+    symbol_indices: dict[str, int] = {}
+
+    def add_symbol(name: str, bind: int) -> None:
+        symbol_type = STT_FUNC if name in program.function_symbols else STT_NOTYPE
+        section = 1 if name in symbols else 0
+        symbol_indices[name] = len(symtab) // 24
+        symtab.extend(
+            struct.pack(
+                "<IBBHQQ",
+                strtab.add(name),
+                bind << 4 | symbol_type,
+                0,
+                section,
+                symbols.get(name, 0),
+                encoded.sizes.get(name, 0),
+            )
+        )
+
+    # Local symbols come first: the sections that debug info refers to, then
+    # the labels except those starting with '.L'
+    for name, relocations in section_relocations.items():
+        for r in relocations:
+            if r.symbol in section_indices and r.symbol not in symbol_indices:
+                symbol_indices[r.symbol] = len(symtab) // 24
+                symtab += struct.pack(
+                    "<IBBHQQ", 0, STT_SECTION, 0, section_indices[r.symbol], 0, 0
+                )
+    global_symbols = set(program.global_symbols)
+    for name in symbols:
+        if not name.startswith(".L") and name not in global_symbols:
+            add_symbol(name, STB_LOCAL)
+    first_global = len(symtab) // 24
+    for name in program.global_symbols:
+        if name not in symbol_indices:
+            add_symbol(name, STB_GLOBAL)
+    for relocation in encoded.relocations:
+        if relocation.symbol not in symbol_indices:
+            add_symbol(relocation.symbol, STB_GLOBAL)
+
+    for index, (
+        name,
+        type,
+        flags,
+        data,
+        link,
+        info,
+        alignment,
+        entry_size,
+    ) in enumerate(sections):
+        if type == SHT_RELA:
+            target = name[len(".rela") :]
+            data = b"".join(
+                struct.pack(
+                    "<QQq", r.offset, symbol_indices[r.symbol] << 32 | r.type, r.addend
+                )
+                for r in section_relocations[target]
+            )
+            link, info = symtab_index, section_indices[target]
+            sections[index] = (
+                name,
+                type,
+                flags,
+                data,
+                link,
+                info,
+                alignment,
+                entry_size,
+            )
+    sections += [
+        (
+            ".symtab",
+            SHT_SYMTAB,
+            0,
+            bytes(symtab),
+            symtab_index + 1,
+            first_global,
+            8,
+            24,
+        ),
+        (".strtab", SHT_STRTAB, 0, bytes(strtab.data), 0, 0, 1, 0),
+    ]
+    shstrtab = StringTable()
+    for name, *_ in sections:
+        shstrtab.add(name)
+    shstrtab.add(".shstrtab")
+    sections.append((".shstrtab", SHT_STRTAB, 0, bytes(shstrtab.data), 0, 0, 1, 0))
+
+    body = bytearray()
+    headers = bytearray(bytes(64))
+    for name, type, flags, data, link, info, alignment, entry_size in sections:
+        offset = 64 + _align(len(body), alignment)
+        body += bytes(offset - 64 - len(body)) + data
+        headers += struct.pack(
+            "<IIQQQQIIQQ",
+            shstrtab.add(name),
+            type,
+            flags,
+            0,
+            offset,
+            len(data),
+            link,
+            info,
+            alignment,
+            entry_size,
+        )
+    section_headers = 64 + _align(len(body), 8)
+    body += bytes(section_headers - 64 - len(body))
+
+    header = b"\x7fELF\x02\x01\x01" + bytes(9)
+    header += struct.pack(
+        "<HHIQQQIHHHHHH",
+        1,  # Relocatable file
+        62,  # x86-64
+        1,
+        0,
+        0,
+        section_headers,
+        0,
+        64,
+        0,
+        0,
+        64,
+        len(sections) + 1,
+        len(sections),
+    )
+    return header + bytes(body) + bytes(headers)
+
+
+# DWARF constants, see the DWARF 3 standard. Like 'as', the debug info is
+# DWARF 3: a compilation unit for the file and a line number program for it.
+DW_TAG_compile_unit = 0x11
+DW_AT_name = 0x03
+DW_AT_stmt_list = 0x10
+DW_AT_low_pc = 0x11
+DW_AT_high_pc = 0x12
+DW_AT_language = 0x13
+DW_AT_comp_dir = 0x1B
+DW_AT_producer = 0x25
+DW_FORM_addr = 0x01
+DW_FORM_data2 = 0x05
+DW_FORM_data4 = 0x06
+DW_FORM_string = 0x08
+DW_LANG_Mips_Assembler = 0x8001
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNS_set_file = 4
+DW_LNS_set_column = 5
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+
+# The parameters of the special opcodes of the line number program, as 'as' uses
+_line_base = -5
+_line_range = 14
+_opcode_base = 13
+_standard_opcode_lengths = [0, 1, 1, 1, 1, 0, 0, 0, 1, 0, 0, 1]
+
+
+def _debug_line(
+    lines: list[tuple[int, SourceLine]], files: dict[int, str], code_size: int
+) -> tuple[bytes, list[Relocation]]:
+    """Returns the '.debug_line' section that maps each code offset to the
+    line of the last '.loc' directive before it, and its relocations."""
+    header = bytearray()
+    header += bytes([1, 1, _line_base & 0xFF, _line_range, _opcode_base])
+    header += bytes(_standard_opcode_lengths)
+    header += b"\0"  # No include directories
+    for number in range(1, max(files) + 1):
+        # Name, directory, modification time and size
+        header += files.get(number, "").encode() + b"\0" + bytes(3)
+    header += b"\0"
+
+    program = bytearray()
+    program += bytes([0, 9, DW_LNE_set_address])
+    address_field = len(program)
+    program += bytes(8)
+    address, line, column, file = 0, 1, 0, 1
+    for offset, source_line in lines:
+        if source_line.file != file:
+            file = source_line.file
+            program += bytes([DW_LNS_set_file]) + _uleb128(file)
+        if source_line.column != column:
+            column = source_line.column
+            program += bytes([DW_LNS_set_column]) + _uleb128(column)
+        line_delta = source_line.line - line
+        address_delta = offset - address
+        opcode = line_delta - _line_base + _line_range * address_delta + _opcode_base
+        if _line_base <= line_delta < _line_base + _line_range and opcode <= 255:
+            program.append(opcode)
+        else:
+            if address_delta != 0:
+                program += bytes([DW_LNS_advance_pc]) + _uleb128(address_delta)
+            if line_delta != 0:
+                program += bytes([DW_LNS_advance_line]) + _sleb128(line_delta)
+            program.append(DW_LNS_copy)
+        address, line = offset, source_line.line
+    if code_size > address:
+        program += bytes([DW_LNS_advance_pc]) + _uleb128(code_size - address)
+    program += bytes([0, 1, DW_LNE_end_sequence])
+
+    # Length, version and header length, then the header and the program
+    prefix_size = 10
+    data = (
+        struct.pack(
+            "<IHI", prefix_size - 4 + len(header) + len(program), 3, len(header)
+        )
+        + header
+        + program
+    )
+    address_offset = prefix_size + len(header) + address_field
+    return data, [Relocation(address_offset, ".text", R_X86_64_64, 0)]
+
+
+def _debug_info(
+    file_name: str, code_size: int
+) -> tuple[bytes, list[Relocation], bytes]:
+    """Returns the '.debug_info' section with a compilation unit covering the code,
+    its relocations, and the '.debug_abbrev' section that describes its layout."""
+    attributes = [
+        (DW_AT_stmt_list, DW_FORM_data4),
+        (DW_AT_low_pc, DW_FORM_addr),
+        (DW_AT_high_pc, DW_FORM_addr),
+        (DW_AT_name, DW_FORM_string),
+        (DW_AT_comp_dir, DW_FORM_string),
+        (DW_AT_producer, DW_FORM_string),
+        (DW_AT_language, DW_FORM_data2),
+    ]
+    abbrev = bytes([1, DW_TAG_compile_unit, 0])
+    abbrev += b"".join(bytes(pair) for pair in attributes) + bytes(3)
+
+    # The abbreviation code, then the attribute values in order
+    unit = bytearray([1])
+    unit += bytes(4 + 8 + 8)
+    unit += file_name.encode() + b"\0"
+    unit += os.getcwd().encode() + b"\0"
+    unit += b"compiler\0"
+    unit += struct.pack("<H", DW_LANG_Mips_Assembler)
+    # Length, version, abbreviation table offset and address size
+    prefix_size = 11
+    data = struct.pack("<IHIB", prefix_size - 4 + len(unit), 3, 0, 8) + unit
+    relocations = [
+        Relocation(6, ".debug_abbrev", R_X86_64_32, 0),
+        Relocation(prefix_size + 1, ".debug_line", R_X86_64_32, 0),
+        Relocation(prefix_size + 5, ".text", R_X86_64_64, 0),
+        Relocation(prefix_size + 13, ".text", R_X86_64_64, code_size),
+    ]
+    return data, relocations, abbrev
+
+
+def _uleb128(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value == 0:
+            result.append(byte)
+            return bytes(result)
+        result.append(byte | 0x80)
+
+
+def _sleb128(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if (value == 0 and byte & 0x40 == 0) or (value == -1 and byte & 0x40 != 0):
+            result.append(byte)
+            return bytes(result)
+        result.append(byte | 0x80)
+
+
+def _align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
@@ -0,0 +1,192 @@
+from dataclasses import replace
+from typing import Callable
+from compiler import ir
+from compiler.cfg import (
+    build_cfg,
+    natural_loops,
+    defined_vars,
+    used_vars,
+    is_local,
+    replace_uses,
+    replace_dest,
+    new_var_generator,
+)
+from compiler.profile import Profile
+
+# Functions with at most this many instructions are inlined everywhere
+small_function_size = 12
+
+# Larger functions are still inlined into loops, up to this size
+loop_function_size = 40
+
+# Inlining stops once the calling function has grown to this many instructions
+max_function_size = 2000
+
+
+def call_graph(fun_insn: dict[str, list[ir.Instruction]]) -> dict[str, set[str]]:
+    """Returns the functions that each function calls or takes the address of."""
+    graph: dict[str, set[str]] = {}
+    for name, instructions in fun_insn.items():
+        graph[name] = {
+            v.name
+            for insn in instructions
+            for v in used_vars(insn)
+            if v.name in fun_insn and v.name != "main"
+        }
+    return graph
+
+
+def recursive_functions(graph: dict[str, set[str]]) -> set[str]:
+    """Returns the functions that can end up calling themselves."""
+    recursive: set[str] = set()
+    for start in graph:
+        stack = list(graph[start])
+        seen: set[str] = set()
+        while len(stack) != 0:
+            name = stack.pop()
+            if name == start:
+                recursive.add(start)
+                break
+            if name not in seen:
+                seen.add(name)
+                stack.extend(graph[name])
+    return recursive
+
+
+def bottom_up_order(graph: dict[str, set[str]]) -> list[str]:
+    """Returns the functions ordered so that, apart from recursion,
+    every function comes after the functions it calls."""
+    order: list[str] = []
+    visited: set[str] = set()
+
+    def visit(name: str) -> None:
+        visited.add(name)
+        for callee in sorted(graph[name]):
+            if callee not in visited:
+                visit(callee)
+        order.append(name)
+
+    for name in sorted(graph):
+        if name not in visited:
+            visit(name)
+    return order
+
+
+def inline_calls(
+    caller: str,
+    instructions: list[ir.Instruction],
+    callees: dict[str, list[ir.Instruction]],
+    profile: Profile | None = None,
+) -> list[ir.Instruction]:
+    """Replaces direct calls to the functions in `callees` with a copy of their body,
+    when the function is small or the call is inside a loop.
+
+    With a profile, calls that ran more often than the calling function was
+    entered count as being inside a loop, and calls that never ran are left alone.
+    A profile of a function that was never entered says nothing about the copies
+    of it that were inlined elsewhere, so it is ignored.
+
+    The bodies must not contain calls that would be inlined themselves."""
+    cfg = build_cfg(instructions)
+    in_loop: set[int] = set()
+    never_ran: set[int] = set()
+    pos = 0
+    loop_blocks = {b for loop in natural_loops(cfg) for b in loop.blocks}
+    entry_count = (
+        profile.block_count(cfg.blocks[0].instructions) if profile is not None else None
+    )
+    if entry_count == 0:
+        profile = None
+    for b, block in enumerate(cfg.blocks):
+        positions = range(pos, pos + len(block.instructions))
+        count = profile.block_count(block.instructions) if profile is not None else None
+        if count is None or entry_count is None:
+            if b in loop_blocks:
+                in_loop.update(positions)
+        elif count == 0:
+            never_ran.update(positions)
+        elif count > entry_count:
+            in_loop.update(positions)
+        pos += len(block.instructions)
+
+    new_var = new_var_generator(instructions)
+    size = len(instructions)
+    inlined = 0
+    result: list[ir.Instruction] = []
+    for pos, insn in enumerate(cfg.instructions()):
+        if (
+            isinstance(insn, ir.Call)
+            and insn.fun.name in callees
+            and pos not in never_ran
+        ):
+            body = callees[insn.fun.name]
+            limit = loop_function_size if pos in in_loop else small_function_size
+            if _size(body) <= limit and size + len(body) <= max_function_size:
+                inlined += 1
+                code = _inline_body(insn, body, f"{caller}_{inlined}", new_var)
+                result.extend(code)
+                size += len(code)
+                continue
+        result.append(insn)
+    return result
+
+
+def _size(instructions: list[ir.Instruction]) -> int:
+    return sum(1 for insn in instructions if not isinstance(insn, ir.Label))
+
+
+def _inline_body(
+    call: ir.Call,
+    body: list[ir.Instruction],
+    label_prefix: str,
+    new_var: Callable[[], ir.IRVar],
+) -> list[ir.Instruction]:
+    """Returns the body of the called function with its variables and labels renamed,
+    reading its parameters from the arguments and storing its return value in the
+    destination of the call."""
+    # Returns store the value in %rax and jump to the label at the end of the function
+    exit_label = body[-1] if len(body) != 0 and isinstance(body[-1], ir.Label) else None
+    if exit_label is not None:
+        body = body[:-1]
+    continuation = ir.Label(f"{label_prefix}_end", loc=call.loc)
+    result = call.dest if is_local(call.dest) else new_var()
+
+    variables: dict[ir.IRVar, ir.IRVar] = {
+        ir.parameter_var(index): arg for index, arg in enumerate(call.args)
+    }
+    for insn in body:
+        for v in defined_vars(insn) + used_vars(insn):
+            if is_local(v) and v not in variables:
+                variables[v] = new_var()
+    variables[ir.IRVar("%rax")] = result
+
+    labels: dict[str, ir.Label] = {}
+    for insn in body:
+        if isinstance(insn, ir.Label):
+            labels[insn.name] = ir.Label(f"{label_prefix}_{insn.name}", loc=insn.loc)
+    if exit_label is not None:
+        labels[exit_label.name] = continuation
+
+    code: list[ir.Instruction] = []
+    for insn in body:
+        insn = replace_uses(insn, variables)
+        dests = defined_vars(insn)
+        if len(dests) != 0 and dests[0] in variables:
+            insn = replace_dest(insn, variables[dests[0]])
+        match insn:
+            case ir.Label():
+                insn = labels[insn.name]
+            case ir.Jump():
+                insn = replace(insn, label=labels[insn.label.name])
+            case ir.CondJump():
+                insn = replace(
+                    insn,
+                    then_label=labels[insn.then_label.name],
+                    else_label=labels[insn.else_label.name],
+                )
+            case ir.TailCall():
+                code.append(ir.Call(insn.fun, insn.args, result, loc=insn.loc))
+                insn = ir.Jump(continuation, loc=insn.loc)
+        code.append(insn)
+    code.append(continuation)
+    return code
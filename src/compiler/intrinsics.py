@@ -13,23 +13,38 @@ Intrinsic = Callable[[IntrinsicArgs], None]
 
 all_intrinsics: dict[str, Intrinsic] = {}
 
+# The positions of the arguments that each intrinsic accepts as an
+# immediate operand like '$5' instead of a register or memory location
+immediate_operands: dict[str, tuple[int, ...]] = {}
 
-def _intrinsic(name: str) -> Callable[[Intrinsic], Intrinsic]:
+
+def _intrinsic(
+    name: str, immediates: tuple[int, ...] = (0, 1)
+) -> Callable[[Intrinsic], Intrinsic]:
     """Function decorator that registers that function as an intrinsic."""
     def wrapper(f: Intrinsic) -> Intrinsic:
         assert name not in all_intrinsics
         all_intrinsics[name] = f
+        immediate_operands[name] = immediates
         return f
     return wrapper
 
 
-@_intrinsic("unary_-")
+def is_immediate(ref: str) -> bool:
+    return ref.startswith('$')
+
+
+def is_register(ref: str) -> bool:
+    return ref.startswith('%')
+
+
+@_intrinsic("unary_-", immediates=(0,))
 def unary_minus(a: IntrinsicArgs) -> None:
     a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
     a.emit(f'negq {a.result_register}')
 
 
-@_intrinsic("unary_not")
+@_intrinsic("unary_not", immediates=(0,))
 def unary_not(a: IntrinsicArgs) -> None:
     a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
     a.emit(f'xorq $1, {a.result_register}')
@@ -37,6 +52,15 @@ def unary_not(a: IntrinsicArgs) -> None:
 
 @_intrinsic("+")
 def plus(a: IntrinsicArgs) -> None:
+    left, right = a.arg_refs
+    if a.result_register != left and is_register(left):
+        # 'leaq' adds into another register without copying the operand first
+        if is_immediate(right):
+            a.emit(f'leaq {right[1:]}({left}), {a.result_register}')
+            return
+        if is_register(right):
+            a.emit(f'leaq ({left},{right}), {a.result_register}')
+            return
     if a.result_register != a.arg_refs[0]:
         a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
     a.emit(f'addq {a.arg_refs[1]}, {a.result_register}')
@@ -44,6 +68,15 @@ def plus(a: IntrinsicArgs) -> None:
 
 @_intrinsic("-")
 def minus(a: IntrinsicArgs) -> None:
+    left, right = a.arg_refs
+    if (
+        a.result_register != left
+        and is_register(left)
+        and is_immediate(right)
+        and int(right[1:]) != -2**31
+    ):
+        a.emit(f'leaq {-int(right[1:])}({left}), {a.result_register}')
+        return
     if a.result_register != a.arg_refs[0]:
         a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
     a.emit(f'subq {a.arg_refs[1]}, {a.result_register}')
@@ -51,12 +84,20 @@ def minus(a: IntrinsicArgs) -> None:
 
 @_intrinsic("*")
 def multiply(a: IntrinsicArgs) -> None:
+    left, right = a.arg_refs
+    # The three-operand form multiplies by an immediate into any register
+    if is_immediate(right) and not is_immediate(left):
+        a.emit(f'imulq {right}, {left}, {a.result_register}')
+        return
+    if is_immediate(left) and not is_immediate(right):
+        a.emit(f'imulq {left}, {right}, {a.result_register}')
+        return
     if a.result_register != a.arg_refs[0]:
         a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
     a.emit(f'imulq {a.arg_refs[1]}, {a.result_register}')
 
 
-@_intrinsic("/")
+@_intrinsic("/", immediates=(0,))
 def divide(a: IntrinsicArgs) -> None:
     a.emit(f'movq {a.arg_refs[0]}, %rax')
     a.emit('cqto')  # TODO: explain
@@ -65,7 +106,7 @@ def divide(a: IntrinsicArgs) -> None:
         a.emit(f'movq %rax, {a.result_register}')
 
 
-@_intrinsic("%")
+@_intrinsic("%", immediates=(0,))
 def remainder(a: IntrinsicArgs) -> None:
     # Same as division, but remainder is in register 'rdx'
     a.emit(f'movq {a.arg_refs[0]}, %rax')
@@ -75,6 +116,57 @@ def remainder(a: IntrinsicArgs) -> None:
         a.emit(f'movq %rdx, {a.result_register}')
 
 
+# The following intrinsics are not operators of the source language.
+# The optimizer rewrites arithmetic into them.
+
+
+@_intrinsic("<<")
+def shift_left(a: IntrinsicArgs) -> None:
+    _shift(a, 'salq')
+
+
+@_intrinsic(">>")
+def shift_right(a: IntrinsicArgs) -> None:
+    # Arithmetic shift: copies the sign bit into the vacated bits
+    _shift(a, 'sarq')
+
+
+@_intrinsic(">>>")
+def shift_right_logical(a: IntrinsicArgs) -> None:
+    _shift(a, 'shrq')
+
+
+@_intrinsic("&")
+def bitwise_and(a: IntrinsicArgs) -> None:
+    if a.result_register != a.arg_refs[0]:
+        a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
+    a.emit(f'andq {a.arg_refs[1]}, {a.result_register}')
+
+
+@_intrinsic("*hi", immediates=(0,))
+def multiply_high(a: IntrinsicArgs) -> None:
+    # The upper 64 bits of the signed 128-bit product, which 'imulq' with
+    # a single operand leaves in 'rdx'
+    a.emit(f'movq {a.arg_refs[0]}, %rax')
+    a.emit(f'imulq {a.arg_refs[1]}')
+    if a.result_register != '%rdx':
+        a.emit(f'movq %rdx, {a.result_register}')
+
+
+def _shift(a: IntrinsicArgs, shift_insn: str) -> None:
+    count = a.arg_refs[1]
+    if is_immediate(count):
+        # Like the processor, use only the lowest 6 bits of the count
+        count = f'${int(count[1:]) & 63}'
+    else:
+        # The shift count must be in 'cl', the lowest byte of 'rcx'
+        a.emit(f'movq {count}, %rcx')
+        count = '%cl'
+    if a.result_register != a.arg_refs[0]:
+        a.emit(f'movq {a.arg_refs[0]}, {a.result_register}')
+    a.emit(f'{shift_insn} {count}, {a.result_register}')
+
+
 @_intrinsic("==")
 def eq(a: IntrinsicArgs) -> None:
     _int_comparison(a, 'sete')
@@ -105,6 +197,28 @@ def ge(a: IntrinsicArgs) -> None:
     _int_comparison(a, 'setge')
 
 
+# For each comparison, the one that gives the same result with the operands swapped
+swapped_comparisons: dict[str, str] = {
+    '==': '==',
+    '!=': '!=',
+    '<': '>',
+    '<=': '>=',
+    '>': '<',
+    '>=': '<=',
+}
+
+# For each comparison, the conditional jump taken when it is true
+# and the one taken when it is false
+comparison_jumps: dict[str, tuple[str, str]] = {
+    '==': ('je', 'jne'),
+    '!=': ('jne', 'je'),
+    '<': ('jl', 'jge'),
+    '<=': ('jle', 'jg'),
+    '>': ('jg', 'jle'),
+    '>=': ('jge', 'jl'),
+}
+
+
 def _int_comparison(a: IntrinsicArgs, setcc_insn: str) -> None:
     # We use 'al' and 'eax' below, which means the lower bytes of 'rax'
     a.emit('xor %rax, %rax')  # Clear all bits of rax
@@ -94,6 +94,15 @@ class CondJump(Instruction):
     else_label: Label
 
 
+@dataclass(frozen=True)
+class TailCall(Instruction):
+    """Calls a function that returns directly to the caller of the current function,
+    with the result of the call as its return value. Nothing after it is executed."""
+
+    fun: IRVar
+    args: list[IRVar]
+
+
 @dataclass
 class IRTab:
     """Maps code source variables to unique IR variables"""
@@ -102,4 +111,17 @@ class IRTab:
     parent: Self | None
 
 
+# The registers that hold the first arguments of a function when it is called
+argument_registers = ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]
+
+
+def parameter_var(index: int) -> IRVar:
+    """Returns the variable holding the argument at the given position when a function
+    starts: one of the argument registers, or `%argN` for those the caller put on the stack.
+    """
+    if index < len(argument_registers):
+        return IRVar(argument_registers[index])
+    return IRVar(f"%arg{index}")
+
+
 reserved_names: set[str] = set(top_level.locals.keys()) | {"==", "!="}
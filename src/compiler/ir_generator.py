@@ -122,8 +122,7 @@ def generate_ir(
                     l_then = new_label()
                     l_end = new_label()
 
-                    var_cond = visit(expr.condition, ir_table)
-                    ins.append(ir.CondJump(var_cond, l_then, l_end, loc=loc))
+                    visit_condition(expr.condition, ir_table, l_then, l_end)
 
                     ins.append(l_then)
                     visit(expr.then, ir_table, while_start, while_end)
@@ -136,8 +135,7 @@ def generate_ir(
                     l_end = new_label()
 
                     var_result = new_var()
-                    var_cond = visit(expr.condition, ir_table)
-                    ins.append(ir.CondJump(var_cond, l_then, l_else, loc=loc))
+                    visit_condition(expr.condition, ir_table, l_then, l_else)
 
                     ins.append(l_then)
                     var_then = visit(expr.then, ir_table, while_start, while_end)
@@ -173,8 +171,7 @@ def generate_ir(
                 l_block = new_label()
                 l_end = new_label()
                 ins.append(l_cond)
-                var_cond = visit(expr.condition, ir_table)
-                ins.append(ir.CondJump(var_cond, l_block, l_end, loc=loc))
+                visit_condition(expr.condition, ir_table, l_block, l_end)
                 ins.append(l_block)
                 visit(expr.block, ir_table, while_start=l_cond, while_end=l_end)
                 ins.append(ir.Jump(l_cond, loc=loc))
@@ -199,6 +196,36 @@ def generate_ir(
 
         return var_unit
 
+    def visit_condition(
+        expr: ast.Expression,
+        ir_table: ir.IRTab,
+        then_label: ir.Label,
+        else_label: ir.Label,
+    ) -> None:
+        """Emits code that jumps to `then_label` if the condition is true and to
+        `else_label` otherwise, without storing `and`, `or` and `not` results in variables."""
+        loc = expr.loc
+
+        match expr:
+            case ast.Literal() if isinstance(expr.value, bool):
+                ins.append(ir.Jump(then_label if expr.value else else_label, loc=loc))
+
+            case ast.UnaryOp() if expr.op == "not":
+                visit_condition(expr.exp, ir_table, else_label, then_label)
+
+            case ast.BinaryOp() if expr.op in ("and", "or"):
+                right_label = new_label()
+                if expr.op == "and":
+                    visit_condition(expr.left, ir_table, right_label, else_label)
+                else:
+                    visit_condition(expr.left, ir_table, then_label, right_label)
+                ins.append(right_label)
+                visit_condition(expr.right, ir_table, then_label, else_label)
+
+            case _:
+                var_cond = visit(expr, ir_table)
+                ins.append(ir.CondJump(var_cond, then_label, else_label, loc=loc))
+
     root_irtab = ir.IRTab({}, None)
     for name in reserved_names:
         root_irtab.locals[name] = ir.IRVar(name)
@@ -207,16 +234,18 @@ def generate_ir(
 
     fun_insn: dict[str, list[ir.Instruction]] = {}
 
-    registers = ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]
     for fun in mod.funs:
         ins = []
         new_table = ir.IRTab({}, root_irtab)
-        for arg, reg in zip(fun.args, registers):
+        for index, arg in enumerate(fun.args):
             arg_var = new_var()
             new_table.locals[arg.name] = arg_var
-            ins.append(ir.Copy(ir.IRVar(reg), arg_var, loc=fun.loc))
+            ins.append(ir.Copy(ir.parameter_var(index), arg_var, loc=fun.loc))
         exit_label = new_label()
-        visit(fun.body, new_table)
+        var_result = visit(fun.body, new_table)
+        if fun.body.typ != Unit and var_result != var_unit:
+            # The value of the body is returned like the value of `return`
+            ins.append(ir.Copy(var_result, ir.IRVar("%rax"), loc=fun.body.loc))
         ins.append(exit_label)
         fun_insn[fun.name] = ins.copy()
 
@@ -0,0 +1,484 @@
+import struct
+from dataclasses import dataclass, field
+from compiler.encoder import (
+    R_X86_64_64,
+    R_X86_64_PC32,
+    R_X86_64_PLT32,
+    R_X86_64_32,
+    R_X86_64_32S,
+    SHF_ALLOC,
+    SHF_EXECINSTR,
+    SHF_WRITE,
+    SHT_NOBITS,
+    SHT_PROGBITS,
+    SHT_RELA,
+    SHT_STRTAB,
+    SHT_SYMTAB,
+    STB_GLOBAL,
+    STB_LOCAL,
+    StringTable,
+)
+
+# A static executable for the programs we compile: the standard library and
+# the program linked together without any libraries, like 'ld -static' does.
+
+# Where the executable is loaded, the same as the default of 'ld'
+base_address = 0x400000
+page_size = 0x1000
+
+SHT_REL = 9
+SHN_UNDEF = 0
+SHN_ABS = 0xFFF1
+STT_SECTION = 3
+PT_LOAD = 1
+PT_GNU_STACK = 0x6474E551
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+
+@dataclass
+class Section:
+    name: str
+    type: int
+    flags: int
+    data: bytes
+    size: int
+    alignment: int
+
+
+@dataclass
+class ObjectSymbol:
+    name: str
+    bind: int
+    type: int
+    section: int
+    value: int
+    size: int
+
+
+@dataclass
+class ObjectFile:
+    """The sections, symbols and relocations of a relocatable ELF file.
+
+    The sections are indexed like in the file, and the relocations
+    are given for each section as (offset, symbol index, type, addend)."""
+
+    sections: list[Section]
+    symbols: list[ObjectSymbol]
+    relocations: dict[int, list[tuple[int, int, int, int]]] = field(
+        default_factory=dict
+    )
+
+
+class LinkError(Exception):
+    """Raised for object files that cannot be linked, or not by this linker."""
+
+
+def read_object(object_file: bytes) -> ObjectFile:
+    if object_file[:4] != b"\x7fELF" or object_file[4:6] != b"\x02\x01":
+        raise LinkError("Not a 64-bit little-endian ELF file")
+    if struct.unpack_from("<HH", object_file, 16) != (1, 62):
+        raise LinkError("Not a relocatable x86-64 object file")
+    shoff = struct.unpack_from("<Q", object_file, 0x28)[0]
+    shnum, shstrndx = struct.unpack_from("<HH", object_file, 0x3C)
+    headers = [
+        struct.unpack_from("<IIQQQQIIQQ", object_file, shoff + 64 * i)
+        for i in range(shnum)
+    ]
+
+    def contents(index: int) -> bytes:
+        _, type, _, _, offset, size, *_ = headers[index]
+        if type == SHT_NOBITS:
+            return b""
+        return object_file[offset : offset + size]
+
+    def string(table: bytes, offset: int) -> str:
+        return table[offset : table.index(b"\0", offset)].decode()
+
+    section_names = contents(shstrndx)
+    sections = [
+        Section(
+            string(section_names, name),
+            type,
+            flags,
+            contents(index),
+            size,
+            max(alignment, 1),
+        )
+        for index, (name, type, flags, _, _, size, _, _, alignment, _) in enumerate(
+            headers
+        )
+    ]
+
+    symbols: list[ObjectSymbol] = []
+    relocations: dict[int, list[tuple[int, int, int, int]]] = {}
+    for index, (_, type, _, _, _, _, link, info, _, _) in enumerate(headers):
+        if type == SHT_SYMTAB:
+            names = contents(link)
+            for name, symbol_info, _, shndx, value, size in struct.iter_unpack(
+                "<IBBHQQ", contents(index)
+            ):
+                symbols.append(
+                    ObjectSymbol(
+                        string(names, name),
+                        symbol_info >> 4,
+                        symbol_info & 0xF,
+                        shndx,
+                        value,
+                        size,
+                    )
+                )
+        elif type == SHT_RELA and _is_linked(sections[info]):
+            relocations[info] = [
+                (offset, symbol_info >> 32, symbol_info & 0xFFFFFFFF, addend)
+                for offset, symbol_info, addend in struct.iter_unpack(
+                    "<QQq", contents(index)
+                )
+            ]
+        elif type == SHT_REL and _is_linked(sections[info]):
+            raise LinkError("REL relocations are not supported")
+    return ObjectFile(sections, symbols, relocations)
+
+
+def _is_linked(section: Section) -> bool:
+    """Tells whether the section goes into the executable: the sections that are
+    loaded into memory, and the DWARF debug info."""
+    return bool(section.flags & SHF_ALLOC) or section.name.startswith(".debug_")
+
+
+def link(
+    object_files: list[bytes], entry: str = "_start", strip: bool = False
+) -> bytes:
+    """Links relocatable object files into a static executable.
+
+    The sections that are loaded into memory are merged by name and placed in
+    two segments: code and read-only data, then writable data and '.bss'.
+    The debug info sections are concatenated by name, like 'ld' does.
+    With `strip`, the executable has no debug info or symbol table."""
+    objects = [read_object(data) for data in object_files]
+
+    # Order the output sections: code, read-only data, writable data, zeroed data
+    def rank(section: Section) -> int:
+        if section.type == SHT_NOBITS:
+            return 3
+        if section.flags & SHF_EXECINSTR:
+            return 0
+        return 2 if section.flags & SHF_WRITE else 1
+
+    pieces: dict[str, list[tuple[int, int]]] = {}
+    output_sections: dict[str, Section] = {}
+    for object_index, obj in enumerate(objects):
+        for section_index, section in enumerate(obj.sections):
+            if not section.flags & SHF_ALLOC:
+                continue
+            if section.name not in output_sections:
+                output_sections[section.name] = Section(
+                    section.name, section.type, section.flags, b"", 0, 1
+                )
+            pieces.setdefault(section.name, []).append((object_index, section_index))
+    names = sorted(output_sections, key=lambda name: rank(output_sections[name]))
+
+    program_headers = 3
+    headers_size = 64 + 56 * program_headers
+
+    # Assign addresses. The writable segment starts on a new page, at the same
+    # offset within the page as in the file, so that no padding is needed.
+    addresses: dict[tuple[int, int], int] = {}
+    section_addresses: dict[str, int] = {}
+    file_offsets: dict[str, int] = {}
+    offset = headers_size
+    address = base_address + offset
+    text_end: int | None = None
+    for name in names:
+        output = output_sections[name]
+        if rank(output) >= 2 and text_end is None:
+            text_end = offset
+            address = _align(address, page_size) + offset % page_size
+        for object_index, section_index in pieces[name]:
+            section = objects[object_index].sections[section_index]
+            output.alignment = max(output.alignment, section.alignment)
+            padding = _align(address, section.alignment) - address
+            if name not in section_addresses:
+                section_addresses[name] = address + padding
+                file_offsets[name] = offset + padding
+            address += padding
+            if output.type != SHT_NOBITS:
+                offset += padding
+            addresses[(object_index, section_index)] = address
+            address += section.size
+            if output.type != SHT_NOBITS:
+                offset += section.size
+        output.size = address - section_addresses[name]
+    if text_end is None:
+        text_end = offset
+        address = _align(address, page_size) + offset % page_size
+    data_end = offset
+    memory_end = address
+
+    # Debug info is not loaded, and is addressed by its offset in the section
+    debug_sections: dict[str, bytearray] = {}
+    debug_offsets: dict[tuple[int, int], int] = {}
+    if not strip:
+        for object_index, obj in enumerate(objects):
+            for section_index, section in enumerate(obj.sections):
+                if section.flags & SHF_ALLOC or not _is_linked(section):
+                    continue
+                data = debug_sections.setdefault(section.name, bytearray())
+                data += bytes(_align(len(data), section.alignment) - len(data))
+                debug_offsets[(object_index, section_index)] = len(data)
+                data += section.data
+
+    # Resolve the symbols
+    global_symbols: dict[str, int] = {}
+    for object_index, obj in enumerate(objects):
+        for symbol in obj.symbols:
+            if symbol.bind == STB_GLOBAL and symbol.section != SHN_UNDEF:
+                if symbol.name in global_symbols:
+                    raise LinkError(f"Multiple definitions of {symbol.name}")
+                global_symbols[symbol.name] = _symbol_address(
+                    symbol, object_index, addresses
+                )
+    if entry not in global_symbols:
+        raise LinkError(f"Entry symbol {entry} not found")
+
+    image = bytearray(data_end)
+    for name in names:
+        for object_index, section_index in pieces[name]:
+            section = objects[object_index].sections[section_index]
+            start = addresses[(object_index, section_index)]
+            if section.type == SHT_NOBITS:
+                continue
+            position = file_offsets[name] + start - section_addresses[name]
+            image[position : position + section.size] = section.data
+
+    # Apply the relocations
+    locations = addresses | debug_offsets
+    for object_index, obj in enumerate(objects):
+        for section_index, relocations in obj.relocations.items():
+            name = obj.sections[section_index].name
+            if (object_index, section_index) in addresses:
+                buffer = image
+                start = addresses[(object_index, section_index)]
+                file_start = file_offsets[name] + start - section_addresses[name]
+            elif (object_index, section_index) in debug_offsets:
+                buffer = debug_sections[name]
+                start = file_start = debug_offsets[(object_index, section_index)]
+            else:
+                continue
+            for offset_in_section, symbol_index, type, addend in relocations:
+                symbol = obj.symbols[symbol_index]
+                if symbol.section == SHN_UNDEF:
+                    if symbol.name not in global_symbols:
+                        raise LinkError(f"Undefined reference to {symbol.name}")
+                    target = global_symbols[symbol.name]
+                else:
+                    target = _symbol_address(symbol, object_index, locations)
+                place = start + offset_in_section
+                position = file_start + offset_in_section
+                if type == R_X86_64_64:
+                    field_format, value = "<Q", target + addend
+                elif type in (R_X86_64_PC32, R_X86_64_PLT32):
+                    field_format, value = "<i", target + addend - place
+                elif type == R_X86_64_32:
+                    field_format, value = "<I", target + addend
+                elif type == R_X86_64_32S:
+                    field_format, value = "<i", target + addend
+                else:
+                    raise LinkError(f"Unsupported relocation type {type}")
+                try:
+                    struct.pack_into(field_format, buffer, position, value)
+                except struct.error:
+                    raise LinkError(f"Relocation to {symbol.name} out of range")
+
+    symbol_table = None
+    if not strip:
+        symbol_table = _symbol_table(objects, addresses, section_addresses, names)
+    return _executable(
+        bytes(image),
+        global_symbols[entry],
+        text_end,
+        data_end,
+        memory_end,
+        names,
+        output_sections,
+        section_addresses,
+        file_offsets,
+        {name: bytes(data) for name, data in debug_sections.items()},
+        symbol_table,
+    )
+
+
+def _symbol_address(
+    symbol: ObjectSymbol, object_index: int, addresses: dict[tuple[int, int], int]
+) -> int:
+    if symbol.section == SHN_ABS:
+        return symbol.value
+    if (object_index, symbol.section) not in addresses:
+        raise LinkError(f"Symbol {symbol.name} is in an unsupported section")
+    return addresses[(object_index, symbol.section)] + symbol.value
+
+
+def _symbol_table(
+    objects: list[ObjectFile],
+    addresses: dict[tuple[int, int], int],
+    section_addresses: dict[str, int],
+    names: list[str],
+) -> tuple[bytes, bytes, int]:
+    """Returns the symbol table of the executable, its string table and the
+    index of the first global symbol."""
+    strtab = StringTable()
+    local_entries = bytearray(bytes(24))
+    global_entries = bytearray()
+    for object_index, obj in enumerate(objects):
+        for symbol in obj.symbols:
+            if symbol.name == "" or symbol.type == STT_SECTION:
+                continue
+            if symbol.section == SHN_ABS:
+                shndx = SHN_ABS
+            elif (object_index, symbol.section) in addresses:
+                shndx = names.index(obj.sections[symbol.section].name) + 1
+            else:
+                continue
+            address = _symbol_address(symbol, object_index, addresses)
+            entry = struct.pack(
+                "<IBBHQQ",
+                strtab.add(symbol.name),
+                symbol.bind << 4 | symbol.type,
+                0,
+                shndx,
+                address,
+                symbol.size,
+            )
+            if symbol.bind == STB_LOCAL:
+                local_entries += entry
+            else:
+                global_entries += entry
+    return (
+        bytes(local_entries + global_entries),
+        bytes(strtab.data),
+        len(local_entries) // 24,
+    )
+
+
+def _executable(
+    image: bytes,
+    entry: int,
+    text_end: int,
+    data_end: int,
+    memory_end: int,
+    names: list[str],
+    output_sections: dict[str, Section],
+    section_addresses: dict[str, int],
+    file_offsets: dict[str, int],
+    debug_sections: dict[str, bytes],
+    symbol_table: tuple[bytes, bytes, int] | None,
+) -> bytes:
+    data_start = text_end
+    data_address = _align(base_address + text_end, page_size) + text_end % page_size
+    program_headers = [
+        (PT_LOAD, PF_R | PF_X, 0, base_address, text_end, text_end, page_size),
+        (
+            PT_LOAD,
+            PF_R | PF_W,
+            data_start,
+            data_address,
+            data_end - data_start,
+            memory_end - data_address,
+            page_size,
+        ),
+        (PT_GNU_STACK, PF_R | PF_W, 0, 0, 0, 0, 16),
+    ]
+    result = bytearray(image)
+    result[64 : 64 + 56 * len(program_headers)] = b"".join(
+        struct.pack(
+            "<IIQQQQQQ",
+            type,
+            flags,
+            offset,
+            address,
+            address,
+            size,
+            memory_size,
+            alignment,
+        )
+        for type, flags, offset, address, size, memory_size, alignment in program_headers
+    )
+
+    # Section headers, for tools like debuggers and profilers
+    shstrtab = StringTable()
+    section_headers = bytearray(bytes(64))
+    for name in names:
+        output = output_sections[name]
+        section_headers += struct.pack(
+            "<IIQQQQIIQQ",
+            shstrtab.add(name),
+            output.type,
+            output.flags,
+            section_addresses[name],
+            file_offsets[name],
+            output.size,
+            0,
+            0,
+            output.alignment,
+            0,
+        )
+    other_sections = [
+        (name, SHT_PROGBITS, data, 0, 0, 1, 0) for name, data in debug_sections.items()
+    ]
+    if symbol_table is not None:
+        symtab, strtab, first_global = symbol_table
+        strtab_index = len(names) + len(other_sections) + 2
+        other_sections += [
+            (".symtab", SHT_SYMTAB, symtab, strtab_index, first_global, 8, 24),
+            (".strtab", SHT_STRTAB, strtab, 0, 0, 1, 0),
+        ]
+    other_sections.append((".shstrtab", SHT_STRTAB, b"", 0, 0, 1, 0))
+    for name, type, data, link, info, alignment, entry_size in other_sections:
+        name_offset = shstrtab.add(name)
+        if name == ".shstrtab":
+            data = bytes(shstrtab.data)
+        result += bytes(_align(len(result), alignment) - len(result))
+        section_headers += struct.pack(
+            "<IIQQQQIIQQ",
+            name_offset,
+            type,
+            0,
+            0,
+            len(result),
+            len(data),
+            link,
+            info,
+            alignment,
+            entry_size,
+        )
+        result += data
+    result += bytes(_align(len(result), 8) - len(result))
+    section_header_offset = len(result)
+    result += section_headers
+
+    result[:64] = (
+        b"\x7fELF\x02\x01\x01"
+        + bytes(9)
+        + struct.pack(
+            "<HHIQQQIHHHHHH",
+            2,  # Executable file
+            62,  # x86-64
+            1,
+            entry,
+            64,
+            section_header_offset,
+            0,
+            64,
+            56,
+            len(program_headers),
+            64,
+            len(section_headers) // 64,
+            len(section_headers) // 64 - 1,
+        )
+    )
+    return bytes(result)
+
+
+def _align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
@@ -0,0 +1,298 @@
+from compiler import ir
+from compiler.cfg import (
+    ControlFlowGraph,
+    Loop,
+    build_cfg,
+    natural_loops,
+    reaching_definitions,
+    definitions_after,
+    liveness,
+    live_before,
+    defined_vars,
+    used_vars,
+    has_side_effects,
+    is_local,
+    trapping_intrinsics,
+    constant_vars,
+    new_var_generator,
+    wrap_int,
+)
+from compiler.intrinsics import all_intrinsics
+
+
+def hoist_loop_invariants(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Loop-invariant code motion: moves computations whose operands do not
+    change inside a loop to a preheader that runs once before the loop."""
+    cfg = build_cfg(instructions)
+    for loop in natural_loops(cfg):
+        hoisted = _invariant_positions(cfg, loop)
+        if len(hoisted) != 0:
+            instructions = cfg.instructions()
+            return _rewrite_loop(
+                cfg,
+                loop,
+                [instructions[pos] for pos in hoisted],
+                {pos: [] for pos in hoisted},
+            )
+    return instructions
+
+
+def reduce_induction_variables(
+    instructions: list[ir.Instruction],
+) -> list[ir.Instruction]:
+    """Strength reduction: replaces a multiplication `i * k` in a loop, where `i` only
+    changes by `i = i + c` and `k` does not change, with a variable that is kept
+    equal to `i * k` by adding `c * k` to it whenever `i` is incremented."""
+    cfg = build_cfg(instructions)
+    instructions = cfg.instructions()
+    constants = constant_vars(instructions)
+    new_var = new_var_generator(instructions)
+    starts = _block_starts(cfg)
+
+    for loop in natural_loops(cfg):
+        in_loop = sorted(
+            starts[b] + offset
+            for b in loop.blocks
+            for offset in range(len(cfg.blocks[b].instructions))
+        )
+        defs_in_loop: dict[ir.IRVar, list[int]] = {}
+        for pos in in_loop:
+            for v in defined_vars(instructions[pos]):
+                defs_in_loop.setdefault(v, []).append(pos)
+
+        def invariant(v: ir.IRVar) -> bool:
+            return is_local(v) and v not in defs_in_loop
+
+        # Basic induction variables: variable -> (position of its update, operator, step)
+        basic: dict[ir.IRVar, tuple[int, str, ir.IRVar]] = {}
+        for v, positions in defs_in_loop.items():
+            update = instructions[positions[0]]
+            if len(positions) != 1 or not isinstance(update, ir.Call):
+                continue
+            op, args = update.fun.name, update.args
+            if op not in ("+", "-") or len(args) != 2:
+                continue
+            if args[0] == v and invariant(args[1]):
+                basic[v] = (positions[0], op, args[1])
+            elif op == "+" and args[1] == v and invariant(args[0]):
+                basic[v] = (positions[0], op, args[0])
+
+        preheader_code: list[ir.Instruction] = []
+        replacements: dict[int, list[ir.Instruction]] = {}
+        reduced: dict[tuple[ir.IRVar, ir.IRVar], ir.IRVar] = {}
+        for pos in in_loop:
+            insn = instructions[pos]
+            if not isinstance(insn, ir.Call) or insn.fun.name != "*":
+                continue
+            if len(insn.args) != 2 or insn.dest in insn.args:
+                continue
+            a, b = insn.args
+            if a in basic and invariant(b):
+                iv, factor = a, b
+            elif b in basic and invariant(a):
+                iv, factor = b, a
+            else:
+                continue
+
+            if (iv, factor) not in reduced:
+                product = new_var()
+                step = new_var()
+                update_pos, op, increment = basic[iv]
+                update = instructions[update_pos]
+                loc = insn.loc
+                preheader_code.append(
+                    ir.Call(ir.IRVar("*"), [iv, factor], product, loc=loc)
+                )
+                if increment in constants and factor in constants:
+                    value = wrap_int(constants[increment] * constants[factor])
+                    preheader_code.append(ir.LoadIntConst(value, step, loc=loc))
+                else:
+                    preheader_code.append(
+                        ir.Call(ir.IRVar("*"), [increment, factor], step, loc=loc)
+                    )
+                replacements.setdefault(update_pos, [update]).append(
+                    ir.Call(ir.IRVar(op), [product, step], product, loc=update.loc)
+                )
+                reduced[(iv, factor)] = product
+            replacements[pos] = [
+                ir.Copy(reduced[(iv, factor)], insn.dest, loc=insn.loc)
+            ]
+
+        if len(reduced) != 0:
+            return _rewrite_loop(cfg, loop, preheader_code, replacements)
+    return instructions
+
+
+def _block_starts(cfg: ControlFlowGraph) -> list[int]:
+    """Returns the position in `cfg.instructions()` of the first instruction of each block."""
+    starts: list[int] = []
+    pos = 0
+    for block in cfg.blocks:
+        starts.append(pos)
+        pos += len(block.instructions)
+    return starts
+
+
+def _invariant_positions(cfg: ControlFlowGraph, loop: Loop) -> list[int]:
+    """Returns the positions in `cfg.instructions()` of the instructions that
+    can be moved out of the loop, in an order that respects their dependencies."""
+    instructions = cfg.instructions()
+    starts = _block_starts(cfg)
+    in_loop = {
+        starts[b] + offset
+        for b in loop.blocks
+        for offset in range(len(cfg.blocks[b].instructions))
+    }
+
+    sites: dict[ir.IRVar, set[int]] = {}
+    for pos, insn in enumerate(instructions):
+        for v in defined_vars(insn):
+            if is_local(v):
+                sites.setdefault(v, set()).add(pos)
+
+    # Definitions reaching each instruction of the loop
+    reaching: dict[int, set[int]] = {}
+    for b, reach in enumerate(reaching_definitions(cfg)):
+        if b not in loop.blocks:
+            continue
+        for offset, insn in enumerate(cfg.blocks[b].instructions):
+            reaching[starts[b] + offset] = reach
+            reach = definitions_after(starts[b] + offset, insn, reach, sites)
+
+    header_live_in = set(liveness(cfg)[loop.header])
+    for insn in reversed(cfg.blocks[loop.header].instructions):
+        header_live_in = live_before(insn, header_live_in)
+
+    def defs_in_loop(v: ir.IRVar) -> int:
+        return len(sites.get(v, set()) & in_loop)
+
+    def constant_value(v: ir.IRVar, pos: int) -> int | None:
+        values = set()
+        for d in reaching[pos] & sites.get(v, set()):
+            definition = instructions[d]
+            if not isinstance(definition, ir.LoadIntConst):
+                return None
+            values.add(definition.value)
+        return values.pop() if len(values) == 1 else None
+
+    def safe_to_speculate(pos: int) -> bool:
+        insn = instructions[pos]
+        if not isinstance(insn, ir.Call) or insn.fun.name not in trapping_intrinsics:
+            return True
+        if constant_value(insn.args[1], pos) not in (None, 0, -1):
+            return True
+        # The header runs whenever the preheader does, so a division there
+        # that no side effect precedes traps at the same point either way.
+        header_start = starts[loop.header]
+        header_end = header_start + len(cfg.blocks[loop.header].instructions)
+        return header_start <= pos < header_end and not any(
+            has_side_effects(instructions[p]) for p in range(header_start, pos)
+        )
+
+    invariant: list[int] = []
+    changed = True
+    while changed:
+        changed = False
+        for pos in sorted(in_loop):
+            insn = instructions[pos]
+            if pos in invariant or not _is_movable(insn):
+                continue
+            dest = defined_vars(insn)[0]
+            if not is_local(dest) or defs_in_loop(dest) != 1:
+                continue
+            if dest in header_live_in:
+                continue
+            operands_invariant = True
+            for v in used_vars(insn):
+                if not is_local(v):
+                    continue
+                defs_here = reaching[pos] & sites.get(v, set())
+                defs_inside = defs_here & in_loop
+                if len(defs_inside) != 0 and not (
+                    defs_here == defs_inside
+                    and len(defs_inside) == 1
+                    and defs_inside <= set(invariant)
+                ):
+                    operands_invariant = False
+            if operands_invariant and safe_to_speculate(pos):
+                invariant.append(pos)
+                changed = True
+    return invariant
+
+
+def _is_movable(insn: ir.Instruction) -> bool:
+    match insn:
+        case ir.LoadIntConst() | ir.LoadBoolConst() | ir.Copy():
+            return True
+        case ir.Call():
+            return insn.fun.name in all_intrinsics
+    return False
+
+
+def _rewrite_loop(
+    cfg: ControlFlowGraph,
+    loop: Loop,
+    preheader_code: list[ir.Instruction],
+    replacements: dict[int, list[ir.Instruction]],
+) -> list[ir.Instruction]:
+    """Returns the instructions with `preheader_code` added to run once before the loop,
+    and the instructions at the positions in `replacements` replaced."""
+    instructions = cfg.instructions()
+    header = cfg.blocks[loop.header]
+    header_label = header.instructions[0]
+    assert isinstance(header_label, ir.Label)
+
+    outside = [p for p in header.predecessors if p not in loop.blocks]
+    reuse = None
+    if (
+        len(outside) == 1
+        and cfg.blocks[outside[0]].successors == [loop.header]
+        and not isinstance(cfg.blocks[outside[0]].instructions[-1], ir.CondJump)
+    ):
+        reuse = outside[0]
+    else:
+        used_labels = {insn.name for insn in instructions if isinstance(insn, ir.Label)}
+        name = f"{header_label.name}_pre"
+        while name in used_labels:
+            name += "_"
+        preheader = ir.Label(name, loc=header_label.loc)
+
+    def retarget(label: ir.Label) -> ir.Label:
+        return preheader if label.name == header_label.name else label
+
+    result: list[ir.Instruction] = []
+    pos = 0
+    for b, block in enumerate(cfg.blocks):
+        body: list[ir.Instruction] = []
+        for insn in block.instructions:
+            body.extend(replacements.get(pos, [insn]))
+            pos += 1
+
+        if b == reuse:
+            if len(body) != 0 and isinstance(body[-1], ir.Jump):
+                body[-1:-1] = preheader_code
+            else:
+                body.extend(preheader_code)
+        elif reuse is None and b in outside:
+            last = body[-1] if len(body) != 0 else None
+            if isinstance(last, ir.Jump):
+                body[-1] = ir.Jump(retarget(last.label), loc=last.loc)
+            elif isinstance(last, ir.CondJump):
+                body[-1] = ir.CondJump(
+                    last.cond,
+                    retarget(last.then_label),
+                    retarget(last.else_label),
+                    loc=last.loc,
+                )
+
+        if reuse is None and b == loop.header:
+            # A loop block falling through into the header must now jump over the preheader
+            last_result = result[-1] if len(result) != 0 else None
+            if b - 1 in loop.blocks and not isinstance(
+                last_result, (ir.Jump, ir.CondJump)
+            ):
+                result.append(ir.Jump(header_label, loc=header_label.loc))
+            result.append(preheader)
+            result.extend(preheader_code)
+        result.extend(body)
+    return result
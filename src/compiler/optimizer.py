@@ -0,0 +1,360 @@
+from typing import Callable
+from compiler import ir
+from compiler.intrinsics import all_intrinsics
+from compiler.loops import hoist_loop_invariants, reduce_induction_variables
+from compiler.inliner import (
+    call_graph,
+    recursive_functions,
+    bottom_up_order,
+    inline_calls,
+)
+from compiler.tail_calls import eliminate_tail_calls
+from compiler.profile import Profile
+from compiler.cfg import (
+    build_cfg,
+    labels_at,
+    available_copies,
+    copies_after,
+    available_expressions,
+    expressions_after,
+    expression_key,
+    liveness,
+    live_before,
+    replace_uses,
+    replace_dest,
+    is_local,
+    has_side_effects,
+    reachable_blocks,
+    defined_vars,
+    used_vars,
+    constant_vars,
+    new_var_generator,
+    evaluate_intrinsic,
+)
+
+
+def optimize(
+    fun_insn: dict[str, list[ir.Instruction]],
+    level: int = 1,
+    profile: Profile | None = None,
+) -> dict[str, list[ir.Instruction]]:
+    """Runs the IR optimization passes enabled at the given level on every function.
+    A profile from an instrumented build guides the inlining decisions."""
+    if level == 0:
+        return fun_insn
+    # Functions are optimized before the functions calling them, so that
+    # calls are replaced with the optimized body of the function.
+    graph = call_graph(fun_insn)
+    recursive = recursive_functions(graph)
+    optimized: dict[str, list[ir.Instruction]] = {}
+    for name in bottom_up_order(graph):
+        callees = {
+            callee: optimized[callee]
+            for callee in graph[name]
+            if callee in optimized and callee not in recursive
+        }
+        instructions = optimize_function(
+            inline_calls(name, fun_insn[name], callees, profile)
+        )
+        optimized[name] = optimize_function(eliminate_tail_calls(name, instructions))
+    return {name: optimized[name] for name in fun_insn}
+
+
+def optimize_function(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    changed = True
+    while changed:
+        before = instructions
+        instructions = remove_unreachable_code(instructions)
+        instructions = remove_redundant_jumps(instructions)
+        instructions = eliminate_common_subexpressions(instructions)
+        instructions = propagate_copies(instructions)
+        instructions = fold_constants(instructions)
+        instructions = remove_dead_code(coalesce_copies(instructions))
+        instructions = hoist_loop_invariants(instructions)
+        instructions = reduce_induction_variables(instructions)
+        instructions = reduce_strength(instructions)
+        changed = instructions != before
+    return instructions
+
+
+def propagate_copies(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Rewrites uses of a variable copied from another local variable
+    to read the original variable instead."""
+    cfg = build_cfg(instructions)
+    result: list[ir.Instruction] = []
+    for block, copies in zip(cfg.blocks, available_copies(cfg)):
+        for insn in block.instructions:
+            mapping = {dest: source for dest, source in copies}
+            result.append(replace_uses(insn, mapping))
+            copies = copies_after(insn, copies)
+    return result
+
+
+def eliminate_common_subexpressions(
+    instructions: list[ir.Instruction],
+) -> list[ir.Instruction]:
+    """Global value numbering: replaces the computation of a value that is
+    already held in a variable on every path leading here with a copy of it."""
+    cfg = build_cfg(instructions)
+    result: list[ir.Instruction] = []
+    for block, expressions in zip(cfg.blocks, available_expressions(cfg)):
+        for insn in block.instructions:
+            key = expression_key(insn)
+            dest = defined_vars(insn)[0] if key is not None else None
+            holders = sorted(
+                (holder for k, holder in expressions if k == key and holder != dest),
+                key=lambda v: (len(v.name), v.name),
+            )
+            expressions = expressions_after(insn, expressions)
+            if dest is not None and is_local(dest) and len(holders) != 0:
+                insn = ir.Copy(holders[0], dest, loc=insn.loc)
+            result.append(insn)
+    return result
+
+
+def fold_constants(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Computes intrinsics whose arguments are all constants at compile time."""
+    constants = constant_vars(instructions)
+    result: list[ir.Instruction] = []
+    for insn in instructions:
+        if (
+            isinstance(insn, ir.Call)
+            and insn.fun.name in all_intrinsics
+            and is_local(insn.dest)
+            and len(insn.args) != 0
+            and all(arg in constants for arg in insn.args)
+        ):
+            value = evaluate_intrinsic(
+                insn.fun.name, [constants[arg] for arg in insn.args]
+            )
+            if isinstance(value, bool):
+                insn = ir.LoadBoolConst(value, insn.dest, loc=insn.loc)
+            elif value is not None:
+                insn = ir.LoadIntConst(value, insn.dest, loc=insn.loc)
+        result.append(insn)
+    return result
+
+
+def reduce_strength(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Replaces multiplication by a constant power of two with a shift, and
+    division and remainder by a constant with multiplications and shifts."""
+    constants = constant_vars(instructions)
+    new_var = new_var_generator(instructions)
+    result: list[ir.Instruction] = []
+    for insn in instructions:
+        if isinstance(insn, ir.Call) and len(insn.args) == 2:
+            replacement = _arithmetic_by_constant(insn, constants, new_var)
+            if replacement is not None:
+                result.extend(replacement)
+                continue
+        result.append(insn)
+    return result
+
+
+def division_magic(divisor: int) -> tuple[int, int]:
+    """Returns the multiplier M and shift s such that, for every signed 64-bit x,
+    `x / divisor` is the high half of `x * M` (corrected by x if the signs of M and
+    the divisor differ) shifted right by s, plus one if that is negative.
+
+    This is the method of Granlund and Montgomery, as given in Hacker's Delight.
+    The divisor must not be -1, 0 or 1."""
+    assert divisor not in (-1, 0, 1) and -(2**63) <= divisor < 2**63
+    two63 = 2**63
+    ad = abs(divisor)
+    t = two63 + (1 if divisor < 0 else 0)
+    anc = t - 1 - t % ad  # The largest dividend whose remainder is ad - 1
+    p = 63
+    q1, r1 = divmod(two63, anc)
+    q2, r2 = divmod(two63, ad)
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc:
+            q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= ad:
+            q2, r2 = q2 + 1, r2 - ad
+        delta = ad - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)):
+            break
+    multiplier = q2 + 1
+    if divisor < 0:
+        multiplier = -multiplier
+    return (multiplier + two63) % 2**64 - two63, p - 64
+
+
+def _arithmetic_by_constant(
+    insn: ir.Call,
+    constants: dict[ir.IRVar, int],
+    new_var: Callable[[], ir.IRVar],
+) -> list[ir.Instruction] | None:
+    op = insn.fun.name
+    a, b = insn.args
+    if op == "*" and a in constants and b not in constants:
+        a, b = b, a
+    if op not in ("*", "/", "%") or b not in constants:
+        return None
+    divisor = constants[b]
+    power_of_two = divisor > 0 and divisor & (divisor - 1) == 0
+    if op == "*" and not power_of_two:
+        return None
+    # Division by zero must still crash, and -2^63 / -1 overflows
+    if divisor in (0, -1):
+        return None
+    loc = insn.loc
+    dest = insn.dest
+    code: list[ir.Instruction] = []
+
+    def const(value: int) -> ir.IRVar:
+        var = new_var()
+        code.append(ir.LoadIntConst(value, var, loc=loc))
+        return var
+
+    def call(
+        op: str, x: ir.IRVar, y: ir.IRVar, result: ir.IRVar | None = None
+    ) -> ir.IRVar:
+        var = new_var() if result is None else result
+        code.append(ir.Call(ir.IRVar(op), [x, y], var, loc=loc))
+        return var
+
+    if not power_of_two:
+        multiplier, shift = division_magic(divisor)
+        quotient = call("*hi", a, const(multiplier))
+        if divisor > 0 and multiplier < 0:
+            quotient = call("+", quotient, a)
+        elif divisor < 0 and multiplier > 0:
+            quotient = call("-", quotient, a)
+        if shift > 0:
+            quotient = call(">>", quotient, const(shift))
+        # The shifts round towards negative infinity, so a negative quotient is one too small
+        quotient = call(
+            "+",
+            quotient,
+            call(">>>", quotient, const(63)),
+            dest if op == "/" else None,
+        )
+        if op == "%":
+            call("-", a, call("*", quotient, b), dest)
+        return code
+
+    k = divisor.bit_length() - 1
+    if k == 0:
+        if op == "%":
+            code.append(ir.LoadIntConst(0, dest, loc=loc))
+        else:
+            code.append(ir.Copy(a, dest, loc=loc))
+        return code
+
+    if op == "*":
+        call("<<", a, const(k), dest)
+        return code
+
+    # Shifting right rounds towards negative infinity, but division must round
+    # towards zero, so negative numbers get 2^k - 1 added to them first.
+    if k == 1:
+        bias = call(">>>", a, const(63))
+    else:
+        bias = call(">>>", call(">>", a, const(63)), const(64 - k))
+    biased = call("+", a, bias)
+    if op == "/":
+        call(">>", biased, const(k), dest)
+    else:
+        call("-", call("&", biased, const(divisor - 1)), bias, dest)
+    return code
+
+
+def remove_unreachable_code(
+    instructions: list[ir.Instruction],
+) -> list[ir.Instruction]:
+    """Removes the blocks that no path from the start of the function reaches,
+    such as code after a `return`, `break` or `continue`."""
+    cfg = build_cfg(instructions)
+    reached = reachable_blocks(cfg)
+    return [
+        insn
+        for i, block in enumerate(cfg.blocks)
+        if i in reached
+        for insn in block.instructions
+    ]
+
+
+def remove_redundant_jumps(
+    instructions: list[ir.Instruction],
+) -> list[ir.Instruction]:
+    """Removes jumps to the label right after them, and then the labels that
+    nothing jumps to, so that the blocks before and after them merge."""
+    kept: list[ir.Instruction] = []
+    for i, insn in enumerate(instructions):
+        if isinstance(insn, ir.Jump) and insn.label.name in labels_at(
+            instructions, i + 1
+        ):
+            continue
+        kept.append(insn)
+
+    targets: set[str] = set()
+    for insn in kept:
+        match insn:
+            case ir.Jump():
+                targets.add(insn.label.name)
+            case ir.CondJump():
+                targets.update([insn.then_label.name, insn.else_label.name])
+    return [
+        insn for insn in kept if not isinstance(insn, ir.Label) or insn.name in targets
+    ]
+
+
+def remove_dead_code(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Removes instructions without side effects whose result is never read.
+
+    Calls that must stay for their side effects stop storing an unused result."""
+    cfg = build_cfg(instructions)
+    result: list[ir.Instruction] = []
+    for block, live_out in zip(cfg.blocks, liveness(cfg)):
+        kept: list[ir.Instruction] = []
+        live = live_out
+        for insn in reversed(block.instructions):
+            dests = [v for v in defined_vars(insn) if is_local(v)]
+            if len(dests) != 0 and dests[0] not in live:
+                if not has_side_effects(insn):
+                    continue
+                insn = replace_dest(insn, ir.IRVar("unit"))
+            if isinstance(insn, ir.Copy) and insn.source == insn.dest:
+                continue
+            kept.append(insn)
+            live = live_before(insn, live)
+        result.extend(reversed(kept))
+    return result
+
+
+def coalesce_copies(instructions: list[ir.Instruction]) -> list[ir.Instruction]:
+    """Makes a temporary that is only computed to be copied into another variable
+    a few instructions later be computed straight into that variable."""
+    def_count: dict[ir.IRVar, int] = {}
+    use_count: dict[ir.IRVar, int] = {}
+    for insn in instructions:
+        for v in defined_vars(insn):
+            def_count[v] = def_count.get(v, 0) + 1
+        for v in used_vars(insn):
+            use_count[v] = use_count.get(v, 0) + 1
+
+    result = list(instructions)
+    for i, insn in enumerate(result):
+        if not isinstance(insn, ir.Copy):
+            continue
+        temp, dest = insn.source, insn.dest
+        if not is_local(temp) or not is_local(dest) or temp == dest:
+            continue
+        if def_count.get(temp) != 1 or use_count.get(temp) != 1:
+            continue
+        # Walk back within the block to the definition of the temporary
+        for j in reversed(range(i)):
+            prev = result[j]
+            if isinstance(prev, (ir.Label, ir.Jump, ir.CondJump)):
+                break
+            if temp in defined_vars(prev):
+                result[j] = replace_dest(prev, dest)
+                result[i] = replace_uses(insn, {temp: dest})
+                break
+            if dest in defined_vars(prev) or dest in used_vars(prev):
+                break
+    return result
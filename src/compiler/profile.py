@@ -0,0 +1,65 @@
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from compiler import ir
+
+# Profiles recorded by instrumented programs, for profile-guided optimization.
+#
+# An instrumented program counts how many times each basic block runs. When
+# `main` returns, it writes `profile_magic` followed by a record for each source
+# location in each block: the row and column of the location and the count of the
+# block, as three little-endian 64-bit integers. Keying the counts by source
+# location lets a profile guide a compilation whose code differs from the
+# instrumented build, for example because of different inlining decisions.
+
+profile_magic = b"PROFILE1"
+record_format = "<qqq"
+record_size = struct.calcsize(record_format)
+
+
+class ProfileError(Exception):
+    """Raised for files that are not profiles written by an instrumented program."""
+
+
+@dataclass
+class Profile:
+    """How many times the code from each source location ran in a training run,
+    as (row, column) -> count. A location in several blocks has the count of
+    the one that ran the most."""
+
+    counts: dict[tuple[int, int], int] = field(default_factory=dict)
+
+    def block_count(self, instructions: list[ir.Instruction]) -> int | None:
+        """Estimates how many times a block of these instructions runs: the lowest
+        count of its source locations, or None if none of them has a count."""
+        counts = [
+            self.counts[loc]
+            for loc in block_locations(instructions)
+            if loc in self.counts
+        ]
+        return min(counts, default=None)
+
+
+def block_locations(instructions: list[ir.Instruction]) -> list[tuple[int, int]]:
+    """Returns the distinct source locations of the instructions, in order."""
+    result: dict[tuple[int, int], None] = {}
+    for insn in instructions:
+        if insn.loc.row >= 0:
+            result[(insn.loc.row, insn.loc.col)] = None
+    return list(result)
+
+
+def parse_profile(data: bytes) -> Profile:
+    if not data.startswith(profile_magic):
+        raise ProfileError("Not a profile written by an instrumented program")
+    records = data[len(profile_magic) :]
+    if len(records) % record_size != 0:
+        raise ProfileError("Truncated profile")
+    profile = Profile()
+    for row, col, count in struct.iter_unpack(record_format, records):
+        profile.counts[(row, col)] = max(count, profile.counts.get((row, col), 0))
+    return profile
+
+
+def read_profile(path: str) -> Profile:
+    return parse_profile(Path(path).read_bytes())
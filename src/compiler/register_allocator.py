@@ -0,0 +1,390 @@
+from dataclasses import dataclass, field
+from compiler import ir
+from compiler.cfg import (
+    build_cfg,
+    natural_loops,
+    liveness,
+    live_before,
+    defined_vars,
+    used_vars,
+    is_local,
+)
+from compiler.intrinsics import all_intrinsics
+from compiler.profile import Profile
+
+# Registers that called functions preserve, so values in them survive calls
+callee_saved_registers = ["%rbx", "%r12", "%r13", "%r14", "%r15"]
+
+# Registers that called functions may overwrite
+caller_saved_registers = ["%rsi", "%rdi", "%r8", "%r9", "%r10"]
+
+# %rax, %rcx, %rdx and %r11 are left out: instructions use them as scratch registers.
+
+
+@dataclass
+class LiveInterval:
+    """The range of instruction positions from the first to the last
+    at which a variable holds a value that may still be read."""
+
+    var: ir.IRVar
+    start: int
+    end: int
+    crosses_call: bool = False
+
+
+@dataclass
+class RegisterAllocation:
+    """The registers chosen for the variables of one function.
+
+    Variables without a register are kept in the stack frame."""
+
+    registers: dict[ir.IRVar, str] = field(default_factory=dict)
+    # For each call, the caller-saved registers holding values needed after it
+    saved_at_calls: dict[int, list[str]] = field(default_factory=dict)
+    # The callee-saved registers the function uses, which it must restore before returning
+    callee_saved: list[str] = field(default_factory=list)
+    # For variables without a register, the index of their 8-byte stack slot
+    stack_slots: dict[ir.IRVar, int] = field(default_factory=dict)
+
+
+def live_after(instructions: list[ir.Instruction]) -> list[set[ir.IRVar]]:
+    """Returns the local variables live after each instruction."""
+    cfg = build_cfg(instructions)
+    result: list[set[ir.IRVar]] = []
+    for block, live_out in zip(cfg.blocks, liveness(cfg)):
+        live = {v for v in live_out if is_local(v)}
+        block_result: list[set[ir.IRVar]] = []
+        for insn in reversed(block.instructions):
+            block_result.append(live)
+            live = live_before(insn, live)
+        result.extend(reversed(block_result))
+    return result
+
+
+def live_intervals(
+    instructions: list[ir.Instruction],
+) -> tuple[list[LiveInterval], dict[int, set[ir.IRVar]]]:
+    """Returns the live interval of each local variable, ordered by start, and
+    the variables live across each call of a function."""
+    ranges: dict[ir.IRVar, list[int]] = {}
+    across_calls: dict[int, set[ir.IRVar]] = {}
+
+    def extend(v: ir.IRVar, pos: int) -> None:
+        if v in ranges:
+            ranges[v][0] = min(ranges[v][0], pos)
+            ranges[v][1] = max(ranges[v][1], pos)
+        else:
+            ranges[v] = [pos, pos]
+
+    for pos, (insn, live) in enumerate(zip(instructions, live_after(instructions))):
+        defs = [v for v in defined_vars(insn) if is_local(v)]
+        uses = [v for v in used_vars(insn) if is_local(v)]
+        for v in list(live) + defs + uses:
+            extend(v, pos)
+        if _is_function_call(insn):
+            across_calls[pos] = live - set(defs)
+
+    intervals = [LiveInterval(v, start, stop) for v, (start, stop) in ranges.items()]
+    for interval in intervals:
+        interval.crosses_call = any(
+            interval.var in live for live in across_calls.values()
+        )
+    intervals.sort(key=lambda i: (i.start, i.end, len(i.var.name), i.var.name))
+    return intervals, across_calls
+
+
+def _is_function_call(insn: ir.Instruction) -> bool:
+    return isinstance(insn, ir.Call) and insn.fun.name not in all_intrinsics
+
+
+def _parameter_reads(instructions: list[ir.Instruction]) -> dict[str, int]:
+    """Returns the position of the last instruction reading each allocatable register
+    directly. Argument registers hold the parameters until the function copies them."""
+    reserved_until: dict[str, int] = {}
+    for pos, insn in enumerate(instructions):
+        for v in used_vars(insn):
+            if v.name in caller_saved_registers:
+                reserved_until[v.name] = pos
+    return reserved_until
+
+
+def allocate_registers(instructions: list[ir.Instruction]) -> RegisterAllocation:
+    """Linear scan register allocation.
+
+    Walks the live intervals in order of their start and gives each a register
+    that no overlapping interval holds. When there is none, the interval that
+    ends last is left in memory. A copy, or an operation whose first operand is
+    read for the last time, puts its result in the register of its source, and
+    parameters stay in the registers they are passed in when they can."""
+    intervals, across_calls = live_intervals(instructions)
+    reserved_until = _parameter_reads(instructions)
+
+    allocation = RegisterAllocation()
+    active: list[LiveInterval] = []
+    by_var = {interval.var: interval for interval in intervals}
+
+    def available(register: str, interval: LiveInterval) -> bool:
+        return interval.start >= reserved_until.get(register, -1)
+
+    for interval in intervals:
+        active = [a for a in active if a.end >= interval.start]
+        in_use = {allocation.registers[a.var] for a in active}
+
+        # Coalescing: reuse the register of a source that dies here
+        source = _coalescing_source(instructions[interval.start], interval.var)
+        if source in allocation.registers and by_var[source].end == interval.start:
+            active.remove(by_var[source])
+            in_use.discard(allocation.registers[source])
+            allocation.registers[interval.var] = allocation.registers[source]
+            active.append(interval)
+            continue
+        if (
+            source is not None
+            and source.name in caller_saved_registers
+            and source.name not in in_use
+            and available(source.name, interval)
+            and not interval.crosses_call
+        ):
+            allocation.registers[interval.var] = source.name
+            active.append(interval)
+            continue
+
+        if interval.crosses_call:
+            preferred = callee_saved_registers + caller_saved_registers
+        else:
+            preferred = caller_saved_registers + callee_saved_registers
+        free = [r for r in preferred if r not in in_use and available(r, interval)]
+        if len(free) != 0:
+            allocation.registers[interval.var] = free[0]
+            active.append(interval)
+            continue
+
+        # Spill the interval that stays live the longest
+        candidates = [
+            a for a in active if available(allocation.registers[a.var], interval)
+        ]
+        victim = max(candidates, key=lambda a: a.end, default=None)
+        if victim is not None and victim.end > interval.end:
+            allocation.registers[interval.var] = allocation.registers.pop(victim.var)
+            active.remove(victim)
+            active.append(interval)
+
+    _record_saved_registers(allocation, across_calls)
+    allocation.stack_slots = assign_stack_slots(instructions, allocation.registers)
+    return allocation
+
+
+def assign_stack_slots(
+    instructions: list[ir.Instruction], registers: dict[ir.IRVar, str]
+) -> dict[ir.IRVar, int]:
+    """Gives each local variable without a register a stack slot,
+    sharing slots between variables that are never live at the same time."""
+    # A variable can be live before the first instruction that mentions it,
+    # for example after loop rotation, so every variable gets an entry first
+    conflicts: dict[ir.IRVar, set[ir.IRVar]] = {}
+    for insn in instructions:
+        for v in defined_vars(insn) + used_vars(insn):
+            if is_local(v):
+                conflicts.setdefault(v, set())
+    for insn, live in zip(instructions, live_after(instructions)):
+        defs = [v for v in defined_vars(insn) if is_local(v)]
+        for d in defs:
+            for v in live:
+                if v != d:
+                    conflicts[d].add(v)
+                    conflicts[v].add(d)
+
+    slots: dict[ir.IRVar, int] = {}
+    for v in conflicts:
+        if v not in registers:
+            taken = {slots[n] for n in conflicts[v] if n in slots}
+            slot = 0
+            while slot in taken:
+                slot += 1
+            slots[v] = slot
+    return slots
+
+
+def _record_saved_registers(
+    allocation: RegisterAllocation, across_calls: dict[int, set[ir.IRVar]]
+) -> None:
+    used = set(allocation.registers.values())
+    allocation.callee_saved = [r for r in callee_saved_registers if r in used]
+    for pos, live in across_calls.items():
+        saved = {allocation.registers[v] for v in live if v in allocation.registers}
+        allocation.saved_at_calls[pos] = [
+            r for r in caller_saved_registers if r in saved
+        ]
+
+
+def _coalescing_source(insn: ir.Instruction, dest: ir.IRVar) -> ir.IRVar | None:
+    """Returns the variable whose register `dest` could share
+    if that variable is not needed after the instruction defining `dest`."""
+    match insn:
+        case ir.Copy() if insn.dest == dest:
+            return insn.source
+        case ir.Call() if insn.dest == dest and insn.fun.name in all_intrinsics:
+            if len(insn.args) != 0:
+                return insn.args[0]
+    return None
+
+
+def color_registers(
+    instructions: list[ir.Instruction], profile: Profile | None = None
+) -> RegisterAllocation:
+    """Graph coloring register allocation in the style of Chaitin and Briggs.
+
+    Variables that are live at the same time interfere and must get different
+    registers. Copies between variables that do not interfere are coalesced when
+    that cannot make the graph harder to color. Variables are then removed from
+    the graph one by one, those with fewer neighbours than there are registers
+    first, and otherwise the one that is cheapest to keep in memory, counting each
+    use and definition ten times for each loop around it, or with a profile, as
+    many times as its block ran. Registers are given in the reverse order, and
+    variables that find none left are kept in memory."""
+    registers = callee_saved_registers + caller_saved_registers
+    k = len(registers)
+    after = live_after(instructions)
+    reserved_until = _parameter_reads(instructions)
+
+    # Interference graph
+    neighbours: dict[ir.IRVar, set[ir.IRVar]] = {}
+    moves: list[tuple[ir.IRVar, ir.IRVar]] = []
+    across_calls: dict[int, set[ir.IRVar]] = {}
+    crosses_call: set[ir.IRVar] = set()
+    forbidden: dict[ir.IRVar, set[str]] = {}
+    # Parameters prefer the register they arrive in, and arguments the one they are passed in
+    register_hints: dict[ir.IRVar, str] = {}
+
+    def node(v: ir.IRVar) -> set[ir.IRVar]:
+        return neighbours.setdefault(v, set())
+
+    for pos, (insn, live) in enumerate(zip(instructions, after)):
+        defs = [v for v in defined_vars(insn) if is_local(v)]
+        uses = [v for v in used_vars(insn) if is_local(v)]
+        for v in defs + uses:
+            node(v)
+        for d in defs:
+            for v in live:
+                # A copy does not make its source and destination interfere
+                if v != d and not (isinstance(insn, ir.Copy) and v == insn.source):
+                    node(d).add(v)
+                    node(v).add(d)
+        if isinstance(insn, ir.Call) and insn.fun.name in all_intrinsics:
+            # Operations write their result before reading the second operand
+            for v in uses:
+                if v not in defs and v != insn.args[0]:
+                    node(insn.dest).add(v)
+                    node(v).add(insn.dest)
+        source = _coalescing_source(insn, defs[0]) if len(defs) != 0 else None
+        if source is not None and is_local(source):
+            moves.append((defs[0], source))
+        elif source is not None and source.name in registers:
+            register_hints.setdefault(defs[0], source.name)
+        if isinstance(insn, ir.Call | ir.TailCall) and not (
+            isinstance(insn, ir.Call) and insn.fun.name in all_intrinsics
+        ):
+            for arg, register in zip(insn.args, ir.argument_registers):
+                if is_local(arg) and register in registers:
+                    register_hints.setdefault(arg, register)
+        if _is_function_call(insn):
+            across_calls[pos] = live - set(defs)
+            crosses_call |= across_calls[pos]
+        for register, last_read in reserved_until.items():
+            # The instruction reading the register last can also write it
+            if pos < last_read:
+                for v in live | set(defs):
+                    forbidden.setdefault(v, set()).add(register)
+
+    # Spill costs weighted by loop depth, or by how many times the block ran
+    cfg = build_cfg(instructions)
+    weights = [1] * len(cfg.blocks)
+    for loop in natural_loops(cfg):
+        for b in loop.blocks:
+            weights[b] *= 10
+    if profile is not None:
+        for b, block in enumerate(cfg.blocks):
+            count = profile.block_count(block.instructions)
+            if count is not None:
+                weights[b] = count + 1
+    cost: dict[ir.IRVar, float] = {v: 0 for v in neighbours}
+    for b, block in enumerate(cfg.blocks):
+        for insn in block.instructions:
+            for v in defined_vars(insn) + used_vars(insn):
+                if v in cost:
+                    cost[v] += weights[b]
+
+    # Conservative coalescing (Briggs): merge `a` and `b` if the merged node has
+    # fewer than k neighbours of significant degree
+    alias: dict[ir.IRVar, ir.IRVar] = {}
+
+    def find(v: ir.IRVar) -> ir.IRVar:
+        while v in alias:
+            v = alias[v]
+        return v
+
+    changed = True
+    while changed:
+        changed = False
+        for x, y in moves:
+            x, y = find(x), find(y)
+            if x == y or y in neighbours[x]:
+                continue
+            merged = neighbours[x] | neighbours[y]
+            if sum(1 for n in merged if len(neighbours[n]) >= k) >= k:
+                continue
+            alias[y] = x
+            for n in neighbours.pop(y):
+                neighbours[n].discard(y)
+                neighbours[n].add(x)
+                neighbours[x].add(n)
+            cost[x] += cost.pop(y)
+            if y in register_hints:
+                register_hints.setdefault(x, register_hints[y])
+            forbidden.setdefault(x, set()).update(forbidden.get(y, set()))
+            if y in crosses_call:
+                crosses_call.add(x)
+            changed = True
+
+    # Simplify, choosing potential spills by cost when every node has k neighbours
+    degree = {v: len(ns) for v, ns in neighbours.items()}
+    stack: list[ir.IRVar] = []
+    remaining = set(neighbours)
+    while len(remaining) != 0:
+        low = [v for v in remaining if degree[v] < k]
+        if len(low) != 0:
+            v = min(low, key=lambda v: (len(v.name), v.name))
+        else:
+            v = min(remaining, key=lambda v: (cost[v] / degree[v], v.name))
+        remaining.remove(v)
+        stack.append(v)
+        for n in neighbours[v]:
+            degree[n] -= 1
+
+    # Select, preferring the register of a move partner
+    partners: dict[ir.IRVar, list[ir.IRVar]] = {}
+    for x, y in moves:
+        partners.setdefault(find(x), []).append(find(y))
+        partners.setdefault(find(y), []).append(find(x))
+    colors: dict[ir.IRVar, str] = {}
+    for v in reversed(stack):
+        taken = {colors[n] for n in neighbours[v] if n in colors}
+        taken |= forbidden.get(v, set())
+        if v in crosses_call:
+            preferred = registers
+        else:
+            preferred = caller_saved_registers + callee_saved_registers
+        hints = [colors[p] for p in partners.get(v, []) if p in colors]
+        if v in register_hints and v not in crosses_call:
+            hints.insert(0, register_hints[v])
+        free = [r for r in hints + preferred if r not in taken]
+        if len(free) != 0:
+            colors[v] = free[0]
+
+    allocation = RegisterAllocation()
+    for v in list(neighbours) + list(alias):
+        if find(v) in colors:
+            allocation.registers[v] = colors[find(v)]
+    _record_saved_registers(allocation, across_calls)
+    allocation.stack_slots = assign_stack_slots(instructions, allocation.registers)
+    return allocation
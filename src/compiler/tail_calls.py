@@ -0,0 +1,102 @@
+from compiler import ir
+from compiler.cfg import new_var_generator
+from compiler.intrinsics import all_intrinsics
+
+
+def eliminate_tail_calls(
+    name: str, instructions: list[ir.Instruction]
+) -> list[ir.Instruction]:
+    """Rewrites calls whose result the function returns right away.
+
+    A call of the function itself becomes an assignment of the arguments to
+    the parameters and a jump back to the start of the function. Calls of other
+    functions become a `TailCall`, which reuses the stack frame of the function."""
+    if name == "main" or len(instructions) == 0:
+        return instructions
+
+    # The parameters are copied from the argument registers and the stack at the start
+    parameters: dict[ir.IRVar, ir.IRVar] = {}
+    entry = 0
+    while entry < len(instructions):
+        insn = instructions[entry]
+        # Earlier passes drop the copies of parameters that are never read,
+        # so the copies need not cover every position
+        if not isinstance(insn, ir.Copy) or not (
+            insn.source.name in ir.argument_registers
+            or insn.source.name.startswith("%arg")
+        ):
+            break
+        parameters[insn.source] = insn.dest
+        entry += 1
+
+    # Returns jump to the labels at the end of the function
+    exit_labels: set[str] = set()
+    for insn in reversed(instructions):
+        if not isinstance(insn, ir.Label):
+            break
+        exit_labels.add(insn.name)
+
+    new_var = new_var_generator(instructions)
+    start = ir.Label(f"{name}_start", loc=instructions[0].loc)
+    self_calls = 0
+    result: list[ir.Instruction] = []
+    i = 0
+    while i < len(instructions):
+        insn = instructions[i]
+        end = _tail_call_end(instructions, i, exit_labels)
+        if (
+            end is None
+            or not isinstance(insn, ir.Call)
+            or insn.fun.name in all_intrinsics
+            or (insn.fun.name != name and len(insn.args) > len(ir.argument_registers))
+        ):
+            result.append(insn)
+            i += 1
+            continue
+
+        if insn.fun.name == name:
+            # The arguments may read the parameters, so they are all
+            # evaluated before any parameter is assigned.
+            assignments: list[tuple[ir.IRVar, ir.IRVar]] = []
+            for index, arg in enumerate(insn.args):
+                if ir.parameter_var(index) in parameters:
+                    temp = new_var()
+                    result.append(ir.Copy(arg, temp, loc=insn.loc))
+                    assignments.append((temp, parameters[ir.parameter_var(index)]))
+            for temp, param in assignments:
+                result.append(ir.Copy(temp, param, loc=insn.loc))
+            result.append(ir.Jump(start, loc=insn.loc))
+            self_calls += 1
+        else:
+            result.append(ir.TailCall(insn.fun, insn.args, loc=insn.loc))
+        i = end
+
+    if self_calls != 0:
+        result.insert(entry, start)
+    return result
+
+
+def _tail_call_end(
+    instructions: list[ir.Instruction], pos: int, exit_labels: set[str]
+) -> int | None:
+    """If the instruction at `pos` is a call that the function returns the result of,
+    returns the position after the instructions that return it, otherwise None."""
+    call = instructions[pos]
+    if not isinstance(call, ir.Call):
+        return None
+    pos += 1
+    if pos < len(instructions):
+        insn = instructions[pos]
+        if isinstance(insn, ir.Copy) and insn.dest.name == "%rax":
+            if insn.source != call.dest:
+                return None
+            pos += 1
+    if pos == len(instructions):
+        return pos
+    insn = instructions[pos]
+    if isinstance(insn, ir.Jump) and insn.label.name in exit_labels:
+        return pos + 1
+    if isinstance(insn, ir.Label) and insn.name in exit_labels:
+        # Falls through to the end of the function
+        return pos
+    return None
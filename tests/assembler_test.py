@@ -0,0 +1,68 @@
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from compiler.assembler import assemble, stdlib_object
+
+program = """
+    .global main
+    .section .text
+main:
+    movq $42, %rdi
+    callq print_int
+    ret
+"""
+
+
+def test_stdlib_object_cache() -> None:
+    with tempfile.TemporaryDirectory(prefix="assembler_test_") as wd:
+        cache_dir = Path(wd) / "cache"
+        old_cache_dir = os.environ.get("COMPILER_CACHE_DIR")
+        os.environ["COMPILER_CACHE_DIR"] = cache_dir.as_posix()
+        try:
+            # Assembled on first use and reused afterwards
+            first = stdlib_object(wd, link_with_c=False)
+            cached = list(cache_dir.glob("stdlib-*.o"))
+            assert len(cached) == 1
+            assert first == os.path.join(wd, "stdlib.o")
+            assert stdlib_object(wd, link_with_c=False) == cached[0].as_posix()
+
+            # The variant for linking with C is cached separately
+            with_c = stdlib_object(wd, link_with_c=True)
+            assert with_c == os.path.join(wd, "stdlib.o")
+            assert len(list(cache_dir.glob("stdlib-*.o"))) == 2
+            assert stdlib_object(wd, link_with_c=True) != cached[0].as_posix()
+
+            # A broken cache entry is rebuilt
+            cached[0].write_bytes(b"")
+            assert stdlib_object(wd, link_with_c=False) == first
+            assert stdlib_object(wd, link_with_c=False) == cached[0].as_posix()
+
+            executable = os.path.join(wd, "a.out")
+            assemble(program, executable, workdir=wd)
+            result = subprocess.run([executable], capture_output=True, check=True)
+            assert result.stdout == b"42\n"
+        finally:
+            if old_cache_dir is None:
+                del os.environ["COMPILER_CACHE_DIR"]
+            else:
+                os.environ["COMPILER_CACHE_DIR"] = old_cache_dir
+
+
+def test_unsupported_code_uses_as() -> None:
+    code = """
+    .global main
+    .section .text
+main:
+    movq value(%rip), %rdi
+    callq print_int
+    ret
+    .section .data
+value:
+    .quad 1234
+"""
+    with tempfile.TemporaryDirectory(prefix="assembler_test_") as wd:
+        executable = os.path.join(wd, "a.out")
+        assemble(code, executable)
+        result = subprocess.run([executable], capture_output=True, check=True)
+    assert result.stdout == b"1234\n"
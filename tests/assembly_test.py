@@ -2,8 +2,23 @@ from compiler.tokenizer import tokenize
 from compiler.parser import parse
 from compiler.typechecker import typecheck
 from compiler.ir_generator import generate_ir
-from compiler.assembly_generator import generate_assembly
-from compiler.ir import reserved_names
+from compiler.assembly_generator import (
+    generate_assembly,
+    layout_blocks,
+    select_immediates,
+)
+from compiler.ir import (
+    reserved_names,
+    LoadIntConst,
+    Call,
+    IRVar,
+    CondJump,
+    Label,
+    Jump,
+    Instruction,
+)
+from compiler.profile import Profile
+from compiler.token import Location
 
 
 def test_assembly_gen() -> None:
@@ -15,14 +30,15 @@ def test_assembly_gen() -> None:
                 program,
                 reserved_names,
             ),
+            0,
         )
         == """.extern print_int
 .extern print_bool
 .extern read_int
 .global main
-.type main, @function
 .section .text
 
+.type main, @function
 main:
 pushq %rbp
 movq %rsp, %rbp
@@ -35,7 +51,7 @@ movq $1, -8(%rbp)
 movq -8(%rbp), %rax
 movq %rax, -16(%rbp)
 
-# CondJump((0, 16), X_1, Label((-1, -1), L_0), Label((-1, -1), L_1))
+# CondJump((0, 19), X_1, Label((-1, -1), L_0), Label((-1, -1), L_1))
 cmpq $0, -16(%rbp)
 jne .LL_0
 jmp .LL_1
@@ -72,5 +88,181 @@ movq $0, %rax
 movq %rbp, %rsp
 popq %rbp
 ret
+.size main, .-main
 """
     )
+
+
+def test_layout_blocks_with_profile() -> None:
+    # while i < n do { if c then print_int(i); i = i + 1 }
+    instructions = [
+        LoadIntConst(0, IRVar("X_0"), loc=Location(0, 0)),
+        Label("L_0", loc=Location(1, 0)),
+        Call(
+            IRVar("<"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2"), loc=Location(1, 6)
+        ),
+        CondJump(IRVar("X_2"), Label("L_1"), Label("L_2"), loc=Location(1, 0)),
+        Label("L_1", loc=Location(2, 0)),
+        CondJump(IRVar("X_3"), Label("L_3"), Label("L_4"), loc=Location(2, 3)),
+        Label("L_3", loc=Location(3, 0)),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit"), loc=Location(3, 5)),
+        Label("L_4", loc=Location(4, 0)),
+        Call(
+            IRVar("+"), [IRVar("X_0"), IRVar("X_4")], IRVar("X_0"), loc=Location(4, 4)
+        ),
+        Jump(Label("L_0"), loc=Location(1, 0)),
+        Label("L_2", loc=Location(5, 0)),
+    ]
+    counts = {(0, 0): 1, (1, 0): 101, (1, 6): 101, (2, 0): 100, (2, 3): 100}
+    counts |= {(3, 0): 2, (3, 5): 2, (4, 0): 100, (4, 4): 100, (5, 0): 1}
+    # The rarely taken branch moves past the loop, before the block at the end
+    assert layout_blocks(instructions, Profile(counts)) == [
+        LoadIntConst(0, IRVar("X_0")),
+        Jump(Label("L_0")),
+        Label("L_1"),
+        CondJump(IRVar("X_3"), Label("L_3"), Label("L_4")),
+        Label("L_4"),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_4")], IRVar("X_0")),
+        Jump(Label("L_0")),
+        Label("L_0"),
+        Call(IRVar("<"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+        Label("L_3"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        Jump(Label("L_4")),
+        Label("L_2"),
+    ]
+    # Without a profile, it stays where it is
+    assert layout_blocks(instructions)[4:7] == [
+        Label("L_3"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        Label("L_4"),
+    ]
+
+
+def test_line_info() -> None:
+    program = parse(tokenize("var x = read_int();\n  print_int(x);"))
+    typecheck(program)
+    assembly = generate_assembly(
+        generate_ir(program, reserved_names), 1, False, 'dir/"a".txt'
+    )
+    assert assembly.startswith('.file 1 "dir/\\"a\\".txt"\n')
+    assert "\nmain:\n.loc 1 1 9\npushq %rbp\n" in assembly
+    assert "\nmovq %rax, %rsi\n.loc 1 2 3\nmovq %rsi, %rdi\n" in assembly
+    assert ".loc" not in generate_assembly(generate_ir(program, reserved_names), 1)
+
+
+def test_layout_blocks() -> None:
+    # while i < n do { i = i + 1 }
+    assert layout_blocks(
+        [
+            LoadIntConst(0, IRVar("X_0")),
+            Label("L_0"),
+            Call(IRVar("<"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+            CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+            Label("L_1"),
+            Call(IRVar("+"), [IRVar("X_0"), IRVar("X_3")], IRVar("X_0")),
+            Jump(Label("L_0")),
+            Label("L_2"),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        ]
+    ) == [
+        LoadIntConst(0, IRVar("X_0")),
+        Jump(Label("L_0")),
+        Label("L_1"),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_3")], IRVar("X_0")),
+        Jump(Label("L_0")),
+        Label("L_0"),
+        Call(IRVar("<"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+        Label("L_2"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+    ]
+
+    # A loop at the start of the function is not rotated, since the function
+    # must test the condition before the first iteration
+    loop_first: list[Instruction] = [
+        Label("L_0"),
+        Call(IRVar("<"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+        Label("L_1"),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_3")], IRVar("X_0")),
+        Jump(Label("L_0")),
+        Label("L_2"),
+    ]
+    assert layout_blocks(loop_first) == loop_first
+
+
+def test_compare_and_branch() -> None:
+    program = parse(tokenize("var i = 0; while i < 10 do { i = i + 1; }"))
+    typecheck(program)
+    code = generate_assembly(generate_ir(program, reserved_names))
+    instructions = [
+        line
+        for line in code.splitlines()
+        if line != "" and not line.startswith("#") and not line.startswith(".")
+    ]
+    # The loop condition is at the bottom and jumps back to the body
+    assert instructions[-4:-1] == [
+        "cmpq $10, %rsi",
+        "jl .LL_1",
+        "movq $0, %rax",
+    ]
+    assert "setl %al" not in code
+    assert code.count("jmp") == 1
+
+
+def test_stack_frame() -> None:
+    # Forty variables live at the same time, then forty others
+    source = "var x = read_int();\n"
+    for prefix in ["a", "b"]:
+        for i in range(40):
+            source += f"var {prefix}{i} = x * {i + 3};\n"
+        source += f"print_int({' + '.join(f'{prefix}{i}' for i in range(40))});\n"
+    program = parse(tokenize(source))
+    typecheck(program)
+    for opt_level in [0, 1, 2]:
+        code = generate_assembly(generate_ir(program, reserved_names), opt_level)
+        frame_sizes = [
+            int(line.split("$")[1].split(",")[0])
+            for line in code.splitlines()
+            if line.startswith("subq $")
+        ]
+        assert all(size % 16 == 0 for size in frame_sizes)
+        if opt_level > 0:
+            # The second forty variables reuse the slots of the first
+            assert frame_sizes[0] < 40 * 8
+
+
+def test_calls_and_frames() -> None:
+    program = parse(tokenize("""
+            fun double(x: Int): Int { return 2 * x; }
+            print_int(double(read_int()));
+            """))
+    typecheck(program)
+    code = generate_assembly(generate_ir(program, reserved_names))
+    double = code[code.index("double:") : code.index("main:")]
+    # A function that calls nothing does not need a stack frame
+    assert "%rbp" not in double
+    assert "callq double" in code
+    assert "callq *%rax" not in code
+    assert "callq *%rax" in generate_assembly(generate_ir(program, reserved_names), 0)
+
+
+def test_select_immediates() -> None:
+    instructions = [
+        LoadIntConst(1, IRVar("X_0")),
+        LoadIntConst(8, IRVar("X_1")),
+        Call(IRVar("read_int"), [], IRVar("X_2")),
+        Call(IRVar("+"), [IRVar("X_2"), IRVar("X_0")], IRVar("X_3")),
+        Call(IRVar("/"), [IRVar("X_3"), IRVar("X_1")], IRVar("X_4")),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+    ]
+    # The divisor of 'idivq' cannot be an immediate, so X_1 stays
+    assert select_immediates(instructions) == [
+        LoadIntConst(8, IRVar("X_1")),
+        Call(IRVar("read_int"), [], IRVar("X_2")),
+        Call(IRVar("+"), [IRVar("X_2"), IRVar("$1")], IRVar("X_3")),
+        Call(IRVar("/"), [IRVar("X_3"), IRVar("X_1")], IRVar("X_4")),
+        Call(IRVar("print_int"), [IRVar("$1")], IRVar("unit")),
+    ]
@@ -0,0 +1,69 @@
+from compiler.cfg import (
+    build_cfg,
+    dominators,
+    natural_loops,
+    reaching_definitions,
+    liveness,
+    Loop,
+)
+from compiler.ir import (
+    LoadIntConst,
+    Call,
+    IRVar,
+    CondJump,
+    Label,
+    Jump,
+    Copy,
+)
+
+# var x = 0; while x < 10 do { if x == 5 then break; x = x + 1 }
+loop_program = [
+    LoadIntConst(0, IRVar("X_0")),
+    Label("L_0"),
+    Call(IRVar("<"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+    CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+    Label("L_1"),
+    Call(IRVar("=="), [IRVar("X_0"), IRVar("X_3")], IRVar("X_4")),
+    CondJump(IRVar("X_4"), Label("L_2"), Label("L_3")),
+    Label("L_3"),
+    Call(IRVar("+"), [IRVar("X_0"), IRVar("X_5")], IRVar("X_6")),
+    Copy(IRVar("X_6"), IRVar("X_0")),
+    Jump(Label("L_0")),
+    Label("L_2"),
+    Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+]
+
+
+def test_build_cfg() -> None:
+    cfg = build_cfg(loop_program)
+    assert [len(block.instructions) for block in cfg.blocks] == [1, 3, 3, 4, 2]
+    assert [block.successors for block in cfg.blocks] == [[1], [2, 4], [4, 3], [1], []]
+    assert [block.predecessors for block in cfg.blocks] == [
+        [],
+        [0, 3],
+        [1],
+        [2],
+        [1, 2],
+    ]
+    assert cfg.instructions() == loop_program
+
+
+def test_dominators_and_loops() -> None:
+    cfg = build_cfg(loop_program)
+    assert dominators(cfg) == [{0}, {0, 1}, {0, 1, 2}, {0, 1, 2, 3}, {0, 1, 4}]
+    assert natural_loops(cfg) == [Loop(header=1, blocks={1, 2, 3})]
+
+
+def test_data_flow() -> None:
+    cfg = build_cfg(loop_program)
+    assert liveness(cfg) == [
+        {IRVar("X_0"), IRVar("X_1"), IRVar("X_3"), IRVar("X_5")},
+        {IRVar("X_0"), IRVar("X_1"), IRVar("X_3"), IRVar("X_5")},
+        {IRVar("X_0"), IRVar("X_1"), IRVar("X_3"), IRVar("X_5")},
+        {IRVar("X_0"), IRVar("X_1"), IRVar("X_3"), IRVar("X_5")},
+        set(),
+    ]
+    # Both the initial value (position 0) and the incremented value
+    # (position 9) of X_0 reach every block of the loop and the exit
+    reaching = {0, 2, 5, 8, 9}
+    assert reaching_definitions(cfg) == [set(), reaching, reaching, reaching, reaching]
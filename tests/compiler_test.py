@@ -0,0 +1,597 @@
+import os
+import random
+import select
+import subprocess
+import tempfile
+from pathlib import Path
+from compiler.__main__ import call_compiler, compile_to_assembly
+from compiler.tokenizer import tokenize
+from compiler.parser import parse
+from compiler.typechecker import typecheck
+from compiler.ir_generator import generate_ir
+from compiler.ir import reserved_names
+from compiler.assembly_generator import generate_assembly
+from compiler.assembler import assemble
+
+programs_dir = Path(__file__).parent.parent / "programs"
+
+
+def run(source_code: str, input: str = "", opt_level: int = 1) -> str:
+    """Compiles and runs the program, returning what it printed."""
+    executable = call_compiler(source_code, opt_level)
+    with tempfile.TemporaryDirectory(prefix="compiler_test_") as wd:
+        path = os.path.join(wd, "a.out")
+        with open(path, "wb") as f:
+            f.write(executable)
+        os.chmod(path, 0o755)
+        result = subprocess.run(
+            [path], input=input, capture_output=True, text=True, check=True
+        )
+    return result.stdout
+
+
+def test_sample_programs() -> None:
+    cases = [
+        ("prime.txt", "97\n", "1\n"),
+        ("prime.txt", "91\n", "0\n"),
+        ("divisors.txt", "28\n", "1\n2\n4\n7\n14\n28\n"),
+        ("funny.txt", "", "25\n25\n215\n21\n2\n0\ntrue\n"),
+        ("whatever.txt", "", "1\n3\n5\n7\n9\ntrue\n"),
+    ]
+    for name, input, expected in cases:
+        source_code = (programs_dir / name).read_text()
+        for opt_level in [0, 1, 2]:
+            assert run(source_code, input, opt_level) == expected
+
+
+def test_copies_and_loops() -> None:
+    program = """
+        var a = 1;
+        var b = a;
+        var i = 0;
+        while i < 3 do {
+            var c = b;
+            b = a + b;
+            a = c;
+            i = i + 1;
+        }
+        print_int(a);
+        b
+    """
+    for opt_level in [0, 1]:
+        assert run(program, opt_level=opt_level) == "3\n5\n"
+
+
+def test_function_result() -> None:
+    # Functions return the value of their body without `return`
+    program = """
+        fun f1(a: Int, b: Int): Int { if b > a then { var v3 = a; } b }
+        fun is_small(x: Int): Bool { if x < 10 then true else false }
+        fun g(x: Int): Int {
+            if x > 0 then { return x; }
+            var y = -x;
+            y
+        }
+        print_int(f1(1, 2));
+        print_bool(is_small(3));
+        print_int(g(5) + g(-7));
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "", opt_level) == "2\ntrue\n12\n"
+
+
+def test_dead_code() -> None:
+    program = """
+        fun f(x: Int): Int {
+            return x + 1;
+            print_int(x);
+            x * 2
+        }
+        var i = 0;
+        while true do {
+            i = i + 1;
+            var unused = i * i + 3;
+            var divided = 10 / i;
+            if i == 3 then {
+                break;
+                print_int(-1);
+            }
+            continue;
+            print_int(-2);
+        }
+        print_int(f(i));
+        read_int();
+    """
+    for opt_level in [0, 1]:
+        assert run(program, "5\n", opt_level) == "4\n"
+
+    # The last computation of a body is its return value
+    program = "fun sq(x: Int): Int { x * x } print_int(sq(7))"
+    for opt_level in [0, 1, 2]:
+        assert run(program, "", opt_level) == "49\n"
+
+
+def test_common_subexpressions() -> None:
+    program = """
+        var a = read_int();
+        var b = 3;
+        var x = a * b;
+        if a > 0 then {
+            a = a + 1;
+        }
+        var y = a * b;
+        var c = a;
+        a = 10;
+        var z = c * b + a * b;
+        var i = 1;
+        while i < 20 do {
+            if a % i == 0 then print_int(i);
+            if i % 2 == 0 then { a = a + 1; }
+            i = i + 1;
+        }
+        print_int(x);
+        print_int(y);
+        z
+    """
+    for opt_level in [0, 1]:
+        assert run(program, "4\n", opt_level) == "1\n2\n6\n18\n19\n12\n15\n45\n"
+
+
+def test_loop_invariants() -> None:
+    program = """
+        var n = read_int();
+        var d = read_int();
+        var i = 0;
+        var x = 0;
+        while i < n do {
+            x = x + n * 3;
+            if d != 0 then {
+                x = x + n / d;
+            }
+            i = i + 1;
+        }
+        print_int(x);
+        while i > 0 do {
+            var k = 2;
+            i = i - k;
+            print_int(i * k);
+        }
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "4\n0\n", opt_level) == "48\n4\n0\n"
+        assert run(program, "3\n2\n", opt_level) == "30\n2\n-2\n"
+
+
+def test_power_of_two_arithmetic() -> None:
+    program = """
+        var x = read_int();
+        print_int(x * 4);
+        print_int(x / 2);
+        print_int(x % 2);
+        print_int(x / 16);
+        print_int(x % 16);
+        print_int(x / 1);
+        print_int(x % 1);
+        print_int(x / 4611686018427387904);
+        print_int(x % 4611686018427387904);
+    """
+    values = [0, 1, -1, 2, -2, 15, -15, 17, -17, 9223372036854775807]
+    values += [-9223372036854775807, 4611686018427387904, -4611686018427387905]
+    for x in values:
+        expected = []
+        for op, d in [
+            ("*", 4),
+            ("/", 2),
+            ("%", 2),
+            ("/", 16),
+            ("%", 16),
+            ("/", 1),
+            ("%", 1),
+            ("/", 2**62),
+            ("%", 2**62),
+        ]:
+            if op == "*":
+                result = (x * d + 2**63) % 2**64 - 2**63
+            elif op == "/":
+                result = abs(x) // d * (1 if x >= 0 else -1)
+            else:
+                result = x - abs(x) // d * (1 if x >= 0 else -1) * d
+            expected.append(f"{result}\n")
+        for opt_level in [0, 1]:
+            assert run(program, f"{x}\n", opt_level) == "".join(expected)
+
+
+def test_division_by_constant() -> None:
+    program = """
+        var n = read_int();
+        while n > 0 do {
+            var x = read_int();
+            print_int(x / 3);
+            print_int(x % 3);
+            print_int(x / 10);
+            print_int(x % 10);
+            print_int(x / -7);
+            print_int(x % -7);
+            print_int(x / 1000000007);
+            print_int(x % 1000000007);
+            print_int(x / 9223372036854775807);
+            print_int(x % 9223372036854775807);
+            var d = 5 * 5;
+            print_int(x / d);
+            print_int(x % d);
+            print_int(x / -d);
+            print_int(x % -d);
+            n = n - 1;
+        }
+    """
+    divisors = [3, 10, -7, 1000000007, 2**63 - 1, 25, -25]
+    rng = random.Random(31)
+    values = [0, 1, -1, 9, -9, 10, -10, 2**63 - 1, -(2**63) + 1]
+    values += [rng.randrange(-(2**63) + 1, 2**63) for _ in range(100)]
+    expected = []
+    for x in values:
+        for d in divisors:
+            quotient = abs(x) // abs(d) * (1 if (x < 0) == (d < 0) else -1)
+            expected.append(f"{quotient}\n{x - quotient * d}\n")
+    input = f"{len(values)}\n" + "".join(f"{x}\n" for x in values)
+    assert run(program, input) == "".join(expected)
+
+
+def test_constant_arguments() -> None:
+    program = """
+        fun f(a: Int, b: Int, c: Int): Int { return a * b + c; }
+        print_int(f(3, -2, -1));
+    """
+    for opt_level in [0, 1]:
+        assert run(program, "", opt_level) == "-7\n"
+
+
+def test_conditions() -> None:
+    program = """
+        fun check(x: Int, result: Bool): Bool {
+            print_int(x);
+            return result;
+        }
+        var a = read_int();
+        if a > 0 and check(1, true) or check(2, false) then print_int(10);
+        if not (a > 0 or check(3, true)) then print_int(20) else print_int(30);
+        var i = 0;
+        while not (i >= 3) and (a != 0 or check(4, false)) do {
+            i = i + 1;
+        }
+        print_int(i);
+        var b = a > 5 or a < -5;
+        print_bool(not b);
+    """
+    for opt_level in [0, 1]:
+        assert run(program, "1\n", opt_level) == "1\n10\n30\n3\ntrue\n"
+        assert run(program, "0\n", opt_level) == "2\n3\n30\n4\n0\ntrue\n"
+
+    # A loop at the very start of the program tests its condition first
+    program = "while read_int() != read_int() do { print_int(read_int()) }"
+    for opt_level in [0, 1, 2]:
+        assert run(program, "1\n1\n", opt_level) == ""
+        assert run(program, "1\n2\n7\n3\n3\n", opt_level) == "7\n"
+
+
+def test_inlining() -> None:
+    program = """
+        fun max(a: Int, b: Int): Int {
+            if a > b then { return a; }
+            return b;
+        }
+        fun sum_to(n: Int): Int {
+            var s = 0;
+            var i = 1;
+            while i <= n do {
+                s = s + i;
+                i = i + 1;
+            }
+            return s;
+        }
+        fun twice(x: Int): Int { return max(x, 0) + max(x, 0); }
+        fun fact(n: Int): Int {
+            if n <= 1 then { return 1; }
+            return n * fact(n - 1);
+        }
+        fun report(x: Int): Unit { print_int(x); }
+        fun apply(f: (Int) => Unit, x: Int): Unit { f(x); }
+        var n = read_int();
+        var i = 0;
+        var t = 0;
+        while i < n do {
+            t = t + max(i, 3) + sum_to(i);
+            i = i + 1;
+        }
+        report(t);
+        report(twice(-5) + twice(n));
+        report(fact(n));
+        var r = report;
+        apply(r, sum_to(n));
+    """
+    for opt_level in [0, 1]:
+        assert run(program, "5\n", opt_level) == "36\n10\n120\n15\n"
+
+    # The inlined value of a body without `return` is the result of the call
+    program = """
+        fun h(x: Int): Int { var y = x * 3; print_int(y); y + 1 }
+        print_int(h(2));
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "", opt_level) == "6\n7\n"
+
+
+def test_tail_calls() -> None:
+    program = """
+        fun sum(n: Int, acc: Int): Int {
+            if n == 0 then { return acc; }
+            return sum(n - 1, acc + n);
+        }
+        fun is_even(n: Int): Bool {
+            if n == 0 then { return true; }
+            return is_odd(n - 1);
+        }
+        fun is_odd(n: Int): Bool {
+            if n == 0 then { return false; }
+            return is_even(n - 1);
+        }
+        fun countdown(n: Int): Unit {
+            if n % 250000 == 0 then print_int(n);
+            if n > 0 then countdown(n - 1);
+        }
+        var n = read_int();
+        print_int(sum(n, 0));
+        print_bool(is_even(n));
+        print_bool(is_odd(n));
+        countdown(n);
+    """
+    assert run(program, "10\n", 0) == "55\ntrue\nfalse\n0\n"
+    # Without tail calls, this many nested calls would overflow the stack
+    assert run(program, "1000000\n") == (
+        "500000500000\ntrue\nfalse\n1000000\n750000\n500000\n250000\n0\n"
+    )
+
+    # A parameter that is overwritten before it is read has no entry copy,
+    # but the parameters after it are still reassigned
+    program = """
+        fun r(n: Int, a: Int, x: Int): Int {
+            if n <= 0 then { return x; }
+            x = -9;
+            return r(n - 1, x * 3, x + 5);
+        }
+        print_int(r(3, -2, -1));
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "", opt_level) == "-4\n"
+
+
+def test_induction_variables() -> None:
+    program = """
+        var n = read_int();
+        var k = read_int();
+        var i = n;
+        var total = 0;
+        while i > -n do {
+            total = total + i * k + 3 * i;
+            i = i - 3;
+            if i % 2 == 0 then continue;
+            print_int(i * k);
+        }
+        total
+    """
+    for opt_level in [0, 1]:
+        assert run(program, "5\n-4\n", opt_level) == "4\n28\n-2\n"
+
+
+def test_register_allocation() -> None:
+    program = """
+        fun fib(n: Int): Int {
+            if n < 2 then { return n; }
+            return fib(n - 1) + fib(n - 2);
+        }
+        fun rot(a: Int, b: Int, c: Int, d: Int, e: Int, n: Int): Int {
+            if n == 0 then { return a * 10000 + b * 1000 + c * 100 + d * 10 + e; }
+            var r = rot(b, c, a, e, d, n - 1);
+            return r + 0 * a;
+        }
+        fun swap(a: Int, b: Int, n: Int): Int {
+            if n == 0 then { return a * 10 + b; }
+            return swap(b, a, n - 1) + 0;
+        }
+        var x = read_int();
+        var a = x + 1; var b = x + 2; var c = x + 3; var d = x + 4; var e = x + 5;
+        var f = x + 6; var g = x + 7; var h = x + 8; var i = x + 9; var j = x + 10;
+        var k = x * 2; var l = x * 3; var m = x * 4; var p = x * 5; var o = x * 6;
+        print_int(fib(x));
+        print_int(a + b + c + d + e + f + g + h + i + j + k + l + m + p + o);
+        print_int(a * b - c * d + e * f - g * h + i * j - k * l + m * p - o);
+        print_int(rot(1, 2, 3, 4, 5, x));
+        print_int(swap(1, 2, x));
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "10\n", opt_level) == "55\n355\n1604\n23145\n12\n"
+
+    # The body reuses i * 3 from the loop condition, which loop rotation
+    # moves below the body
+    program = """
+        var n = read_int();
+        var i = 0;
+        while i * 3 < n do {
+            var z = i + 1;
+            print_int(i * 3);
+            i = z;
+        }
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "10\n", opt_level) == "0\n3\n6\n9\n"
+
+
+def test_stack_arguments() -> None:
+    program = """
+        fun weigh(a: Int, b: Int, c: Int, d: Int, e: Int, f: Int, g: Int, h: Int, i: Int): Int {
+            return a + 2 * b + 3 * c + 4 * d + 5 * e + 6 * f + 7 * g + 8 * h + 9 * i;
+        }
+        fun seven(a: Int, b: Int, c: Int, d: Int, e: Int, f: Int, g: Int): Int {
+            if g == 0 then { return a * 1000000 + b * 100000 + c * 10000 + d * 1000 + e * 100 + f * 10; }
+            var r = seven(g, a, b, c, d, e, f - 1);
+            return r + 1;
+        }
+        fun count(n: Int, acc: Int, x3: Int, x4: Int, x5: Int, x6: Int, x7: Int, step: Int): Int {
+            if n == 0 then { return acc + x7; }
+            return count(n - 1, acc + step, x3, x4, x5, x6, x7, step);
+        }
+        fun pick(k: Int, a: Int, b: Int, c: Int, d: Int, e: Int, g: (Int) => Int, h: (Int) => Int): Int {
+            if k == 0 then { return g(a); }
+            return h(b) + pick(k - 1, a, b, c, d, e, g, h);
+        }
+        fun twice(x: Int): Int { return 2 * x; }
+        fun neg(x: Int): Int { return -x; }
+        var n = read_int();
+        print_int(weigh(n, n + 1, n + 2, n + 3, n + 4, n + 5, n + 6, n + 7, n + 8));
+        print_int(seven(1, 2, 3, 4, 5, 6, n));
+        print_int(count(n * 1000, 0, 1, 2, 3, 4, 5, 3));
+        var t = twice;
+        var u = neg;
+        print_int(pick(n, 5, 6, 0, 0, 0, t, u));
+        print_int(weigh(1, 2, 3, 4, 5, 6, 7, 8, 9) + weigh(9, 8, 7, 6, 5, 4, 3, 2, 1));
+    """
+    for opt_level in [0, 1, 2]:
+        assert run(program, "3\n", opt_level) == "375\n1234536\n9005\n-8\n450\n"
+
+
+def test_immediate_operands() -> None:
+    program = """
+        fun sub3(a: Int, b: Int, c: Int, d: Int, e: Int, f: Int, g: Int): Int { return a - b - c - d - e - f - g; }
+        var x = read_int();
+        var y = read_int();
+        print_int(x + 1);
+        print_int(x - 5);
+        print_int(x - -2147483648);
+        print_int(7 - x);
+        print_int(x * 12);
+        print_int(-3 * y);
+        print_int(100 / x);
+        print_int(100 % y);
+        print_int(x * 4294967296);
+        print_int(x + 3000000000);
+        if 10 > x then print_int(1) else print_int(2);
+        if x <= 3 then print_int(3) else print_int(4);
+        if x == 0 then print_int(5) else print_int(6);
+        if y != 0 then print_int(7) else print_int(8);
+        var z = x < 100;
+        print_bool(z);
+        print_int(sub3(1000, x, 20, y, 7, 1, 2));
+        var i = 0;
+        var s = 0;
+        while i < 20 do { s = s + i * 3 + 1; i = i + 2; }
+        print_int(s);
+        print_int(y / 8);
+        print_int(y % 16);
+        print_int(x * 8 + y / 4);
+    """
+    expected = "8 2 2147483655 0 84 111 14 26 30064771072 3000000007 1 4 6 7 true 1000 280 -4 -5 47"
+    for opt_level in [0, 1, 2]:
+        assert run(program, "7\n-37\n", opt_level).split() == expected.split()
+
+
+def test_buffered_output() -> None:
+    program = """
+        var i = 0;
+        while i < 20000 do {
+            print_int(i);
+            print_bool(i % 2 == 0);
+            i = i + 1;
+        }
+    """
+    expected = "".join(f"{i}\n{str(i % 2 == 0).lower()}\n" for i in range(20000))
+    assert run(program) == expected
+
+    # Output is written before the program waits for input
+    program = "print_int(1); print_int(read_int());"
+    with tempfile.TemporaryDirectory(prefix="compiler_test_") as wd:
+        path = os.path.join(wd, "a.out")
+        with open(path, "wb") as f:
+            f.write(call_compiler(program))
+        os.chmod(path, 0o755)
+        process = subprocess.Popen(
+            [path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        assert process.stdin is not None and process.stdout is not None
+        ready, _, _ = select.select([process.stdout], [], [], 5)
+        assert ready == [process.stdout]
+        assert process.stdout.readline() == "1\n"
+        output, _ = process.communicate("2\n")
+        assert output == "2\n"
+
+
+def test_buffered_output_with_c() -> None:
+    program = parse(tokenize("print_int(1); print_bool(false);"))
+    typecheck(program)
+    code = generate_assembly(generate_ir(program, reserved_names))
+    with tempfile.TemporaryDirectory(prefix="compiler_test_") as wd:
+        path = os.path.join(wd, "a.out")
+        assemble(code, path, workdir=wd, link_with_c=True)
+        result = subprocess.run([path], capture_output=True, text=True, check=True)
+    assert result.stdout == "1\nfalse\n"
+
+
+def test_read_int() -> None:
+    program = "print_int(read_int()); print_int(read_int()); print_int(read_int());"
+    assert run(program, "  12abc\n--5\n-x7") == "12\n5\n-7\n"
+
+    # Many numbers, filling the input buffer several times
+    numbers = [random.randint(-(10**12), 10**12) for _ in range(20000)]
+    program = """
+        var n = read_int();
+        var sum = 0;
+        while n > 0 do { sum = sum + read_int(); n = n - 1; }
+        sum
+    """
+    input = f"{len(numbers)}\n" + "".join(f"{x}\n" for x in numbers)
+    assert run(program, input) == f"{sum(numbers)}\n"
+
+    # Running out of input is an error
+    with tempfile.TemporaryDirectory(prefix="compiler_test_") as wd:
+        path = os.path.join(wd, "a.out")
+        with open(path, "wb") as f:
+            f.write(call_compiler("print_int(read_int()); print_int(read_int());"))
+        os.chmod(path, 0o755)
+        result = subprocess.run([path], input="3\n", capture_output=True, text=True)
+    assert result.returncode == 1
+    assert result.stdout == "3\n"
+    assert "read_int() failed" in result.stderr
+
+
+def test_print_int() -> None:
+    edge_cases = [0, 1, -1, 9, 10, 99, 100, 101, 2**63 - 1, -(2**63), -(2**63) + 1]
+    edge_cases += [
+        sign * 10**k + d for k in range(19) for d in [-1, 0] for sign in [1, -1]
+    ]
+    # About three million random values, spread evenly over the magnitudes
+    numbers = edge_cases + [
+        random.randint(-(2**bits), 2**bits - 1)
+        for bits in range(1, 64)
+        for _ in range(48000)
+    ]
+    program = "var n = read_int(); while n > 0 do { print_int(read_int()); n = n - 1; }"
+    input = f"{len(numbers)}\n" + "".join(f"{x}\n" for x in numbers)
+    assert run(program, input) == "".join(f"{x}\n" for x in numbers)
+
+
+def test_release_mode() -> None:
+    source_code = (programs_dir / "prime.txt").read_text()
+    debug = call_compiler(source_code)
+    release = call_compiler(source_code, release=True)
+    assert b".symtab" in debug
+    assert b".symtab" not in release
+    assert len(release) < len(debug)
+    assert "#" in compile_to_assembly(source_code)
+    assert "#" not in compile_to_assembly(source_code, release=True)
+
+    with tempfile.TemporaryDirectory(prefix="compiler_test_") as wd:
+        path = os.path.join(wd, "a.out")
+        with open(path, "wb") as f:
+            f.write(release)
+        os.chmod(path, 0o755)
+        result = subprocess.run([path], input="97\n", capture_output=True, text=True)
+    assert result.stdout == "1\n"
@@ -0,0 +1,185 @@
+import os
+import struct
+import subprocess
+import tempfile
+from pathlib import Path
+from compiler.__main__ import compile_to_assembly
+from compiler.encoder import assemble_object, R_X86_64_PC32, R_X86_64_PLT32
+
+programs_dir = Path(__file__).parent.parent / "programs"
+
+
+def gnu_as(assembly_code: str) -> bytes:
+    with tempfile.TemporaryDirectory(prefix="encoder_test_") as wd:
+        path = os.path.join(wd, "program.o")
+        subprocess.run(
+            ["as", "-o" + path, "--"], input=assembly_code, text=True, check=True
+        )
+        return Path(path).read_bytes()
+
+
+def text_and_relocations(
+    object_file: bytes,
+) -> tuple[bytes, list[tuple[int, int, str, int]]]:
+    """Returns the '.text' section of an ELF object file and its relocations
+    as (offset, type, symbol name, addend), sorted by offset."""
+    shoff = struct.unpack_from("<Q", object_file, 0x28)[0]
+    shnum, shstrndx = struct.unpack_from("<HH", object_file, 0x3C)
+    headers = [
+        struct.unpack_from("<IIQQQQIIQQ", object_file, shoff + 64 * i)
+        for i in range(shnum)
+    ]
+
+    def contents(index: int) -> bytes:
+        offset, size = headers[index][4], headers[index][5]
+        return object_file[offset : offset + size]
+
+    def string(table: bytes, offset: int) -> str:
+        return table[offset : table.index(b"\0", offset)].decode()
+
+    names = [string(contents(shstrndx), h[0]) for h in headers]
+    text = contents(names.index(".text"))
+    symtab = contents(names.index(".symtab"))
+    strtab = contents(names.index(".strtab"))
+    relocations = []
+    if ".rela.text" in names:
+        rela = contents(names.index(".rela.text"))
+        for offset, info, addend in struct.iter_unpack("<QQq", rela):
+            name = string(
+                strtab, struct.unpack_from("<I", symtab, 24 * (info >> 32))[0]
+            )
+            relocations.append((offset, info & 0xFFFFFFFF, name, addend))
+    return text, sorted(relocations)
+
+
+def assert_same_as_gnu_as(assembly_code: str) -> None:
+    expected = text_and_relocations(gnu_as(assembly_code))
+    assert text_and_relocations(assemble_object(assembly_code)) == expected
+
+
+def test_instructions() -> None:
+    assert_same_as_gnu_as("""
+        .global main
+        .type main, @function
+        .section .text
+    main:
+        pushq %rbp
+        movq %rsp, %rbp
+        subq $1024, %rsp
+        pushq %r12
+        pushq $5
+        pushq $500
+        pushq -16(%rbp)
+        popq %r13
+        movq $-7, %rax
+        movq $100000, -8(%rbp)
+        movabsq $-81985529216486896, %r9
+        movq %r8, %rdi
+        movq %rdi, -200(%rbp)
+        movq 16(%rbp), %r15
+        movq -8(%rsp), %r12
+        movq %r13, 8(%r12)
+        movq (%r13), %rax
+        leaq 5(%rbx), %rdi
+        leaq -3(%r12), %r10
+        leaq (%rsi,%rdi), %rax
+        leaq (%rbp,%r13), %r8
+        leaq (%r13,%rbp), %rax
+        leaq print_int(%rip), %rax
+        addq $1, %rax
+        addq $1000, %rax
+        addq $1000, %rbx
+        addq %r9, %r10
+        addq -8(%rbp), %rax
+        subq %rsi, -24(%rbp)
+        andq $255, %rdi
+        xorq $1, %r11
+        xor %rax, %rax
+        cmpq $5, -8(%rbp)
+        cmpq -16(%rbp), %rdx
+        cmpq %rsi, %rdi
+        testq %r14, %r14
+        imulq %rsi, %rdi
+        imulq -8(%rbp), %rax
+        imulq $10, %rdi, %rsi
+        imulq $1000, -8(%rbp), %rax
+        imulq %r12
+        idivq -8(%rbp)
+        idivq %r10
+        cqto
+        negq %r8
+        salq $1, %rax
+        salq $3, %r9
+        sarq $63, %rdx
+        shrq %cl, %rsi
+        sete %al
+        setne %al
+        setl %al
+        setle %al
+        setg %al
+        setge %al
+        callq *%rax
+        callq print_int
+        jmp *%rax
+        ret
+        """)
+
+
+def test_branch_relaxation() -> None:
+    # The first jump fits in a byte only until the second one grows
+    filler = "movq $1, %rax\n" * 17
+    assert_same_as_gnu_as(f"""
+        .section .text
+    f:
+        jmp .Lend
+        jl .Lfar
+        {filler}
+        jmp .Lfar
+        jne f
+    .Lend:
+        {filler * 4}
+    .Lfar:
+        jmp f
+        jmp g
+        jge g
+        """)
+
+
+def test_relocations() -> None:
+    code = """
+        .extern print_int
+        .global main
+        .section .text
+    main:
+        callq print_int
+        callq main
+        leaq print_int(%rip), %rdi
+        leaq main(%rip), %rdi
+        jmp print_int
+    """
+    _, relocations = text_and_relocations(assemble_object(code))
+    assert relocations == [
+        (1, R_X86_64_PLT32, "print_int", -4),
+        (6, R_X86_64_PLT32, "main", -4),
+        (13, R_X86_64_PC32, "print_int", -4),
+        (20, R_X86_64_PC32, "main", -4),
+        (25, R_X86_64_PLT32, "print_int", -4),
+    ]
+    assert_same_as_gnu_as(code)
+
+
+def test_generated_code() -> None:
+    sources = [path.read_text() for path in sorted(programs_dir.glob("*.txt"))]
+    sources.append("""
+        fun f(a: Int, b: Int, c: Int, d: Int, e: Int, g: Int, h: Int): Int {
+            return a * 2 + b / c - d % e + g * 4 + h;
+        }
+        fun loop(n: Int): Int { if n > 0 then { return loop(n - 1); } return n; }
+        var x = read_int();
+        while x < 1000 do { x = f(x, 1, 2, 3, 4, 5, 6) + loop(x) * 1000003; }
+        print_bool(x != 5 and not (x >= 3));
+        print_int(-x);
+        """)
+    for source in sources:
+        for opt_level in [0, 1, 2]:
+            assert_same_as_gnu_as(compile_to_assembly(source, opt_level))
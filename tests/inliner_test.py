@@ -0,0 +1,154 @@
+from compiler.inliner import (
+    call_graph,
+    recursive_functions,
+    bottom_up_order,
+    inline_calls,
+)
+from compiler.ir import (
+    Instruction,
+    LoadIntConst,
+    Call,
+    IRVar,
+    CondJump,
+    Label,
+    Jump,
+    Copy,
+)
+from compiler.profile import Profile
+from compiler.token import Location
+
+# fun max(a: Int, b: Int): Int { if a > b then { return a; } return b; }
+max_body = [
+    Copy(IRVar("%rdi"), IRVar("X_0")),
+    Copy(IRVar("%rsi"), IRVar("X_1")),
+    Call(IRVar(">"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+    CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+    Label("L_1"),
+    Copy(IRVar("X_0"), IRVar("%rax")),
+    Jump(Label("L_0")),
+    Label("L_2"),
+    Copy(IRVar("X_1"), IRVar("%rax")),
+    Jump(Label("L_0")),
+    Label("L_0"),
+]
+
+
+def test_call_graph() -> None:
+    fun_insn: dict[str, list[Instruction]] = {
+        "f": [Call(IRVar("g"), [], IRVar("X_0"))],
+        "g": [Call(IRVar("f"), [], IRVar("X_1")), Copy(IRVar("h"), IRVar("X_2"))],
+        "h": [Call(IRVar("print_int"), [IRVar("X_3")], IRVar("unit"))],
+        "main": [Call(IRVar("h"), [IRVar("X_4")], IRVar("unit"))],
+    }
+    graph = call_graph(fun_insn)
+    assert graph == {"f": {"g"}, "g": {"f", "h"}, "h": set(), "main": {"h"}}
+    assert recursive_functions(graph) == {"f", "g"}
+    order = bottom_up_order(graph)
+    assert order.index("h") < order.index("g")
+    assert order.index("h") < order.index("main")
+
+
+def test_inline_calls() -> None:
+    assert inline_calls(
+        "main",
+        [
+            Call(IRVar("read_int"), [], IRVar("X_5")),
+            LoadIntConst(0, IRVar("X_6")),
+            Call(IRVar("max"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_0")),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        ],
+        {"max": max_body},
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_5")),
+        LoadIntConst(0, IRVar("X_6")),
+        Copy(IRVar("X_5"), IRVar("X_7")),
+        Copy(IRVar("X_6"), IRVar("X_8")),
+        Call(IRVar(">"), [IRVar("X_7"), IRVar("X_8")], IRVar("X_9")),
+        CondJump(IRVar("X_9"), Label("main_1_L_1"), Label("main_1_L_2")),
+        Label("main_1_L_1"),
+        Copy(IRVar("X_7"), IRVar("X_0")),
+        Jump(Label("main_1_end")),
+        Label("main_1_L_2"),
+        Copy(IRVar("X_8"), IRVar("X_0")),
+        Jump(Label("main_1_end")),
+        Label("main_1_end"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+    ]
+
+    # Larger functions are only inlined into loops
+    big_body = max_body[:-1] * 4 + max_body[-1:]
+    program = [
+        Label("L_3"),
+        Call(IRVar("max"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_7")),
+        Call(IRVar("max"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_7")),
+        CondJump(IRVar("X_7"), Label("L_3"), Label("L_4")),
+        Label("L_4"),
+        Call(IRVar("max"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_7")),
+    ]
+    result = inline_calls("f", program, {"max": big_body})
+    calls = [
+        insn for insn in result if isinstance(insn, Call) and insn.fun.name == "max"
+    ]
+    assert len(calls) == 1
+    assert Label("f_1_end") in result and Label("f_2_end") in result
+
+
+def test_inline_implicit_result() -> None:
+    # fun inc(x: Int): Int { x + 1 }
+    inc_body = [
+        Copy(IRVar("%rdi"), IRVar("X_0")),
+        LoadIntConst(1, IRVar("X_1")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        Copy(IRVar("X_2"), IRVar("%rax")),
+        Label("L_0"),
+    ]
+    assert inline_calls(
+        "main",
+        [
+            Call(IRVar("read_int"), [], IRVar("X_5")),
+            Call(IRVar("inc"), [IRVar("X_5")], IRVar("X_6")),
+            Call(IRVar("print_int"), [IRVar("X_6")], IRVar("unit")),
+        ],
+        {"inc": inc_body},
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_5")),
+        Copy(IRVar("X_5"), IRVar("X_7")),
+        LoadIntConst(1, IRVar("X_8")),
+        Call(IRVar("+"), [IRVar("X_7"), IRVar("X_8")], IRVar("X_9")),
+        Copy(IRVar("X_9"), IRVar("X_6")),
+        Label("main_1_end"),
+        Call(IRVar("print_int"), [IRVar("X_6")], IRVar("unit")),
+    ]
+
+
+def test_profile_guided_inlining() -> None:
+    program = [
+        Call(IRVar("read_int"), [], IRVar("X_5"), loc=Location(0, 0)),
+        Label("L_3", loc=Location(1, 0)),
+        Call(
+            IRVar("max"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_7"), loc=Location(1, 4)
+        ),
+        CondJump(IRVar("X_7"), Label("L_3"), Label("L_4"), loc=Location(1, 0)),
+        Label("L_4", loc=Location(2, 0)),
+        Call(
+            IRVar("max"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_7"), loc=Location(2, 4)
+        ),
+    ]
+
+    def calls_left(body: list[Instruction], loop_count: int, after_count: int) -> int:
+        counts = {(0, 0): min(loop_count, 1), (1, 0): loop_count, (1, 4): loop_count}
+        counts |= {(2, 0): after_count, (2, 4): after_count}
+        result = inline_calls("f", program, {"max": body}, Profile(counts))
+        return sum(
+            1 for insn in result if isinstance(insn, Call) and insn.fun.name == "max"
+        )
+
+    # Calls that never ran are not inlined even when the function is small
+    assert calls_left(max_body, 1, 1) == 0
+    assert calls_left(max_body, 1, 0) == 1
+    # Unless the function itself never ran, as happens when it was inlined
+    assert calls_left(max_body, 0, 0) == 0
+    # Larger functions are inlined into loops that ran more than once
+    big_body = max_body[:-1] * 4 + max_body[-1:]
+    assert calls_left(big_body, 1, 1) == 2
+    assert calls_left(big_body, 50, 1) == 1
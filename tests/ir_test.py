@@ -72,6 +72,23 @@ def test_ir_basics() -> None:
     ]
 
 
+def test_ir_conditions() -> None:
+    # Conditions jump to their targets instead of computing `or` and `not`
+    program = "var a = read_int(); if not (a < 1 or true) then print_int(a)"
+    assert generate_ir(get_ast(program), reserved_names)["main"] == [
+        Call(IRVar("read_int"), [], IRVar("X_1")),
+        Copy(IRVar("X_1"), IRVar("X_0")),
+        LoadIntConst(1, IRVar("X_3")),
+        Call(IRVar("<"), [IRVar("X_0"), IRVar("X_3")], IRVar("X_2")),
+        CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+        Label("L_2"),
+        Jump(Label("L_1")),
+        Label("L_0"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("X_4")),
+        Label("L_1"),
+    ]
+
+
 def test_ir_blocks() -> None:
     assert (
         generate_ir(
@@ -98,33 +115,47 @@ def test_ir_blocks() -> None:
             LoadBoolConst(value=False, dest=IRVar("X_5")),
             Copy(source=IRVar("X_5"), dest=IRVar("X_4")),
             Label("L_0"),
-            Call(fun=IRVar("<="), args=[IRVar("X_2"), IRVar("X_0")], dest=IRVar("X_7")),
-            CondJump(IRVar("X_7"), Label("L_5"), Label("L_4")),
-            Label("L_4"),
-            Copy(source=IRVar("X_7"), dest=IRVar("X_6")),
-            Jump(Label("L_3")),
-            Label("L_5"),
-            LoadBoolConst(value=False, dest=IRVar("X_9")),
-            Call(fun=IRVar("=="), args=[IRVar("X_4"), IRVar("X_9")], dest=IRVar("X_8")),
-            Copy(source=IRVar("X_8"), dest=IRVar("X_6")),
+            Call(fun=IRVar("<="), args=[IRVar("X_2"), IRVar("X_0")], dest=IRVar("X_6")),
+            CondJump(IRVar("X_6"), Label("L_3"), Label("L_2")),
             Label("L_3"),
-            CondJump(IRVar("X_6"), Label("L_1"), Label("L_2")),
+            LoadBoolConst(value=False, dest=IRVar("X_8")),
+            Call(fun=IRVar("=="), args=[IRVar("X_4"), IRVar("X_8")], dest=IRVar("X_7")),
+            CondJump(IRVar("X_7"), Label("L_1"), Label("L_2")),
             Label("L_1"),
-            Call(fun=IRVar("print_int"), args=[IRVar("X_2")], dest=IRVar("X_11")),
-            Call(fun=IRVar("%"), args=[IRVar("X_0"), IRVar("X_2")], dest=IRVar("X_13")),
-            Copy(source=IRVar("X_13"), dest=IRVar("X_12")),
-            LoadIntConst(value=0, dest=IRVar("X_15")),
+            Call(fun=IRVar("print_int"), args=[IRVar("X_2")], dest=IRVar("X_10")),
+            Call(fun=IRVar("%"), args=[IRVar("X_0"), IRVar("X_2")], dest=IRVar("X_12")),
+            Copy(source=IRVar("X_12"), dest=IRVar("X_11")),
+            LoadIntConst(value=0, dest=IRVar("X_14")),
             Call(
-                fun=IRVar("=="), args=[IRVar("X_12"), IRVar("X_15")], dest=IRVar("X_14")
+                fun=IRVar("=="), args=[IRVar("X_11"), IRVar("X_14")], dest=IRVar("X_13")
             ),
-            CondJump(IRVar("X_14"), Label("L_6"), Label("L_7")),
-            Label("L_6"),
-            LoadBoolConst(value=True, dest=IRVar("X_17")),
-            Copy(source=IRVar("X_17"), dest=IRVar("X_4")),
-            Copy(source=IRVar("unit"), dest=IRVar("X_16")),
-            Label("L_7"),
-            Copy(source=IRVar("unit"), dest=IRVar("X_10")),
+            CondJump(IRVar("X_13"), Label("L_4"), Label("L_5")),
+            Label("L_4"),
+            LoadBoolConst(value=True, dest=IRVar("X_16")),
+            Copy(source=IRVar("X_16"), dest=IRVar("X_4")),
+            Copy(source=IRVar("unit"), dest=IRVar("X_15")),
+            Label("L_5"),
+            Copy(source=IRVar("unit"), dest=IRVar("X_9")),
             Jump(Label("L_0")),
             Label("L_2"),
         ]
     )
+
+
+def test_ir_function_result() -> None:
+    # The value of the body is returned in %rax, unless the function returns Unit
+    program = "fun sq(x: Int): Int { x * x } fun p(x: Int): Unit { print_int(x) }"
+    fun_insn = generate_ir(get_ast(program), reserved_names)
+    assert fun_insn["sq"] == [
+        Copy(IRVar("%rdi"), IRVar("X_0")),
+        Call(IRVar("*"), [IRVar("X_0"), IRVar("X_0")], IRVar("X_2")),
+        Copy(IRVar("X_2"), IRVar("X_1")),
+        Copy(IRVar("X_1"), IRVar("%rax")),
+        Label("L_0"),
+    ]
+    assert fun_insn["p"] == [
+        Copy(IRVar("%rdi"), IRVar("X_3")),
+        Call(IRVar("print_int"), [IRVar("X_3")], IRVar("X_5")),
+        Copy(IRVar("X_5"), IRVar("X_4")),
+        Label("L_1"),
+    ]
@@ -0,0 +1,130 @@
+import os
+import pytest
+import subprocess
+import tempfile
+from pathlib import Path
+from compiler.__main__ import compile_to_assembly
+from compiler.assembler import stdlib_object
+from compiler.encoder import assemble_object
+from compiler.linker import LinkError, link, read_object
+
+programs_dir = Path(__file__).parent.parent / "programs"
+
+
+def run(path: str, input: str) -> tuple[int, str]:
+    result = subprocess.run([path], input=input, capture_output=True, text=True)
+    return result.returncode, result.stdout
+
+
+def write_executable(path: str, executable: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(executable)
+    os.chmod(path, 0o755)
+
+
+def test_read_object() -> None:
+    obj = read_object(assemble_object("""
+            .global main
+            .section .text
+        main:
+            callq print_int
+            ret
+            """))
+    assert [s.name for s in obj.sections][1:2] == [".text"]
+    assert obj.sections[1].data == b"\xe8\x00\x00\x00\x00\xc3"
+    assert [s.name for s in obj.symbols] == ["", "main", "print_int"]
+    assert obj.relocations == {1: [(1, 2, 4, -4)]}
+
+
+def test_same_behavior_as_ld() -> None:
+    cases = [
+        ("prime.txt", "97\n"),
+        ("divisors.txt", "28\n"),
+        ("funny.txt", ""),
+        ("whatever.txt", ""),
+        ("multiples.txt", "100\n"),
+    ]
+    with tempfile.TemporaryDirectory(prefix="linker_test_") as wd:
+        stdlib = stdlib_object(wd, link_with_c=False)
+        for name, input in cases:
+            for opt_level in [0, 1, 2]:
+                program = os.path.join(wd, "program.o")
+                with open(program, "wb") as f:
+                    f.write(
+                        assemble_object(
+                            compile_to_assembly(
+                                (programs_dir / name).read_text(), opt_level
+                            )
+                        )
+                    )
+                ld_output = os.path.join(wd, "ld.out")
+                subprocess.run(
+                    ["ld", "-static", "-o" + ld_output, stdlib, program], check=True
+                )
+                output = os.path.join(wd, "a.out")
+                write_executable(
+                    output,
+                    link([Path(stdlib).read_bytes(), Path(program).read_bytes()]),
+                )
+                assert run(output, input) == run(ld_output, input)
+
+        # Reading from empty input fails the same way
+        read_program = assemble_object(compile_to_assembly("read_int()", 1))
+        output = os.path.join(wd, "a.out")
+        write_executable(output, link([Path(stdlib).read_bytes(), read_program]))
+        assert run(output, "") == (1, "")
+
+
+def test_undefined_symbol() -> None:
+    program = assemble_object("""
+        .global _start
+        .section .text
+    _start:
+        callq missing
+        """)
+    with pytest.raises(LinkError, match="Undefined reference to missing"):
+        link([program])
+
+
+def test_debug_info() -> None:
+    source = (programs_dir / "prime.txt").read_text()
+    program = assemble_object(compile_to_assembly(source, 1, source_file="prime.txt"))
+    with tempfile.TemporaryDirectory(prefix="linker_test_") as wd:
+        stdlib = stdlib_object(wd, link_with_c=False)
+        program_obj = os.path.join(wd, "program.o")
+        Path(program_obj).write_bytes(program)
+        ld_output = os.path.join(wd, "ld.out")
+        subprocess.run(
+            ["ld", "-static", "-o" + ld_output, stdlib, program_obj], check=True
+        )
+        output = os.path.join(wd, "a.out")
+        write_executable(output, link([Path(stdlib).read_bytes(), program]))
+
+        def source_lines(executable: str) -> list[str]:
+            """Returns the source line of each byte of 'main', per 'addr2line'."""
+            symbols = subprocess.run(
+                ["nm", "-S", executable], capture_output=True, text=True, check=True
+            ).stdout
+            address, size = next(
+                (int(line.split()[0], 16), int(line.split()[1], 16))
+                for line in symbols.splitlines()
+                if line.endswith(" main")
+            )
+            addresses = [hex(address + i) for i in range(size)]
+            return subprocess.run(
+                ["addr2line", "-e", executable, *addresses],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.splitlines()
+
+        lines = source_lines(output)
+        assert lines == source_lines(ld_output)
+        # The file name is relative to the working directory of the compiler
+        file_lines = [line.rsplit("/", 1)[-1] for line in lines]
+        assert "prime.txt:8" in file_lines
+        assert all(line.startswith("prime.txt:") for line in file_lines)
+
+        # Stripped executables have neither debug info nor symbols
+        stripped = link([Path(stdlib).read_bytes(), program], strip=True)
+        assert b".debug_line" not in stripped and b"print_int" not in stripped
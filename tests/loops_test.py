@@ -0,0 +1,158 @@
+from compiler.loops import hoist_loop_invariants, reduce_induction_variables
+from compiler.ir import (
+    LoadIntConst,
+    Call,
+    IRVar,
+    CondJump,
+    Label,
+    Jump,
+    Copy,
+)
+
+
+def test_hoist_loop_invariants() -> None:
+    assert hoist_loop_invariants(
+        [
+            Call(IRVar("read_int"), [], IRVar("X_0")),
+            LoadIntConst(0, IRVar("X_1")),
+            Label("L_0"),
+            Call(IRVar("<"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_2")),
+            CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+            Label("L_1"),
+            LoadIntConst(3, IRVar("X_3")),
+            Call(IRVar("*"), [IRVar("X_0"), IRVar("X_3")], IRVar("X_4")),
+            Call(IRVar("print_int"), [IRVar("X_4")], IRVar("unit")),
+            Call(IRVar("+"), [IRVar("X_1"), IRVar("X_4")], IRVar("X_1")),
+            Jump(Label("L_0")),
+            Label("L_2"),
+        ]
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        LoadIntConst(0, IRVar("X_1")),
+        LoadIntConst(3, IRVar("X_3")),
+        Call(IRVar("*"), [IRVar("X_0"), IRVar("X_3")], IRVar("X_4")),
+        Label("L_0"),
+        Call(IRVar("<"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_2")),
+        CondJump(IRVar("X_2"), Label("L_1"), Label("L_2")),
+        Label("L_1"),
+        Call(IRVar("print_int"), [IRVar("X_4")], IRVar("unit")),
+        Call(IRVar("+"), [IRVar("X_1"), IRVar("X_4")], IRVar("X_1")),
+        Jump(Label("L_0")),
+        Label("L_2"),
+    ]
+
+
+def test_hoist_into_new_preheader() -> None:
+    # The loop is entered from two places, so it gets a block of its own to hoist into
+    assert hoist_loop_invariants(
+        [
+            Call(IRVar("read_int"), [], IRVar("X_0")),
+            CondJump(IRVar("X_0"), Label("L_0"), Label("L_1")),
+            Label("L_1"),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+            Label("L_0"),
+            Call(IRVar("-"), [IRVar("X_0"), IRVar("X_0")], IRVar("X_1")),
+            Call(IRVar("print_int"), [IRVar("X_1")], IRVar("unit")),
+            Jump(Label("L_0")),
+        ]
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        CondJump(IRVar("X_0"), Label("L_0_pre"), Label("L_1")),
+        Label("L_1"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        Label("L_0_pre"),
+        Call(IRVar("-"), [IRVar("X_0"), IRVar("X_0")], IRVar("X_1")),
+        Label("L_0"),
+        Call(IRVar("print_int"), [IRVar("X_1")], IRVar("unit")),
+        Jump(Label("L_0")),
+    ]
+
+
+def test_loop_variant_code_stays() -> None:
+    loop = [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        Call(IRVar("read_int"), [], IRVar("X_1")),
+        Label("L_0"),
+        # Reads a variable redefined in the loop
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_0")], IRVar("X_0")),
+        CondJump(IRVar("X_0"), Label("L_1"), Label("L_2")),
+        Label("L_1"),
+        # Division by a value that may be zero, after a side effect
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        Call(IRVar("/"), [IRVar("X_1"), IRVar("X_1")], IRVar("X_2")),
+        Call(IRVar("print_int"), [IRVar("X_2")], IRVar("unit")),
+        # Variable that is live around the loop
+        LoadIntConst(7, IRVar("X_3")),
+        Call(IRVar("print_int"), [IRVar("X_3")], IRVar("unit")),
+        Copy(IRVar("X_0"), IRVar("X_3")),
+        Jump(Label("L_0")),
+        Label("L_2"),
+    ]
+    assert hoist_loop_invariants(loop) == loop
+
+    # Division by a non-zero constant cannot trap, so it can run early
+    assert hoist_loop_invariants(
+        [
+            Call(IRVar("read_int"), [], IRVar("X_0")),
+            LoadIntConst(10, IRVar("X_1")),
+            Label("L_0"),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+            Call(IRVar("%"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+            Call(IRVar("print_int"), [IRVar("X_2")], IRVar("unit")),
+            Jump(Label("L_0")),
+        ]
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        LoadIntConst(10, IRVar("X_1")),
+        Call(IRVar("%"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        Label("L_0"),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        Call(IRVar("print_int"), [IRVar("X_2")], IRVar("unit")),
+        Jump(Label("L_0")),
+    ]
+
+
+def test_reduce_induction_variables() -> None:
+    assert reduce_induction_variables(
+        [
+            Call(IRVar("read_int"), [], IRVar("X_0")),
+            Call(IRVar("read_int"), [], IRVar("X_1")),
+            LoadIntConst(2, IRVar("X_2")),
+            Label("L_0"),
+            Call(IRVar("*"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_3")),
+            Call(IRVar("print_int"), [IRVar("X_3")], IRVar("unit")),
+            Call(IRVar("+"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_0")),
+            Call(IRVar("*"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_4")),
+            Call(IRVar("print_int"), [IRVar("X_4")], IRVar("unit")),
+            Jump(Label("L_0")),
+        ]
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        Call(IRVar("read_int"), [], IRVar("X_1")),
+        LoadIntConst(2, IRVar("X_2")),
+        Call(IRVar("*"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_5")),
+        Call(IRVar("*"), [IRVar("X_2"), IRVar("X_1")], IRVar("X_6")),
+        Call(IRVar("*"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_7")),
+        LoadIntConst(4, IRVar("X_8")),
+        Label("L_0"),
+        Copy(IRVar("X_5"), IRVar("X_3")),
+        Call(IRVar("print_int"), [IRVar("X_3")], IRVar("unit")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_0")),
+        Call(IRVar("+"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_5")),
+        Call(IRVar("+"), [IRVar("X_7"), IRVar("X_8")], IRVar("X_7")),
+        Copy(IRVar("X_7"), IRVar("X_4")),
+        Call(IRVar("print_int"), [IRVar("X_4")], IRVar("unit")),
+        Jump(Label("L_0")),
+    ]
+
+    # The counter changes by a different amount on each iteration, so it is not an induction variable
+    loop = [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        LoadIntConst(3, IRVar("X_1")),
+        Label("L_0"),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_0")], IRVar("X_0")),
+        Call(IRVar("*"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        Call(IRVar("print_int"), [IRVar("X_2")], IRVar("unit")),
+        Jump(Label("L_0")),
+    ]
+    assert reduce_induction_variables(loop) == loop
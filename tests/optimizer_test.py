@@ -0,0 +1,376 @@
+import random
+from compiler.tokenizer import tokenize
+from compiler.parser import parse
+from compiler.typechecker import typecheck
+from compiler.ir_generator import generate_ir
+from compiler.ir import reserved_names
+from compiler.optimizer import (
+    optimize,
+    propagate_copies,
+    remove_dead_code,
+    remove_unreachable_code,
+    eliminate_common_subexpressions,
+    reduce_strength,
+    coalesce_copies,
+    fold_constants,
+)
+from compiler.cfg import evaluate_intrinsic, truncating_divide
+from compiler.ir import (
+    LoadIntConst,
+    Call,
+    IRVar,
+    CondJump,
+    Label,
+    Jump,
+    Copy,
+    LoadBoolConst,
+    Instruction,
+)
+
+
+def get_ir(program: str) -> dict[str, list[Instruction]]:
+    program_ast = parse(tokenize(program))
+    typecheck(program_ast)
+    return generate_ir(program_ast, reserved_names)
+
+
+def test_propagate_copies() -> None:
+    assert propagate_copies(
+        [
+            LoadIntConst(1, IRVar("X_0")),
+            Copy(IRVar("X_0"), IRVar("X_1")),
+            Copy(IRVar("X_1"), IRVar("X_2")),
+            Call(IRVar("+"), [IRVar("X_1"), IRVar("X_2")], IRVar("X_3")),
+        ]
+    ) == [
+        LoadIntConst(1, IRVar("X_0")),
+        Copy(IRVar("X_0"), IRVar("X_1")),
+        Copy(IRVar("X_0"), IRVar("X_2")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_3")),
+    ]
+
+    # The copy does not reach the use along the path that reassigns the source
+    assert propagate_copies(
+        [
+            Copy(IRVar("X_0"), IRVar("X_1")),
+            CondJump(IRVar("X_2"), Label("L_0"), Label("L_1")),
+            Label("L_0"),
+            LoadIntConst(5, IRVar("X_0")),
+            Label("L_1"),
+            Call(IRVar("print_int"), [IRVar("X_1")], IRVar("X_3")),
+        ]
+    ) == [
+        Copy(IRVar("X_0"), IRVar("X_1")),
+        CondJump(IRVar("X_2"), Label("L_0"), Label("L_1")),
+        Label("L_0"),
+        LoadIntConst(5, IRVar("X_0")),
+        Label("L_1"),
+        Call(IRVar("print_int"), [IRVar("X_1")], IRVar("X_3")),
+    ]
+
+    # Loop-carried variables are only replaced where no iteration redefines them
+    assert propagate_copies(
+        [
+            Copy(IRVar("X_0"), IRVar("X_1")),
+            Label("L_0"),
+            Call(IRVar("print_int"), [IRVar("X_1")], IRVar("X_2")),
+            Call(IRVar("+"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_1")),
+            Jump(Label("L_0")),
+        ]
+    ) == [
+        Copy(IRVar("X_0"), IRVar("X_1")),
+        Label("L_0"),
+        Call(IRVar("print_int"), [IRVar("X_1")], IRVar("X_2")),
+        Call(IRVar("+"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_1")),
+        Jump(Label("L_0")),
+    ]
+
+
+def test_remove_dead_code() -> None:
+    assert remove_dead_code(
+        [
+            LoadIntConst(1, IRVar("X_0")),
+            Copy(IRVar("X_0"), IRVar("X_1")),
+            Copy(IRVar("X_0"), IRVar("X_0")),
+            Copy(IRVar("X_0"), IRVar("%rax")),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("X_2")),
+        ]
+    ) == [
+        LoadIntConst(1, IRVar("X_0")),
+        Copy(IRVar("X_0"), IRVar("%rax")),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+    ]
+
+    # Pure computations go away, calls and possible division by zero stay
+    assert remove_dead_code(
+        [
+            Call(IRVar("read_int"), [], IRVar("X_0")),
+            LoadIntConst(2, IRVar("X_1")),
+            Call(IRVar("*"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+            Call(IRVar("<"), [IRVar("X_2"), IRVar("X_1")], IRVar("X_3")),
+            Call(IRVar("/"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_4")),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("X_5")),
+        ]
+    ) == [
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        LoadIntConst(2, IRVar("X_1")),
+        Call(IRVar("/"), [IRVar("X_0"), IRVar("X_1")], IRVar("unit")),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+    ]
+
+    # The value of a function body is returned, so computing it is not dead
+    sq = remove_dead_code(get_ir("fun sq(x: Int): Int { x * x } sq(7)")["sq"])
+    assert any(isinstance(insn, Call) and insn.fun.name == "*" for insn in sq)
+
+
+def test_remove_unreachable_code() -> None:
+    assert remove_unreachable_code(
+        [
+            Label("L_0"),
+            Call(IRVar("read_int"), [], IRVar("X_0")),
+            CondJump(IRVar("X_0"), Label("L_1"), Label("L_2")),
+            Label("L_1"),
+            Jump(Label("L_0")),
+            LoadIntConst(2, IRVar("X_1")),
+            Jump(Label("L_0")),
+            Label("L_3"),
+            Copy(IRVar("X_0"), IRVar("%rax")),
+            Label("L_2"),
+        ]
+    ) == [
+        Label("L_0"),
+        Call(IRVar("read_int"), [], IRVar("X_0")),
+        CondJump(IRVar("X_0"), Label("L_1"), Label("L_2")),
+        Label("L_1"),
+        Jump(Label("L_0")),
+        Label("L_2"),
+    ]
+
+
+def test_eliminate_common_subexpressions() -> None:
+    assert eliminate_common_subexpressions(
+        [
+            LoadIntConst(2, IRVar("X_2")),
+            Call(IRVar("%"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_3")),
+            LoadIntConst(2, IRVar("X_4")),
+            Call(IRVar("*"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_5")),
+            Call(IRVar("*"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_6")),
+            Call(IRVar(">"), [IRVar("X_5"), IRVar("X_0")], IRVar("X_7")),
+            Call(IRVar("<"), [IRVar("X_0"), IRVar("X_5")], IRVar("X_8")),
+            Call(IRVar("%"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_9")),
+        ]
+    ) == [
+        LoadIntConst(2, IRVar("X_2")),
+        Call(IRVar("%"), [IRVar("X_0"), IRVar("X_2")], IRVar("X_3")),
+        Copy(IRVar("X_2"), IRVar("X_4")),
+        Call(IRVar("*"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_5")),
+        Copy(IRVar("X_5"), IRVar("X_6")),
+        Call(IRVar(">"), [IRVar("X_5"), IRVar("X_0")], IRVar("X_7")),
+        Copy(IRVar("X_7"), IRVar("X_8")),
+        Copy(IRVar("X_3"), IRVar("X_9")),
+    ]
+
+    # Redefining an operand on one of the paths makes the value unavailable
+    assert eliminate_common_subexpressions(
+        [
+            Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+            CondJump(IRVar("X_3"), Label("L_0"), Label("L_1")),
+            Label("L_0"),
+            Copy(IRVar("X_2"), IRVar("X_0")),
+            Label("L_1"),
+            Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_4")),
+        ]
+    ) == [
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        CondJump(IRVar("X_3"), Label("L_0"), Label("L_1")),
+        Label("L_0"),
+        Copy(IRVar("X_2"), IRVar("X_0")),
+        Label("L_1"),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_4")),
+    ]
+
+    # Copying the result into an operand of the expression changes its value
+    program: list[Instruction] = [
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        Copy(IRVar("X_2"), IRVar("X_0")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_3")),
+    ]
+    assert eliminate_common_subexpressions(program) == program
+
+    # A copy of the result holds the value as well, until it is reassigned
+    assert eliminate_common_subexpressions(
+        [
+            Call(IRVar("-"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+            Copy(IRVar("X_2"), IRVar("X_3")),
+            LoadIntConst(0, IRVar("X_2")),
+            Call(IRVar("-"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_4")),
+        ]
+    ) == [
+        Call(IRVar("-"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        Copy(IRVar("X_2"), IRVar("X_3")),
+        LoadIntConst(0, IRVar("X_2")),
+        Copy(IRVar("X_3"), IRVar("X_4")),
+    ]
+
+
+def test_reduce_strength() -> None:
+    assert reduce_strength(
+        [
+            LoadIntConst(8, IRVar("X_1")),
+            Call(IRVar("*"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_2")),
+            Call(IRVar("/"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_3")),
+            Call(IRVar("%"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_4")),
+            Call(IRVar("/"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_5")),
+        ]
+    ) == [
+        LoadIntConst(8, IRVar("X_1")),
+        LoadIntConst(3, IRVar("X_6")),
+        Call(IRVar("<<"), [IRVar("X_0"), IRVar("X_6")], IRVar("X_2")),
+        LoadIntConst(63, IRVar("X_7")),
+        Call(IRVar(">>"), [IRVar("X_0"), IRVar("X_7")], IRVar("X_8")),
+        LoadIntConst(61, IRVar("X_9")),
+        Call(IRVar(">>>"), [IRVar("X_8"), IRVar("X_9")], IRVar("X_10")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_10")], IRVar("X_11")),
+        LoadIntConst(3, IRVar("X_12")),
+        Call(IRVar(">>"), [IRVar("X_11"), IRVar("X_12")], IRVar("X_3")),
+        LoadIntConst(63, IRVar("X_13")),
+        Call(IRVar(">>"), [IRVar("X_0"), IRVar("X_13")], IRVar("X_14")),
+        LoadIntConst(61, IRVar("X_15")),
+        Call(IRVar(">>>"), [IRVar("X_14"), IRVar("X_15")], IRVar("X_16")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_16")], IRVar("X_17")),
+        LoadIntConst(7, IRVar("X_18")),
+        Call(IRVar("&"), [IRVar("X_17"), IRVar("X_18")], IRVar("X_19")),
+        Call(IRVar("-"), [IRVar("X_19"), IRVar("X_16")], IRVar("X_4")),
+        Call(IRVar("/"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_5")),
+    ]
+
+
+def run_straight_line(
+    instructions: list[Instruction], values: dict[IRVar, int]
+) -> dict[IRVar, int]:
+    """Computes the values of the variables set by IR without jumps."""
+    values = dict(values)
+    for insn in instructions:
+        match insn:
+            case LoadIntConst():
+                values[insn.dest] = insn.value
+            case Copy():
+                values[insn.dest] = values[insn.source]
+            case Call():
+                result = evaluate_intrinsic(
+                    insn.fun.name, [values[arg] for arg in insn.args]
+                )
+                assert isinstance(result, int)
+                values[insn.dest] = result
+            case _:
+                assert False, f"unexpected {insn}"
+    return values
+
+
+def test_reduce_strength_division_by_constant() -> None:
+    rng = random.Random(31)
+    divisors = [2, 3, 5, 6, 7, 10, 100, 641, 1000000007, -2, -3, -7, -8, -10]
+    divisors += [2**62, -(2**62), 2**63 - 1, -(2**63) + 1, -(2**63)]
+    divisors += [rng.randrange(-(2**63), 2**63) for _ in range(100)]
+    for d in divisors:
+        code = reduce_strength(
+            [
+                LoadIntConst(d, IRVar("X_1")),
+                Call(IRVar("/"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+                Call(IRVar("%"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_3")),
+            ]
+        )
+        assert not any(
+            isinstance(insn, Call) and insn.fun.name in ("/", "%") for insn in code
+        )
+        dividends = [0, 1, -1, 2**63 - 1, -(2**63), -(2**63) + 1, d, d - 1]
+        dividends += [d + 1, abs(d) * 3 - 1, -abs(d) * 3 + 1]
+        dividends += [rng.randrange(-(2**63), 2**63) for _ in range(300)]
+        for x in dividends:
+            x = (x + 2**63) % 2**64 - 2**63
+            values = run_straight_line(code, {IRVar("X_0"): x})
+            quotient = truncating_divide(x, d)
+            assert values[IRVar("X_2")] == quotient, (x, d)
+            assert values[IRVar("X_3")] == x - quotient * d, (x, d)
+
+    # Division by zero must crash at run time and -2^63 / -1 overflows
+    for d in [0, -1]:
+        code = [
+            LoadIntConst(d, IRVar("X_1")),
+            Call(IRVar("/"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+        ]
+        assert reduce_strength(code) == code
+
+
+def test_fold_constants() -> None:
+    assert fold_constants(
+        [
+            LoadIntConst(7, IRVar("X_1")),
+            LoadIntConst(-2, IRVar("X_2")),
+            Call(IRVar("/"), [IRVar("X_1"), IRVar("X_2")], IRVar("X_3")),
+            Call(IRVar("%"), [IRVar("X_1"), IRVar("X_2")], IRVar("X_4")),
+            Call(IRVar("<"), [IRVar("X_1"), IRVar("X_2")], IRVar("X_5")),
+            Call(IRVar("unary_-"), [IRVar("X_1")], IRVar("X_6")),
+            Call(IRVar("+"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_7")),
+            LoadIntConst(0, IRVar("X_8")),
+            Call(IRVar("/"), [IRVar("X_1"), IRVar("X_8")], IRVar("X_9")),
+            Call(IRVar("f"), [IRVar("X_1"), IRVar("X_2"), IRVar("X_8")], IRVar("X_10")),
+        ]
+    ) == [
+        LoadIntConst(7, IRVar("X_1")),
+        LoadIntConst(-2, IRVar("X_2")),
+        LoadIntConst(-3, IRVar("X_3")),
+        LoadIntConst(1, IRVar("X_4")),
+        LoadBoolConst(False, IRVar("X_5")),
+        LoadIntConst(-7, IRVar("X_6")),
+        Call(IRVar("+"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_7")),
+        LoadIntConst(0, IRVar("X_8")),
+        Call(IRVar("/"), [IRVar("X_1"), IRVar("X_8")], IRVar("X_9")),
+        Call(IRVar("f"), [IRVar("X_1"), IRVar("X_2"), IRVar("X_8")], IRVar("X_10")),
+    ]
+    assert evaluate_intrinsic("+", [1, 2, 3]) is None
+
+
+def test_coalesce_copies() -> None:
+    assert coalesce_copies(
+        [
+            LoadIntConst(2, IRVar("X_1")),
+            Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_2")),
+            Copy(IRVar("X_2"), IRVar("X_0")),
+        ]
+    ) == [
+        LoadIntConst(2, IRVar("X_1")),
+        Call(IRVar("+"), [IRVar("X_0"), IRVar("X_1")], IRVar("X_0")),
+        Copy(IRVar("X_0"), IRVar("X_0")),
+    ]
+
+    # The destination is read in between, so it must keep its old value until the copy
+    assert coalesce_copies(
+        [
+            LoadIntConst(2, IRVar("X_1")),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("X_2")),
+            Copy(IRVar("X_1"), IRVar("X_0")),
+        ]
+    ) == [
+        LoadIntConst(2, IRVar("X_1")),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("X_2")),
+        Copy(IRVar("X_1"), IRVar("X_0")),
+    ]
+
+
+def test_optimize_removes_copies() -> None:
+    program = "var x = read_int(); var y = x; print_int(y + x)"
+    assert optimize(get_ir(program))["main"] == [
+        Call(IRVar("read_int"), [], IRVar("X_1")),
+        Call(IRVar("+"), [IRVar("X_1"), IRVar("X_1")], IRVar("X_4")),
+        Call(IRVar("print_int"), [IRVar("X_4")], IRVar("unit")),
+    ]
+    assert optimize(get_ir("var x = 1; var y = x; print_int(y + x)"))["main"] == [
+        LoadIntConst(2, IRVar("X_4")),
+        Call(IRVar("print_int"), [IRVar("X_4")], IRVar("unit")),
+    ]
+
+    assert (
+        optimize(get_ir("var x = 1; x = x + 1; print_int(x)"), 0)["main"]
+        == get_ir("var x = 1; x = x + 1; print_int(x)")["main"]
+    )
@@ -0,0 +1,53 @@
+import os
+import pytest
+import subprocess
+import tempfile
+from compiler.__main__ import compile_to_assembly
+from compiler.assembler import assemble
+from compiler.profile import ProfileError, parse_profile, read_profile, profile_magic
+
+program = """var n = read_int();
+var i = 0;
+while i < n do {
+    i = i + 1;
+    if i % 100 == 0 then print_int(i);
+}
+print_int(i);
+"""
+
+
+def run(executable: str, input: str) -> str:
+    return subprocess.run(
+        [executable], input=input, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_instrumented_program() -> None:
+    with tempfile.TemporaryDirectory(prefix="profile_test_") as wd:
+        for opt_level in [0, 1, 2]:
+            executable = os.path.join(wd, "program")
+            profile_file = os.path.join(wd, "program.profile")
+            assemble(
+                compile_to_assembly(program, opt_level, instrument=profile_file),
+                executable,
+            )
+            assert run(executable, "250\n") == "100\n200\n250\n"
+            profile = read_profile(profile_file)
+            assert profile.counts[(0, 8)] == 1
+            assert profile.counts[(3, 4)] == 250
+            assert profile.counts[(4, 25)] == 2
+            assert profile.counts[(6, 0)] == 1
+
+            # The profile guides another build of the same program
+            assemble(
+                compile_to_assembly(program, opt_level, profile=profile), executable
+            )
+            assert run(executable, "250\n") == "100\n200\n250\n"
+
+
+def test_parse_profile() -> None:
+    assert parse_profile(profile_magic).counts == {}
+    with pytest.raises(ProfileError):
+        parse_profile(b"not a profile")
+    with pytest.raises(ProfileError):
+        parse_profile(profile_magic + bytes(10))
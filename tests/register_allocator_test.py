@@ -0,0 +1,176 @@
+from compiler.register_allocator import (
+    LiveInterval,
+    live_intervals,
+    allocate_registers,
+    color_registers,
+    assign_stack_slots,
+    callee_saved_registers,
+    caller_saved_registers,
+)
+from compiler.ir import (
+    LoadIntConst,
+    Call,
+    IRVar,
+    Copy,
+    Label,
+    CondJump,
+    Jump,
+    Instruction,
+)
+from compiler.profile import Profile
+from compiler.token import Location
+
+# var a = 1; var b = 2 + a; print_int(b); print_int(a)
+code: list[Instruction] = [
+    LoadIntConst(1, IRVar("X_0")),
+    LoadIntConst(2, IRVar("X_1")),
+    Call(IRVar("+"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_2")),
+    Call(IRVar("print_int"), [IRVar("X_2")], IRVar("X_3")),
+    Call(IRVar("print_int"), [IRVar("X_0")], IRVar("X_4")),
+]
+
+
+def test_live_intervals() -> None:
+    intervals, across_calls = live_intervals(code)
+    assert intervals == [
+        LiveInterval(IRVar("X_0"), 0, 4, True),
+        LiveInterval(IRVar("X_1"), 1, 2),
+        LiveInterval(IRVar("X_2"), 2, 3),
+        LiveInterval(IRVar("X_3"), 3, 3),
+        LiveInterval(IRVar("X_4"), 4, 4),
+    ]
+    assert across_calls == {3: {IRVar("X_0")}, 4: set()}
+
+
+def test_allocate_registers() -> None:
+    allocation = allocate_registers(code)
+    registers = allocation.registers
+    # X_0 is needed after a call, so it goes to a register the call preserves
+    assert registers[IRVar("X_0")] == "%rbx"
+    assert allocation.callee_saved == ["%rbx"]
+    assert registers[IRVar("X_1")] in caller_saved_registers
+    # The sum reuses the register of X_1, which is not needed after it
+    assert registers[IRVar("X_2")] == registers[IRVar("X_1")]
+    assert allocation.saved_at_calls == {3: [], 4: []}
+
+
+def test_parameter_registers() -> None:
+    # fun f(a: Int, b: Int): Int { return b - a; }
+    instructions: list[Instruction] = [
+        Copy(IRVar("%rdi"), IRVar("X_0")),
+        Copy(IRVar("%rsi"), IRVar("X_1")),
+        Call(IRVar("-"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_2")),
+        Copy(IRVar("X_2"), IRVar("%rax")),
+    ]
+    registers = allocate_registers(instructions).registers
+    # X_0 must not take %rsi before the second parameter has been read from it
+    assert registers[IRVar("X_0")] != "%rsi"
+    assert registers[IRVar("X_1")] != registers[IRVar("X_0")]
+
+
+def test_spilling() -> None:
+    count = len(callee_saved_registers) + len(caller_saved_registers) + 3
+    instructions: list[Instruction] = [
+        LoadIntConst(i, IRVar(f"X_{i}")) for i in range(count)
+    ]
+    total = IRVar(f"X_{count}")
+    instructions.append(Copy(IRVar("X_0"), total))
+    for i in range(1, count):
+        instructions.append(Call(IRVar("+"), [total, IRVar(f"X_{i}")], total))
+    allocation = allocate_registers(instructions)
+    in_registers = [
+        IRVar(f"X_{i}") for i in range(count) if IRVar(f"X_{i}") in allocation.registers
+    ]
+    assert len(in_registers) == len(callee_saved_registers) + len(
+        caller_saved_registers
+    )
+    # The variables read last are the ones left in memory
+    assert IRVar(f"X_{count - 1}") not in allocation.registers
+
+
+def test_color_registers() -> None:
+    allocation = color_registers(code)
+    registers = allocation.registers
+    assert registers[IRVar("X_0")] == "%rbx"
+    assert registers[IRVar("X_2")] == registers[IRVar("X_1")]
+    assert allocation.callee_saved == ["%rbx"]
+
+
+def test_color_registers_spill_costs() -> None:
+    # Eleven variables are live together, and one of them is only read outside the loop
+    count = len(callee_saved_registers) + len(caller_saved_registers) + 1
+    instructions: list[Instruction] = [
+        LoadIntConst(i, IRVar(f"X_{i}")) for i in range(count)
+    ]
+    instructions.append(Label("L_0"))
+    for i in range(1, count):
+        instructions.append(
+            Call(IRVar("+"), [IRVar(f"X_{i}"), IRVar(f"X_{i}")], IRVar(f"X_{i}"))
+        )
+    instructions.append(CondJump(IRVar(f"X_{count - 1}"), Label("L_0"), Label("L_1")))
+    instructions.append(Label("L_1"))
+    instructions.append(Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")))
+    registers = color_registers(instructions).registers
+    assert IRVar("X_0") not in registers
+    assert all(IRVar(f"X_{i}") in registers for i in range(1, count))
+    assert len(set(registers.values())) == count - 1
+
+
+def test_color_registers_profile() -> None:
+    # As above, but with counts in which the code after the loop ran far more often
+    # than the loop, so that a variable used in the loop is the cheapest to spill
+    count = len(callee_saved_registers) + len(caller_saved_registers) + 1
+    before, loop, after = Location(0, 0), Location(1, 0), Location(2, 0)
+    instructions: list[Instruction] = [
+        LoadIntConst(i, IRVar(f"X_{i}"), loc=before) for i in range(count)
+    ]
+    instructions.append(Label("L_0", loc=loop))
+    for i in range(1, count):
+        instructions.append(
+            Call(
+                IRVar("+"),
+                [IRVar(f"X_{i}"), IRVar(f"X_{i}")],
+                IRVar(f"X_{i}"),
+                loc=loop,
+            )
+        )
+    instructions.append(
+        CondJump(IRVar(f"X_{count - 1}"), Label("L_0"), Label("L_1"), loc=loop)
+    )
+    instructions.append(Label("L_1", loc=after))
+    instructions.append(
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit"), loc=after)
+    )
+    profile = Profile({(0, 0): 1, (1, 0): 1, (2, 0): 1000})
+    registers = color_registers(instructions, profile).registers
+    assert IRVar("X_0") in registers
+    assert len(set(registers.values())) == count - 1
+
+
+def test_assign_stack_slots() -> None:
+    slots = assign_stack_slots(code, {IRVar("X_1"): "%rsi"})
+    assert IRVar("X_1") not in slots
+    # X_0 is live until the last call, and the others are never live at the same time
+    assert slots == {
+        IRVar("X_0"): 0,
+        IRVar("X_2"): 1,
+        IRVar("X_3"): 1,
+        IRVar("X_4"): 0,
+    }
+
+    # After loop rotation, X_1 is live in the body before its definition
+    # in the condition below it
+    rotated: list[Instruction] = [
+        LoadIntConst(0, IRVar("X_0")),
+        Jump(Label("L_0")),
+        Label("L_1"),
+        LoadIntConst(3, IRVar("X_2")),
+        Call(IRVar("+"), [IRVar("X_1"), IRVar("X_2")], IRVar("X_3")),
+        Call(IRVar("print_int"), [IRVar("X_3")], IRVar("unit")),
+        Label("L_0"),
+        Call(IRVar("<"), [IRVar("X_0"), IRVar("X_0")], IRVar("X_1")),
+        CondJump(IRVar("X_1"), Label("L_1"), Label("L_2")),
+        Label("L_2"),
+    ]
+    slots = assign_stack_slots(rotated, {})
+    assert slots[IRVar("X_1")] != slots[IRVar("X_2")]
@@ -0,0 +1,96 @@
+from compiler.tail_calls import eliminate_tail_calls
+from compiler.ir import (
+    LoadIntConst,
+    Call,
+    IRVar,
+    CondJump,
+    Label,
+    Jump,
+    Copy,
+    TailCall,
+    Instruction,
+)
+
+# fun sum(n: Int, acc: Int): Int {
+#     if n == 0 then { return acc; }
+#     return sum(n - 1, acc + n);
+# }
+sum_body = [
+    Copy(IRVar("%rdi"), IRVar("X_0")),
+    Copy(IRVar("%rsi"), IRVar("X_1")),
+    LoadIntConst(0, IRVar("X_2")),
+    Call(IRVar("=="), [IRVar("X_0"), IRVar("X_2")], IRVar("X_3")),
+    CondJump(IRVar("X_3"), Label("L_1"), Label("L_2")),
+    Label("L_1"),
+    Copy(IRVar("X_1"), IRVar("%rax")),
+    Jump(Label("L_0")),
+    Label("L_2"),
+    LoadIntConst(1, IRVar("X_4")),
+    Call(IRVar("-"), [IRVar("X_0"), IRVar("X_4")], IRVar("X_5")),
+    Call(IRVar("+"), [IRVar("X_1"), IRVar("X_0")], IRVar("X_6")),
+    Call(IRVar("sum"), [IRVar("X_5"), IRVar("X_6")], IRVar("X_7")),
+    Copy(IRVar("X_7"), IRVar("%rax")),
+    Jump(Label("L_0")),
+    Label("L_0"),
+]
+
+
+def test_self_tail_call() -> None:
+    assert eliminate_tail_calls("sum", sum_body) == [
+        Copy(IRVar("%rdi"), IRVar("X_0")),
+        Copy(IRVar("%rsi"), IRVar("X_1")),
+        Label("sum_start"),
+        *sum_body[2:12],
+        Copy(IRVar("X_5"), IRVar("X_8")),
+        Copy(IRVar("X_6"), IRVar("X_9")),
+        Copy(IRVar("X_8"), IRVar("X_0")),
+        Copy(IRVar("X_9"), IRVar("X_1")),
+        Jump(Label("sum_start")),
+        Label("L_0"),
+    ]
+
+
+def test_self_tail_call_with_unused_parameter() -> None:
+    # The copy of the first parameter was dropped because it is never read
+    body: list[Instruction] = [Copy(IRVar("%rsi"), IRVar("X_1")), *sum_body[2:]]
+    assert eliminate_tail_calls("sum", body) == [
+        Copy(IRVar("%rsi"), IRVar("X_1")),
+        Label("sum_start"),
+        *sum_body[2:12],
+        Copy(IRVar("X_6"), IRVar("X_8")),
+        Copy(IRVar("X_8"), IRVar("X_1")),
+        Jump(Label("sum_start")),
+        Label("L_0"),
+    ]
+
+
+def test_tail_call() -> None:
+    assert eliminate_tail_calls(
+        "f",
+        [
+            Copy(IRVar("%rdi"), IRVar("X_0")),
+            Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+            Call(IRVar("g"), [IRVar("X_0")], IRVar("X_1")),
+            Copy(IRVar("X_1"), IRVar("%rax")),
+            Jump(Label("L_0")),
+            Label("L_0"),
+        ],
+    ) == [
+        Copy(IRVar("%rdi"), IRVar("X_0")),
+        Call(IRVar("print_int"), [IRVar("X_0")], IRVar("unit")),
+        TailCall(IRVar("g"), [IRVar("X_0")]),
+        Label("L_0"),
+    ]
+
+    # The result of the call is not what the function returns
+    not_tail_call: list[Instruction] = [
+        Call(IRVar("g"), [], IRVar("X_1")),
+        Copy(IRVar("X_2"), IRVar("%rax")),
+        Jump(Label("L_0")),
+        Label("L_0"),
+    ]
+    assert eliminate_tail_calls("f", not_tail_call) == not_tail_call
+
+    # The main program must return 0 by itself
+    main: list[Instruction] = [Call(IRVar("g"), [], IRVar("unit"))]
+    assert eliminate_tail_calls("main", main) == main